@@ -0,0 +1,14 @@
+"""
+Vercel entry point.
+
+Vercel serves the Python functions under ``api/``; ``vercel.json`` routes
+every path to this one, which serves ``direct.py``'s app from the read-only
+catalog the build command writes (see catalog_builder.py).
+"""
+import os
+import sys
+
+# The app's modules sit in the project root, one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from direct import app  # noqa: E402,F401
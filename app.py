@@ -7,6 +7,27 @@ from flask import Flask, render_template, request, redirect, url_for, flash, jso
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 
+import bitmap_index
+import catalog_snapshot
+import catalog_sync
+import config
+import facets
+import fuzzy
+import http_cache
+import migrations
+import page_cache
+import pick_list
+import read_replicas
+import readonly_catalog
+import search_api
+import search_cache
+import search_engine
+import shelf_browse
+import single_flight
+import suggest
+import template_cache
+from isbn import to_isbn13
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -15,113 +36,315 @@ logger = logging.getLogger(__name__)
 class Base(DeclarativeBase):
     pass
 
-# Initialize SQLAlchemy with the base class
-db = SQLAlchemy(model_class=Base)
+# Initialize SQLAlchemy with the base class; sessions send read-only requests to replicas
+db = SQLAlchemy(model_class=Base, session_options={"class_": read_replicas.RoutingSession})
 
 # Get the directory where app.py is located
 BASE_DIR = Path(__file__).resolve().parent
-logger.info(f"Base directory: {BASE_DIR}")
-
-# CRITICAL: Handle templates explicitly for Render deployment
-if os.environ.get('RENDER'):
-    logger.info("Running in Render environment, using pre-copied template files")
-    template_dir = os.path.join("/opt/render/project/src", "templates")
-    static_dir = os.path.join("/opt/render/project/src", "static")
-else:
-    logger.info("Running in local environment")
-    template_dir = os.path.join(BASE_DIR, "templates")
-    static_dir = os.path.join(BASE_DIR, "static")
-
-# Log the directories to help with debugging
-logger.info(f"Template directory exists: {os.path.exists(template_dir)}")
-if os.path.exists(template_dir):
-    template_files = os.listdir(template_dir)
-    logger.info(f"Template files: {template_files}")
-else:
-    logger.error(f"Template directory NOT FOUND: {template_dir}")
-
-# Create the Flask application with explicit template folder
-app = Flask(__name__, 
-            template_folder=template_dir,
-            static_folder=static_dir)
-
-# Log important paths to help with debugging
-logger.info(f"Current working directory: {os.getcwd()}")
-logger.info(f"Template directory: {template_dir}")
-logger.info(f"Static directory: {static_dir}")
-
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 
-# Configure database connection
-database_url = os.environ.get("DATABASE_URL", "sqlite:///library.db")
-# Fix for PostgreSQL URL format for Render deployment
-if database_url and database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
-app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Initialize the application with Flask-SQLAlchemy
-db.init_app(app)
-
-# Import routes and models after initializing db to avoid circular imports
-with app.app_context():
-    # Import models
-    from models import Book
+def create_app(config_object=None):
+    """
+    Create and configure the Flask application.
+    
+    ``config_object`` (a class such as ``config.TestingConfig``, or its import
+    path) overrides the defaults of ``config.Config``, which are read from
+    the environment. Startup does no
+    filesystem or table scans of its own: the schema is checked with a single
+    query (see ``migrations.ensure_schema``), and an existing catalog is
+    seeded only on request, with ``flask seed``. The in-memory indexes are
+    built on first use, or ahead of it by ``lazy_index.warm_up(app)``.
+    """
+    # CRITICAL: Handle templates explicitly for Render deployment
+    if os.environ.get('RENDER'):
+        template_dir = os.path.join("/opt/render/project/src", "templates")
+        static_dir = os.path.join("/opt/render/project/src", "static")
+    else:
+        template_dir = os.path.join(BASE_DIR, "templates")
+        static_dir = os.path.join(BASE_DIR, "static")
+    
+    # Create the Flask application with explicit template folder
+    app = Flask(__name__, 
+                template_folder=template_dir,
+                static_folder=static_dir)
+    logger.info(f"Template directory: {template_dir}, static directory: {static_dir}")
+    
+    # Defaults from the environment (see config.py), then the caller's overrides
+    app.config.from_object(config.Config)
+    if config_object is not None:
+        app.config.from_object(config_object)
+    app.config["SQLALCHEMY_BINDS"] = read_replicas.replica_binds(app.config["DATABASE_READ_URLS"])
+    readonly_catalog.configure(app)
     
-    # Create all database tables
-    db.create_all()
+    # Initialize the application with Flask-SQLAlchemy
+    db.init_app(app)
+    readonly_catalog.init_app(app, db)
     
-    # Check if the database needs to be seeded with initial data
-    if Book.query.count() == 0:
+    # Import models after initializing db to avoid circular imports
+    with app.app_context():
+        from models import Book
         from seed_data import seed_database
-        seed_database()
-        app.logger.info("Database seeded with initial book data.")
-
-# Routes
-@app.route('/')
-def index():
-    """Render the main page with search functionality."""
-    return render_template('index.html')
-
-@app.route('/search', methods=['GET', 'POST'])
-def search():
-    """Handle search requests and display results."""
-    search_query = request.args.get('query', '') if request.method == 'GET' else request.form.get('query', '')
-    
-    if not search_query:
-        flash('Please enter a search term.', 'warning')
-        return redirect(url_for('index'))
-    
-    # Search for books by title, author, or ISBN
-    from models import Book
-    books = Book.query.filter(
-        (Book.title.ilike(f'%{search_query}%')) | 
-        (Book.author.ilike(f'%{search_query}%')) | 
-        (Book.isbn.ilike(f'%{search_query}%'))
-    ).all()
-    
-    return render_template('search_results.html', books=books, query=search_query)
-
-@app.route('/book/<int:book_id>')
-def book_details(book_id):
-    """Display detailed information about a specific book."""
-    from models import Book
-    book = Book.query.get_or_404(book_id)
-    return render_template('book_details.html', book=book)
-
-@app.errorhandler(404)
-def page_not_found(e):
-    """Handle 404 errors."""
-    return render_template('error.html', error="Page not found"), 404
+        migrations.init_app(app, db, Book, seed=seed_database)
+        
+        # Create tables and apply migrations unless this schema is already in place
+        migrations.ensure_schema(db, Book, migrate_on_start=app.config["MIGRATE_ON_START"],
+                                 seed=seed_database)
+    
+    # Replay other processes' changes into the in-process indexes registered below
+    catalog_sync.init_app(app, db, Book)
+    
+    # Set up the full-text search backend for the configured database, and the
+    # result cache in front of it
+    search_engine.init_app(app, db, Book)
+    search_cache.init_app(app, Book)
+    
+    # Rendered book pages, keyed on the row version
+    page_cache.init_app(app, Book)
+    
+    # Read-only requests go to the read replicas, if any are configured
+    read_replicas.init_app(app, db)
+    
+    # Identical concurrent searches share one execution
+    single_flight.init_app(app, Book)
+    
+    # Relevance ranking of search candidates
+    if app.config["SEARCH_RANKING"] == "bm25":
+        import ranking
+        ranking.init_app(app, db, Book)
+    
+    # In-memory prefix index behind the search box suggestions
+    suggest.init_app(app, db, Book)
+    
+    # Typo-tolerant index used when a search finds few results
+    fuzzy.init_app(app, db, Book)
+    
+    # Facet counts for the search filter bar
+    facets.init_app(app, Book)
+    
+    # Bitsets per status, category, shelf, column and row for filter-only lookups
+    bitmap_index.init_app(app, db, Book)
+    
+    # Walking routes for pick lists
+    pick_list.init_app(app)
+    
+    # Columnar in-memory copy of the catalog behind search results and book details
+    if app.config["CATALOG_SNAPSHOT"]:
+        catalog_snapshot.init_app(app, db, Book)
+    
+    # Template bytecode cache, and compiling every template before the first request
+    template_cache.init_app(app)
+    
+    # ETag, Last-Modified and Cache-Control of book and search pages, and the catalog generation
+    http_cache.init_app(app, db, Book)
+    
+    # Routes
+    @app.route('/')
+    def index():
+        """Render the main page with search functionality."""
+        return render_template('index.html')
+    
+    @app.route('/search', methods=['GET', 'POST'])
+    def search():
+        """Handle search requests and display results."""
+        search_query = request.args.get('query', '') if request.method == 'GET' else request.form.get('query', '')
+        
+        if not search_query:
+            flash('Please enter a search term.', 'warning')
+            return redirect(url_for('index'))
+        
+        # ISBN-shaped queries are resolved with one lookup on the unique index
+        canonical = to_isbn13(search_query)
+        if canonical:
+            book = Book.query.filter_by(isbn=canonical).first()
+            if book:
+                return redirect(url_for('book_details', book_id=book.id))
+        
+        suggest.get_suggest_index().record_search(search_query)
+        
+        # Answer 304 without searching when the client has this page of the current catalog
+        caching = http_cache.get_http_cache()
+        catalog = caching.catalog_state(db.session)
+        validators = caching.catalog_validators(catalog)
+        caching.abort_if_current(validators)
+        generation = catalog[0] if catalog is not None else None
+        
+        # Search for books by title, author, or ISBN, one page at a time
+        cursor = request.values.get('after')
+        page_size = app.config["SEARCH_PAGE_SIZE"]
+        filters = facets.parse_filters(request.values)
+        page = search_cache.get_search_cache().get_or_set(
+            search_cache.cache_key(search_query, after=cursor, page_size=page_size,
+                                   generation=generation, **filters),
+            lambda: search_engine.get_search_engine().paginate(
+                search_query,
+                cursor=cursor,
+                page_size=page_size,
+                count_cap=app.config["SEARCH_COUNT_CAP"],
+                summaries=True,
+                filters=filters
+            )
+        )
+        
+        # Category, status and shelf counts for the filter bar
+        facet_counts = search_cache.get_search_cache().get_or_set(
+            search_cache.cache_key(search_query, facets=True, generation=generation, **filters),
+            lambda: search_engine.get_search_engine().facets(search_query, filters)
+        )
+        
+        # Fall back to typo-tolerant matching when the search finds little
+        close_books = []
+        if not cursor and not filters and page.total < app.config["FUZZY_MIN_RESULTS"]:
+            close_books = fuzzy.close_matches(
+                fuzzy.get_fuzzy_index(), Book, search_query,
+                exclude_ids=[book.id for book in page.items],
+                limit=page_size
+            )
+        
+        return caching.respond(render_template(
+            'search_results.html', books=page.items, page=page,
+            close_books=close_books, query=search_query, filters=filters,
+            facets=facets.facet_groups(facet_counts, filters, Book.STATUS_CHOICES)
+        ), validators)
+    
+    @app.route('/book/<int:book_id>')
+    def book_details(book_id):
+        """Display detailed information about a specific book, from the page cache when it can."""
+        caching = http_cache.get_http_cache()
+        
+        def render_page():
+            snapshot = catalog_snapshot.get_catalog_snapshot()
+            book = snapshot.get(book_id) if snapshot is not None else None
+            if book is None:
+                book = Book.query.get_or_404(book_id)
+            previous_book, next_book = shelf_browse.neighbors(Book, book)
+            # Answer 304 without rendering when the client has this version of the page
+            validators = caching.book_validators(book, (previous_book, next_book))
+            caching.abort_if_current(validators)
+            page = render_template('book_details.html', book=book,
+                                   previous_book=previous_book, next_book=next_book)
+            return (page, validators), book, (previous_book, next_book)
+        
+        page, validators = page_cache.get_page_cache().get_or_render('book_details', book_id, render_page)
+        return caching.respond(page, validators)
+    
+    @app.route('/api/search')
+    def api_search():
+        """Stream search matches as NDJSON or a JSON array."""
+        return search_api.stream_search(
+            search_engine.get_search_engine(),
+            request.args.get('query', ''),
+            fields=request.args.get('fields'),
+            output_format=request.args.get('format', 'ndjson'),
+            limit=request.args.get('limit'),
+            max_limit=app.config["SEARCH_API_MAX_LIMIT"]
+        )
+    
+    @app.route('/api/facets')
+    def api_facets():
+        """Return category, status and shelf counts for a search, or for the whole catalog."""
+        search_query = request.args.get('query', '')
+        filters = facets.parse_filters(request.args)
+        if search_query:
+            counts = search_engine.get_search_engine().facets(search_query, filters)
+        elif filters:
+            counts = bitmap_index.get_bitmap_index().facet_counts(facets.FACET_NAMES, filters)
+        else:
+            counts = facets.get_catalog_facets().counts()
+        return jsonify(facets={
+            name: [{'value': value, 'count': count} for value, count in values]
+            for name, values in counts.items()
+        })
+    
+    @app.route('/api/books')
+    def api_books():
+        """Return a page of books matching status, category, shelf, column and row filters."""
+        after, error = bitmap_index.parse_after(request.args.get('after'))
+        if error:
+            return jsonify(error), 400
+        limit = min(request.args.get('limit', app.config["SEARCH_PAGE_SIZE"], type=int), 100)
+        total, records, next_after = bitmap_index.browse(
+            bitmap_index.get_bitmap_index(), Book,
+            bitmap_index.parse_filters(request.args),
+            after=after,
+            limit=max(limit, 1)
+        )
+        return jsonify(total=total, results=records, next=next_after)
+    
+    @app.route('/shelf/<shelf>')
+    def shelf_view(shelf):
+        """List the books on a shelf in physical order, optionally one column."""
+        column = request.args.get('column')
+        page = shelf_browse.shelf_page(
+            Book, shelf, column,
+            cursor=request.args.get('after'),
+            page_size=app.config["SEARCH_PAGE_SIZE"],
+            count_cap=app.config["SEARCH_COUNT_CAP"]
+        )
+        column_counts = db.session.execute(shelf_browse.column_counts_statement(Book, shelf)).all()
+        return render_template('shelf.html', shelf=shelf, column=column, page=page,
+                               books=page.items, column_counts=column_counts)
+    
+    @app.route('/api/shelf/<shelf>')
+    def api_shelf(shelf):
+        """Return a page of the books on a shelf in physical order, with per-column counts."""
+        column = request.args.get('column')
+        limit = min(request.args.get('limit', app.config["SEARCH_PAGE_SIZE"], type=int), 100)
+        page = shelf_browse.shelf_page(
+            Book, shelf, column,
+            cursor=request.args.get('after'),
+            page_size=max(limit, 1),
+            count_cap=app.config["SEARCH_COUNT_CAP"]
+        )
+        column_counts = db.session.execute(shelf_browse.column_counts_statement(Book, shelf)).all()
+        return jsonify(shelf_browse.shelf_payload(shelf, column, page, column_counts))
+    
+    @app.route('/api/pick-list', methods=['GET', 'POST'])
+    def api_pick_list():
+        """Return the requested books in the order of a short walk through the stacks."""
+        ids, isbns, error = pick_list.parse_request(
+            request.args, request.get_json(silent=True), app.config["PICK_LIST_MAX_STOPS"]
+        )
+        if error:
+            return jsonify(error), 400
+        rows = db.session.execute(pick_list.lookup_statement(Book, ids, isbns)).all()
+        books, missing = pick_list.resolve(Book, rows, ids, isbns)
+        route = pick_list.plan_route(pick_list.get_floor_plan(), books)
+        return jsonify(pick_list.route_payload(route, missing))
+    
+    @app.route('/api/suggest')
+    def suggest_completions():
+        """Return title and author completions for a search-box prefix."""
+        prefix = request.args.get('prefix', '')
+        limit = min(request.args.get('limit', app.config["SUGGEST_LIMIT"], type=int), suggest.MAX_SUGGESTIONS)
+        completions = suggest.get_suggest_index().suggest(prefix, max(limit, 1))
+        return jsonify(
+            prefix=prefix,
+            suggestions=[{'text': text, 'type': field} for field, text in completions]
+        )
+    
+    @app.route('/api/stats')
+    def stats():
+        """Report cache, coalescing and read replica counters as JSON."""
+        return jsonify(
+            search_cache=search_cache.get_search_cache().stats(),
+            page_cache=page_cache.get_page_cache().stats(),
+            single_flight=single_flight.get_single_flight().stats(),
+            read_replicas=read_replicas.replica_stats()
+        )
+    
+    @app.errorhandler(404)
+    def page_not_found(e):
+        """Handle 404 errors."""
+        return render_template('error.html', error="Page not found"), 404
+    
+    @app.errorhandler(500)
+    def server_error(e):
+        """Handle 500 errors."""
+        return render_template('error.html', error="Internal server error"), 500
+    
+    return app
 
-@app.errorhandler(500)
-def server_error(e):
-    """Handle 500 errors."""
-    return render_template('error.html', error="Internal server error"), 500
+# The application instance used by main.py, wsgi servers and asgi.py
+app = create_app()
 
 # Run the application
 if __name__ == '__main__':
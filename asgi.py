@@ -0,0 +1,604 @@
+"""
+ASGI entry point for the read paths.
+
+Serves the home page, search results, book details, shelf listings and the
+JSON APIs from Starlette with an async SQLAlchemy engine (aiosqlite for
+SQLite, asyncpg for PostgreSQL), so a slow query parks a coroutine instead of
+blocking a worker. Queries are built by the same search engine, facet,
+pagination and shelf code as app.py, rendered with the same templates, and
+only executed asynchronously. The in-process indexes (suggestions, fuzzy
+matches, bitmaps, the catalog snapshot) are the ones app.py registers, built
+in a worker thread at startup (see lazy_index.py). Lookups in them that cost
+CPU time, like n-gram matching and ranking, run in the thread pool so they
+don't hold up the event loop. Other processes' changes are followed through
+catalog_sync.py: an async task reads the catalog generation every
+``CATALOG_SYNC_INTERVAL`` seconds and hands the replay to a worker thread
+only when it has moved.
+
+Reads all go to the primary, so the app refuses to start with read replicas
+configured (``DATABASE_READ_URLS``); serve app.py to use them.
+
+Run with ``uvicorn asgi:app`` (or gunicorn with ``-k uvicorn.workers.UvicornWorker``).
+"""
+import asyncio
+import contextlib
+import logging
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from jinja2 import Environment, select_autoescape
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+import bitmap_index
+import catalog_generation
+import facets
+import fuzzy
+import http_cache
+import lazy_index
+import pagination
+import pick_list
+import projection
+import search_api
+import search_cache
+import shelf_browse
+import suggest
+import template_cache
+from app import app as flask_app, db
+from isbn import to_isbn13
+from models import Book
+
+logger = logging.getLogger(__name__)
+# app.py logs at DEBUG, where aiosqlite reports every operation
+logging.getLogger('aiosqlite').setLevel(logging.INFO)
+
+# Async driver for each database backend
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    """Return the async-driver form of a database URL."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    url = url.set(drivername=ASYNC_DRIVERS.get(backend, url.drivername))
+    if backend == 'postgresql' and 'sslmode' in url.query:
+        # asyncpg spells libpq's sslmode as ssl
+        query = dict(url.query)
+        query['ssl'] = query.pop('sslmode')
+        url = url.set(query=query)
+    return url
+
+
+config = flask_app.config
+search = flask_app.extensions['search_engine']
+caching = flask_app.extensions['http_cache']
+sync = flask_app.extensions.get('catalog_sync')
+snapshot = flask_app.extensions.get('catalog_snapshot')
+
+if flask_app.extensions.get('read_replicas') is not None:
+    # Queries run on one async engine for the primary; see app.py for replica routing
+    raise RuntimeError("asgi.py doesn't read from DATABASE_READ_URLS; unset it or serve app.py")
+
+with flask_app.app_context():
+    # db.engine.url has relative SQLite paths resolved to the instance folder
+    database_url = db.engine.url
+
+engine = create_async_engine(
+    async_database_url(database_url),
+    pool_size=config["ASYNC_POOL_SIZE"],
+    max_overflow=config["ASYNC_MAX_OVERFLOW"],
+    pool_recycle=300,
+    pool_pre_ping=True,
+)
+search.attach(engine.sync_engine)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+logger.info(f"ASGI read paths using {engine.url.drivername} with {search.name} search")
+
+
+def _in_app_context(func, *args):
+    with flask_app.app_context():
+        return func(*args)
+
+
+async def matches(query, filters=None):
+    """
+    Return ``SearchEngine.matches`` for the search text; only builds queries, never runs them.
+
+    Building them can look the text up in the n-gram or fuzzy indexes, which
+    is CPU work, so it runs in the thread pool.
+    """
+    return await run_in_threadpool(_in_app_context, search.matches, query, filters)
+
+
+async def ranking(conn, query, filters, books, sort_keys):
+    """Async counterpart of ``SearchEngine.ranking``."""
+    # Rankings made before the statistics are loaded aren't kept
+    key = search.ranking_key(query, filters) if search.rankings is not None and search.ranker.ready() else None
+    value = search.rankings.get(key) if key is not None else None
+    if value is None:
+        rows = (await conn.execute(search.candidates(books, sort_keys).statement)).all()
+        # Scoring is CPU work, so keep it off the event loop
+        value = await run_in_threadpool(search.rank_candidates, query, rows)
+        if key is not None:
+            search.rankings.set(key, value)
+    return value
+
+
+async def build(conn, query, filters=None, limit=None):
+    """Async counterpart of ``SearchEngine.build``: ``(books, sort_keys)`` with ranking applied."""
+    if search.ranks_in_memory:
+        # Ranking the matches is CPU work, so keep it off the event loop
+        return await run_in_threadpool(_in_app_context, search.build, query, filters, limit)
+    books, sort_keys = await matches(query, filters)
+    if search.ranker is not None:
+        sort_keys = search.rank_keys((await ranking(conn, query, filters, books, sort_keys)).ids)
+    return books, sort_keys
+
+
+async def keyset_page(conn, books, sort_keys, cursor, page_size, count_cap):
+    """Return a keyset pagination.Page of BookSummary records, from the catalog snapshot if there is one."""
+    count = (await conn.execute(pagination.capped_count_statement(books, count_cap))).scalar()
+    if snapshot is not None:
+        columns, make_item = [Book.id], lambda row: row[0]
+    else:
+        columns, make_item = projection.list_columns(Book), projection.summary_factory(Book)
+    page_query, width = pagination.keyset_query(books, sort_keys, cursor, page_size, columns)
+    rows = (await conn.execute(page_query.statement)).all()
+    page = pagination.make_page(rows, width, page_size, count, count_cap, make_item)
+    if snapshot is not None:
+        page.items = await summaries(page.items)
+    return page
+
+
+async def search_page(query, cursor, page_size, count_cap, filters):
+    """Return a pagination.Page of BookSummary records, as ``SearchEngine.paginate`` does."""
+    if search.ranks_in_memory:
+        ids, next_token, count = await run_in_threadpool(
+            _in_app_context, search.page_ids, query, cursor, page_size, filters
+        )
+        return pagination.Page(await summaries(ids), next_token, min(count, count_cap), count > count_cap)
+    books, sort_keys = await matches(query, filters)
+    async with engine.connect() as conn:
+        if search.ranker is None:
+            return await keyset_page(conn, books, sort_keys, cursor, page_size, count_cap)
+        ranked = await ranking(conn, query, filters, books, sort_keys)
+        ids, next_token, rest_token, rest_size = search.ranked_slice(ranked, cursor, page_size)
+        items = await summaries(ids, conn)
+        if rest_token is not None:
+            page = await keyset_page(conn, books, sort_keys, rest_token, rest_size, count_cap)
+            page.items = items + page.items
+            return page
+        if ranked.rest is None:
+            count = len(ranked.ids)
+        else:
+            count = (await conn.execute(pagination.capped_count_statement(books, count_cap))).scalar()
+    return pagination.Page(items, next_token, min(count, count_cap), count > count_cap)
+
+
+async def search_facets(query, filters):
+    """Return facet counts for the matches of ``query``, as ``SearchEngine.facets`` does."""
+    books, _ = await matches(query, filters)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(facets.facet_counts_query(books, Book).statement)).all()
+    return facets.tally_facets(rows)
+
+
+async def summaries(ids, conn=None):
+    """Return BookSummary records for ``ids``, in the order given, from the catalog snapshot if there is one."""
+    if not ids:
+        return []
+    if snapshot is not None:
+        # Books the snapshot is missing are read from the database
+        return await run_in_threadpool(_in_app_context, snapshot.summaries, ids)
+    if conn is None:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(projection.summaries_by_id(Book, ids))).all()
+    else:
+        rows = (await conn.execute(projection.summaries_by_id(Book, ids))).all()
+    make_summary = projection.summary_factory(Book)
+    return [make_summary(row) for row in rows]
+
+
+async def shelf_listing(shelf, column, cursor, page_size):
+    """Return a shelf's pagination.Page of BookSummary records and its per-column counts."""
+    count_cap = config["SEARCH_COUNT_CAP"]
+    with flask_app.app_context():
+        books = shelf_browse.shelf_query(Book, shelf, column)
+    async with engine.connect() as conn:
+        page = await keyset_page(conn, books, shelf_browse.order_keys(Book), cursor, page_size, count_cap)
+        column_counts = (await conn.execute(shelf_browse.column_counts_statement(Book, shelf))).all()
+    return page, column_counts
+
+
+async def shelf_neighbors(book):
+    """Return the BookSummary records before and after ``book`` on its shelf, as shelf_browse.neighbors does."""
+    make_summary = projection.summary_factory(Book)
+    async with engine.connect() as conn:
+        rows = [(await conn.execute(statement)).first()
+                for statement in shelf_browse.neighbor_statements(Book, book)]
+    return tuple(make_summary(row) if row is not None else None for row in rows)
+
+
+async def catalog_state():
+    """Return the catalog's ``(generation, changed_at)``, as ``HttpCache.catalog_state`` does."""
+    if not caching.catalog:
+        return None
+    try:
+        async with engine.connect() as conn:
+            row = (await conn.execute(catalog_generation.state_statement())).first()
+    except SQLAlchemyError as e:
+        logger.warning(f"Catalog generation unavailable: {e}")
+        return None
+    return tuple(row) if row is not None else None
+
+
+async def cached(key, compute):
+    """Async counterpart of ``SearchCache.get_or_set``, coalescing identical concurrent misses."""
+    cache = flask_app.extensions['search_cache']
+
+    async def compute_and_set():
+        value = await compute()
+        cache.set(key, value)
+        return value
+
+    value = cache.get(key)
+    if value is None:
+        value = await flask_app.extensions['single_flight'].do_async(key, compute_and_set)
+    return value
+
+
+def int_arg(args, name, default=None):
+    """Return a query-string argument as an int, or ``default`` if missing or malformed."""
+    try:
+        return int(args[name])
+    except (KeyError, ValueError):
+        return default
+
+
+# Templates
+
+# Shares the Flask app's bytecode cache (see template_cache.py): compiled once, by whichever loads a template first
+templates = Environment(loader=flask_app.jinja_loader, autoescape=select_autoescape(),
+                        bytecode_cache=flask_app.jinja_env.bytecode_cache)
+
+
+def url_for(endpoint, **values):
+    """Build a URL like Flask's url_for: path parameters fill the route, the rest become the query string."""
+    if endpoint == 'static':
+        values['path'] = values.pop('filename')
+    path_params = {name: values.pop(name) for name in ROUTE_PARAMS.get(endpoint, ()) if name in values}
+    url = str(app.url_path_for(endpoint, **path_params))
+    query = {name: value for name, value in values.items() if value is not None}
+    return f"{url}?{urlencode(query)}" if query else url
+
+
+templates.globals['url_for'] = url_for
+
+
+def render(request, template_name, status_code=200, messages=(), **context):
+    """
+    Render one of the app's templates.
+
+    ``messages`` are ``(category, message)`` pairs shown where Flask would
+    show flashed messages.
+    """
+    def get_flashed_messages(with_categories=False):
+        return list(messages) if with_categories else [message for category, message in messages]
+
+    html = templates.get_template(template_name).render(
+        request=SimpleNamespace(args=request.query_params),
+        get_flashed_messages=get_flashed_messages,
+        **context
+    )
+    return HTMLResponse(html, status_code=status_code)
+
+
+def not_modified(request, validators):
+    """Return a 304 response if the request holds the current copy of a page with ``validators``, else None."""
+    if (validators is not None and request.method in http_cache.CONDITIONAL_METHODS
+            and http_cache.is_current(request.headers, validators)):
+        return Response(status_code=304, headers=caching.headers(validators))
+    return None
+
+
+def json_response(payload, status_code=200):
+    return Response(search_api.dumps(payload), status_code=status_code, media_type='application/json')
+
+
+# Routes
+
+async def index(request):
+    """Render the main page with search functionality."""
+    return render(request, 'index.html')
+
+
+async def search_results(request):
+    """Handle search requests and display results."""
+    args = request.query_params
+    search_query = args.get('query', '')
+
+    if not search_query:
+        return render(request, 'index.html', messages=[('warning', 'Please enter a search term.')])
+
+    # ISBN-shaped queries are resolved with one lookup on the unique index
+    canonical = to_isbn13(search_query)
+    if canonical:
+        async with engine.connect() as conn:
+            book_id = (await conn.execute(select(Book.id).where(Book.isbn == canonical))).scalar()
+        if book_id is not None:
+            return RedirectResponse(url_for('book_details', book_id=book_id), status_code=302)
+
+    flask_app.extensions['suggest_index'].record_search(search_query)
+
+    # Answer 304 without searching when the client has this page of the current catalog
+    catalog = await catalog_state()
+    validators = caching.catalog_validators(catalog)
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    generation = catalog[0] if catalog is not None else None
+
+    cursor = args.get('after')
+    page_size = config["SEARCH_PAGE_SIZE"]
+    filters = facets.parse_filters(args)
+    page = await cached(
+        search_cache.cache_key(search_query, after=cursor, page_size=page_size,
+                               generation=generation, **filters),
+        lambda: search_page(search_query, cursor, page_size, config["SEARCH_COUNT_CAP"], filters)
+    )
+    facet_counts = await cached(
+        search_cache.cache_key(search_query, facets=True, generation=generation, **filters),
+        lambda: search_facets(search_query, filters)
+    )
+
+    # Fall back to typo-tolerant matching when the search finds little
+    close_books = []
+    if not cursor and not filters and page.total < config["FUZZY_MIN_RESULTS"]:
+        close_books = await summaries(await run_in_threadpool(
+            fuzzy.close_match_ids, flask_app.extensions['fuzzy_index'], search_query,
+            [book.id for book in page.items], page_size
+        ))
+
+    response = render(request, 'search_results.html', books=page.items, page=page,
+                      close_books=close_books, query=search_query, filters=filters,
+                      facets=facets.facet_groups(facet_counts, filters, Book.STATUS_CHOICES))
+    response.headers.update(caching.headers(validators))
+    return response
+
+
+async def book_details(request):
+    """Display detailed information about a specific book, from the page cache when it can."""
+    book_id = request.path_params['book_id']
+    pages = flask_app.extensions['page_cache']
+    cached_page = pages.get('book_details', book_id)
+    if cached_page is not None:
+        page, validators = cached_page
+        return not_modified(request, validators) or HTMLResponse(page, headers=caching.headers(validators))
+    since = pages.changes
+    book = None
+    if snapshot is not None:
+        book = await run_in_threadpool(_in_app_context, snapshot.get, book_id)
+    if book is None:
+        async with Session() as session:
+            book = await session.get(Book, book_id)
+    if book is None:
+        raise HTTPException(status_code=404)
+    previous_book, next_book = await shelf_neighbors(book)
+    # Answer 304 without rendering when the client has this version of the page
+    validators = caching.book_validators(book, (previous_book, next_book))
+    response = not_modified(request, validators)
+    if response is not None:
+        return response
+    response = render(request, 'book_details.html', book=book,
+                      previous_book=previous_book, next_book=next_book)
+    response.headers.update(caching.headers(validators))
+    pages.put('book_details', book, (response.body.decode(), validators), (previous_book, next_book), since)
+    return response
+
+
+async def shelf_view(request):
+    """List the books on a shelf in physical order, optionally one column."""
+    shelf = request.path_params['shelf']
+    column = request.query_params.get('column')
+    page, column_counts = await shelf_listing(
+        shelf, column, request.query_params.get('after'), config["SEARCH_PAGE_SIZE"]
+    )
+    return render(request, 'shelf.html', shelf=shelf, column=column, page=page,
+                  books=page.items, column_counts=column_counts)
+
+
+async def api_shelf(request):
+    """Return a page of the books on a shelf in physical order, with per-column counts."""
+    args = request.query_params
+    shelf = request.path_params['shelf']
+    limit = min(int_arg(args, 'limit', config["SEARCH_PAGE_SIZE"]), 100)
+    page, column_counts = await shelf_listing(shelf, args.get('column'), args.get('after'), max(limit, 1))
+    return json_response(shelf_browse.shelf_payload(shelf, args.get('column'), page, column_counts))
+
+
+async def api_search(request):
+    """Stream search matches as NDJSON or a JSON array."""
+    args = request.query_params
+    search_query = args.get('query', '')
+    output_format = args.get('format', 'ndjson')
+    fields, error = search_api.check_request(search_query, args.get('fields'), output_format)
+    if not error:
+        limit, error = search_api.parse_limit(args.get('limit'), config["SEARCH_API_MAX_LIMIT"])
+    if error:
+        return json_response(error, 400)
+
+    async def records():
+        async with engine.connect() as conn:
+            books, sort_keys = await build(conn, search_query, limit=limit)
+            books = (books.with_entities(*(getattr(Book, field) for field in fields))
+                     .order_by(*sort_keys).limit(limit))
+            result = await conn.stream(books.statement)
+            async for rows in result.partitions(search_api.STREAM_BATCH_SIZE):
+                for row in rows:
+                    yield dict(zip(fields, row))
+
+    async def ndjson():
+        async for record in records():
+            yield search_api.dumps(record) + b'\n'
+
+    async def json_array():
+        yield b'{"results":['
+        first = True
+        async for record in records():
+            if not first:
+                yield b','
+            first = False
+            yield search_api.dumps(record)
+        yield b']}'
+
+    if output_format == 'ndjson':
+        return StreamingResponse(ndjson(), media_type='application/x-ndjson')
+    return StreamingResponse(json_array(), media_type='application/json')
+
+
+async def api_facets(request):
+    """Return category, status and shelf counts for a search, or for the whole catalog."""
+    search_query = request.query_params.get('query', '')
+    filters = facets.parse_filters(request.query_params)
+    if search_query:
+        counts = await search_facets(search_query, filters)
+    else:
+        counts = flask_app.extensions['bitmap_index'].facet_counts(facets.FACET_NAMES, filters)
+    return json_response({'facets': {
+        name: [{'value': value, 'count': count} for value, count in values]
+        for name, values in counts.items()
+    }})
+
+
+async def api_books(request):
+    """Return a page of books matching status, category, shelf, column and row filters."""
+    args = request.query_params
+    after, error = bitmap_index.parse_after(args.get('after'))
+    if error:
+        return json_response(error, 400)
+    limit = min(int_arg(args, 'limit', config["SEARCH_PAGE_SIZE"]), 100)
+    total, ids, next_after = bitmap_index.browse_ids(
+        flask_app.extensions['bitmap_index'],
+        bitmap_index.parse_filters(args),
+        after=after,
+        limit=max(limit, 1)
+    )
+    records = [{field: getattr(book, field) for field in projection.LIST_FIELDS}
+               for book in await summaries(ids)]
+    return json_response({'total': total, 'results': records, 'next': next_after})
+
+
+async def api_pick_list(request):
+    """Return the requested books in the order of a short walk through the stacks."""
+    body = None
+    if request.method == 'POST':
+        with contextlib.suppress(ValueError):
+            body = await request.json()
+    ids, isbns, error = pick_list.parse_request(request.query_params, body, config["PICK_LIST_MAX_STOPS"])
+    if error:
+        return json_response(error, 400)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(pick_list.lookup_statement(Book, ids, isbns))).all()
+    books, missing = pick_list.resolve(Book, rows, ids, isbns)
+    route = pick_list.plan_route(flask_app.extensions['floor_plan'], books)
+    return json_response(pick_list.route_payload(route, missing))
+
+
+async def suggest_completions(request):
+    """Return title and author completions for a search-box prefix."""
+    prefix = request.query_params.get('prefix', '')
+    limit = min(int_arg(request.query_params, 'limit', config["SUGGEST_LIMIT"]), suggest.MAX_SUGGESTIONS)
+    completions = flask_app.extensions['suggest_index'].suggest(prefix, max(limit, 1))
+    return json_response({
+        'prefix': prefix,
+        'suggestions': [{'text': text, 'type': field} for field, text in completions],
+    })
+
+
+async def stats(request):
+    """Report cache, coalescing and read replica counters as JSON."""
+    replicas = flask_app.extensions.get('read_replicas')
+    return json_response({
+        'search_cache': flask_app.extensions['search_cache'].stats(),
+        'page_cache': flask_app.extensions['page_cache'].stats(),
+        'single_flight': flask_app.extensions['single_flight'].stats(),
+        'read_replicas': replicas.stats() if replicas is not None else [],
+    })
+
+
+async def http_error(request, exc):
+    if exc.status_code == 404:
+        return render(request, 'error.html', 404, error="Page not found")
+    return render(request, 'error.html', exc.status_code, error=exc.detail)
+
+
+async def server_error(request, exc):
+    return render(request, 'error.html', 500, error="Internal server error")
+
+
+async def follow_catalog(sync):
+    """Replay other processes' catalog changes, reading the generation on the event loop (see catalog_sync.py)."""
+    while True:
+        await asyncio.sleep(sync.interval)
+        try:
+            state = await catalog_state()
+            if state is None:
+                continue
+            if sync.behind(state) or sync.prune_due:
+                await run_in_threadpool(_in_app_context, sync.maintain, state)
+            else:
+                # Only notes the time of the check; no query
+                sync.check(state)
+        except Exception as e:
+            logger.error(f"Catalog sync failed: {e}")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(lazy_index.warm_up, flask_app)
+    if config.get('TEMPLATE_PRECOMPILE'):
+        await run_in_threadpool(template_cache.precompile_environment, templates)
+    # One task per process, started here since the event loop is the worker's own
+    follower = asyncio.create_task(follow_catalog(sync)) if sync is not None and sync.interval > 0 else None
+    yield
+    if follower is not None:
+        follower.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await follower
+    await engine.dispose()
+
+
+routes = [
+    Route('/', index, name='index'),
+    Route('/search', search_results, name='search'),
+    Route('/book/{book_id:int}', book_details, name='book_details'),
+    Route('/api/search', api_search, name='api_search'),
+    Route('/api/facets', api_facets, name='api_facets'),
+    Route('/shelf/{shelf}', shelf_view, name='shelf_view'),
+    Route('/api/books', api_books, name='api_books'),
+    Route('/api/shelf/{shelf}', api_shelf, name='api_shelf'),
+    Route('/api/pick-list', api_pick_list, methods=['GET', 'POST'], name='api_pick_list'),
+    Route('/api/suggest', suggest_completions, name='suggest_completions'),
+    Route('/api/stats', stats, name='stats'),
+    Mount('/static', StaticFiles(directory=flask_app.static_folder, check_dir=False), name='static'),
+]
+
+# Path parameters of each named route, for url_for
+ROUTE_PARAMS = {route.name: tuple(route.param_convertors) for route in routes}
+
+app = Starlette(
+    routes=routes,
+    exception_handlers={HTTPException: http_error, 500: server_error},
+    lifespan=lifespan,
+)
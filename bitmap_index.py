@@ -0,0 +1,233 @@
+"""
+In-memory bitmap index over the low-cardinality Book columns.
+
+Each distinct value of status, category, shelf, column and row gets a bitset
+(a Python int with bit ``n`` set for book id ``n``). A filter such as
+"available Fiction books on shelf B1" is the AND of three bitsets, counts are
+``int.bit_count()``, and only the ids of the requested page are then fetched
+from the database. The bitsets are built on first use (see lazy_index.py)
+and updated from committed changes through model_events.
+"""
+import logging
+import threading
+from collections import Counter
+from itertools import islice
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+import lazy_index
+import model_events
+import projection
+
+logger = logging.getLogger(__name__)
+
+BITMAP_FIELDS = ('status', 'category', 'shelf', 'column', 'row')
+
+
+def bitmap_of(ids, size):
+    """Return the bitset of ``ids``, all below ``size``, packed in one pass instead of bit by bit."""
+    bits = np.zeros(size, dtype=bool)
+    bits[np.fromiter(ids, dtype=np.int64)] = True
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+
+def iter_ids(bitmap, after=None):
+    """Yield the ids set in ``bitmap`` in ascending order, starting after ``after``."""
+    offset = 0
+    if after is not None and after >= 0:
+        offset = after + 1
+        bitmap >>= offset
+    while bitmap:
+        lowest = bitmap & -bitmap
+        position = lowest.bit_length() - 1
+        yield offset + position
+        bitmap >>= position + 1
+        offset += position + 1
+
+
+class BitmapIndex(lazy_index.LazyIndex):
+    """Per-value bitsets for a fixed set of columns."""
+
+    def __init__(self, fields=BITMAP_FIELDS):
+        self.fields = fields
+        self._bitmaps = {field: {} for field in fields}
+        self._values = {}
+        self._all = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._all.bit_count()
+
+    def _clear(self, book_id):
+        values = self._values.pop(book_id, None)
+        if values is None:
+            return
+        mask = ~(1 << book_id)
+        for field, value in zip(self.fields, values):
+            bitmaps = self._bitmaps[field]
+            remaining = bitmaps.get(value, 0) & mask
+            if remaining:
+                bitmaps[value] = remaining
+            else:
+                bitmaps.pop(value, None)
+        self._all &= mask
+
+    def load(self, rows):
+        """
+        Replace the index with ``(id, *values)`` rows, as when it is built.
+
+        The ids of each value are collected first and its bitset made once:
+        OR-ing one bit at a time into a growing int copies it for every book.
+        """
+        values = {}
+        ids = {field: {} for field in self.fields}
+        for row in rows:
+            book_id, row_values = row[0], tuple(row[1:])
+            values[book_id] = row_values
+            for field, value in zip(self.fields, row_values):
+                ids[field].setdefault(value, []).append(book_id)
+        size = max(values, default=-1) + 1
+        bitmaps = {field: {value: bitmap_of(value_ids, size) for value, value_ids in ids[field].items()}
+                   for field in self.fields}
+        with self._lock:
+            self._bitmaps = bitmaps
+            self._values = values
+            self._all = bitmap_of(values, size)
+
+    def add(self, book_id, values):
+        """Index a book's column values, replacing any earlier version; for single-row changes."""
+        values = tuple(values)
+        bit = 1 << book_id
+        with self._lock:
+            self._clear(book_id)
+            for field, value in zip(self.fields, values):
+                bitmaps = self._bitmaps[field]
+                bitmaps[value] = bitmaps.get(value, 0) | bit
+            self._values[book_id] = values
+            self._all |= bit
+
+    def remove(self, book_id):
+        """Drop a book from the index if it is present."""
+        with self._lock:
+            self._clear(book_id)
+
+    def apply_change(self, op, row):
+        if op == 'delete':
+            self.remove(row['id'])
+        else:
+            self.add(row['id'], [row.get(field) for field in self.fields])
+
+    def select(self, filters):
+        """Return the bitset of books matching every ``{field: value}`` filter."""
+        self.ensure_loaded()
+        with self._lock:
+            result = self._all
+            for field, value in (filters or {}).items():
+                result &= self._bitmaps[field].get(value, 0)
+                if not result:
+                    break
+        return result
+
+    def count(self, filters):
+        """Return how many books match the filters."""
+        return self.select(filters).bit_count()
+
+    def page(self, filters, after=None, limit=20):
+        """Return up to ``limit`` matching ids in ascending order, starting after id ``after``."""
+        return list(islice(iter_ids(self.select(filters), after), limit))
+
+    def facet_counts(self, fields, filters=None):
+        """
+        Count matching books per value of each field.
+
+        Returns ``{field: [(value, count), ...]}`` with the largest counts
+        first, the same shape as facets.facet_counts.
+        """
+        selected = self.select(filters)
+        with self._lock:
+            counts = {}
+            for field in fields:
+                counter = Counter()
+                for value, bitmap in self._bitmaps[field].items():
+                    count = (bitmap & selected).bit_count()
+                    if count and value is not None:
+                        counter[value] = count
+                counts[field] = sorted(counter.items(), key=lambda item: (-item[1], str(item[0])))
+        return counts
+
+
+def parse_after(value):
+    """
+    Parse the ``after`` parameter of a browse request.
+
+    Returns ``(after, error)``: None when no value is given, and the JSON body
+    of a 400 response unless the value is a book id (a whole number from 0).
+    """
+    if value is None or value == '':
+        return None, None
+    try:
+        after = int(value)
+    except ValueError:
+        after = -1
+    if after < 0:
+        return None, {'error': "The 'after' parameter must be a book id."}
+    return after, None
+
+
+def parse_filters(args):
+    """Return the column filters present in request arguments, e.g. ``{'shelf': 'B1'}``."""
+    return {field: args.get(field) for field in BITMAP_FIELDS if args.get(field)}
+
+
+def browse_ids(index, filters, after=None, limit=20):
+    """
+    Return ``(total, ids, next_after)`` for one page of the books matching ``filters``.
+
+    ``ids`` are in ascending order and ``next_after`` is the id to pass as
+    ``after`` for the next page, or None on the last page.
+    """
+    bitmap = index.select(filters)
+    ids = list(islice(iter_ids(bitmap, after), limit + 1))
+    next_after = ids[limit - 1] if len(ids) > limit else None
+    return bitmap.bit_count(), ids[:limit], next_after
+
+
+def browse(index, model, filters, after=None, limit=20):
+    """
+    Return one page of the books matching ``filters``, in id order.
+
+    The matching ids come from the bitmaps; only the ``limit`` rows of the
+    page are read from the database. Returns ``(total, records, next_after)``
+    where ``records`` are dicts of the list-view fields (see browse_ids).
+    """
+    total, ids, next_after = browse_ids(index, filters, after, limit)
+    records = []
+    if ids:
+        rows = model.query.session.execute(projection.summaries_by_id(model, ids)).all()
+        records = [dict(zip(projection.LIST_FIELDS, row)) for row in rows]
+    return total, records, next_after
+
+
+def init_app(app, db, model):
+    """Register a bitmap index for an app, built from ``model`` on first use and kept current."""
+    index = BitmapIndex()
+    columns = [getattr(model, field) for field in index.fields]
+
+    def build(index):
+        with app.app_context():
+            with db.engine.connect() as conn:
+                index.load(conn.execute(select(model.id, *columns)))
+        logger.info(f"Built bitmap index over {len(index)} books")
+
+    index.defer(build)
+    lazy_index.on_warm_up(app, index.ensure_loaded)
+    model_events.subscribe(model, index.changed)
+    app.extensions['bitmap_index'] = index
+    return index
+
+
+def get_bitmap_index():
+    """Return the bitmap index registered on the current app."""
+    return current_app.extensions['bitmap_index']
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Build the read-only catalog file shipped with serverless deployments.
+
+Run before deploying, from the project directory (``vercel.json`` runs it as
+the build command)::
+
+    python catalog_builder.py catalog.db
+    python catalog_builder.py catalog.db --source postgresql://.../library
+
+The file is created the way ``direct.py`` creates a new database (schema,
+migrations, indexes, FTS5 index and the schema fingerprint), filled with the
+books of ``--source`` (by default the sample books ``direct.py`` seeds), then
+analyzed and vacuumed so the app can open it immutable (see
+``readonly_catalog.py``).
+
+The BM25 statistics of the catalog are written next to it
+(``catalog.bm25.pickle`` for ``catalog.db``; see ``stats_path``). With
+``BM25_STATS_PATH`` pointing there a cold start loads them instead of
+tokenizing every book. The other in-memory indexes are built on first use
+(see lazy_index.py).
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+
+from sqlalchemy import MetaData, Table, create_engine, select, text
+
+import read_replicas
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("catalog_builder")
+
+# Books copied from the source per transaction
+COPY_BATCH_SIZE = 1000
+
+
+def copy_books(app, source_url):
+    """Replace the books of ``app``'s database with those of the database at ``source_url``."""
+    db = app.extensions['sqlalchemy']
+    book_model = app.extensions['search_engine'].model
+    source = create_engine(read_replicas.normalize_url(source_url))
+    source_table = Table(book_model.__tablename__, MetaData(), autoload_with=source)
+    columns = [name for name in book_model.__table__.c.keys() if name in source_table.c]
+    copied = 0
+    with app.app_context(), source.connect() as conn:
+        db.session.execute(book_model.__table__.delete())
+        db.session.commit()
+        rows = conn.execution_options(stream_results=True).execute(
+            select(*[source_table.c[name] for name in columns]).order_by(source_table.c.id)
+        )
+        for batch in rows.partitions(COPY_BATCH_SIZE):
+            # Through the ORM, so ISBNs are validated and normalized columns filled
+            db.session.add_all(book_model(**row._asdict()) for row in batch)
+            db.session.commit()
+            db.session.expunge_all()
+            copied += len(batch)
+    source.dispose()
+    logger.info(f"Copied {copied} books from {source.url.render_as_string(hide_password=True)}")
+
+
+def stats_path(output):
+    """Return the path of the BM25 statistics stored with the catalog file ``output``."""
+    return os.path.splitext(output)[0] + '.bm25.pickle'
+
+
+def build(output, source_url=None):
+    """Write the catalog to a new SQLite file at ``output``, and its BM25 statistics, replacing any files there."""
+    output = os.path.abspath(output)
+    building = output + '.building'
+    stats = stats_path(output)
+    for path in (building, stats):
+        if os.path.exists(path):
+            os.remove(path)
+
+    # direct.py builds its app at import, from these settings
+    os.environ['DATABASE_URL'] = f"sqlite:///{building}"
+    os.environ['MIGRATE_ON_START'] = 'true'
+    os.environ['BM25_STATS_PATH'] = stats
+    for name in ('CATALOG_DATABASE', 'DATABASE_READ_URLS', 'CATALOG_SNAPSHOT'):
+        os.environ.pop(name, None)
+    import direct
+    app = direct.app
+    if source_url:
+        copy_books(app, source_url)
+
+    # Stored at BM25_STATS_PATH; nothing below changes the books or the catalog generation
+    ranker = app.extensions.get('bm25_ranker')
+    if ranker is not None:
+        with app.app_context():
+            ranker.ensure_loaded()
+
+    db = app.extensions['sqlalchemy']
+    search = app.extensions['search_engine']
+    with app.app_context():
+        with db.engine.begin() as conn:
+            if hasattr(search, 'fts_table'):
+                conn.execute(text(f"INSERT INTO {search.fts_table}({search.fts_table}) VALUES ('optimize')"))
+            conn.execute(text("ANALYZE"))
+        for engine in db.engines.values():
+            engine.dispose()
+
+    # An immutable database must not depend on a WAL or rollback journal
+    conn = sqlite3.connect(building, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(building, output)
+    logger.info(f"Wrote read-only catalog {output} ({os.path.getsize(output) / 1024:.0f} KiB)")
+    if os.path.exists(stats):
+        logger.info(f"Wrote BM25 statistics {stats} ({os.path.getsize(stats) / 1024:.0f} KiB)")
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the read-only catalog file for serverless deployments.")
+    parser.add_argument('output', nargs='?', default='catalog.db', help="catalog file to write")
+    parser.add_argument('--source', help="database URL to copy the books from (default: direct.py's sample books)")
+    args = parser.parse_args(argv)
+    try:
+        build(args.output, args.source)
+    except Exception as e:
+        logger.error(f"Catalog build failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
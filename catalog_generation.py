@@ -0,0 +1,138 @@
+"""
+Catalog-wide generation number, and the log of the changes behind it.
+
+Pages that depend on the whole catalog, like search results, can't be
+validated by any one row. Instead every flush that inserts, updates or
+deletes a book appends one ``catalog_changes`` row per book, in the same
+transaction, and the catalog's generation is the number of the latest row.
+Any process, and any replica the change has reached, can then tell whether
+the catalog changed by reading one row at the end of the primary key,
+without scanning the book table (see http_cache.py), and can tell which
+books changed by reading the rows after the generation it last saw (see
+catalog_sync.py). Appending rows, unlike incrementing one counter, doesn't
+make every writer wait on the same row lock.
+
+Migration 0006 created a single-row counter, ``catalog_state``; migration
+0007 replaced it with the log, starting after the counter's last value so
+generations, and the ETags made from them, never repeat. Old rows are
+pruned after ``CATALOG_CHANGE_RETENTION`` seconds; the latest row always
+stays. Writes that bypass the ORM, like migration backfills, aren't logged.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, MetaData, String, Table, event, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_metadata = MetaData()
+
+catalog_state = Table(
+    'catalog_state', _metadata,
+    Column('id', Integer, primary_key=True),
+    Column('generation', BigInteger, nullable=False),
+    Column('changed_at', DateTime, nullable=False),
+)
+
+catalog_changes = Table(
+    'catalog_changes', _metadata,
+    # SQLite only numbers INTEGER PRIMARY KEY columns itself
+    Column('generation', BigInteger().with_variant(Integer, 'sqlite'), primary_key=True),
+    # None on the row migration 0007 starts the log with
+    Column('book_id', Integer),
+    Column('op', String(10)),
+    Column('changed_at', DateTime, nullable=False),
+)
+
+# Primary key of the one catalog_state row
+STATE_ID = 1
+
+_tracked = set()
+
+
+def create(engine):
+    """Create the catalog_state table and its row, if missing."""
+    catalog_state.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        if conn.execute(select(catalog_state.c.id).where(catalog_state.c.id == STATE_ID)).first() is None:
+            conn.execute(catalog_state.insert().values(id=STATE_ID, generation=0, changed_at=datetime.utcnow()))
+
+
+def create_change_log(engine):
+    """Create the catalog_changes table, starting it after catalog_state's generation, if missing."""
+    catalog_changes.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        if conn.execute(select(catalog_changes.c.generation).limit(1)).first() is not None:
+            return
+        generation = conn.execute(
+            select(catalog_state.c.generation).where(catalog_state.c.id == STATE_ID)
+        ).scalar() or 0
+        conn.execute(catalog_changes.insert().values(generation=generation + 1, changed_at=datetime.utcnow()))
+        if engine.dialect.name == 'postgresql':
+            # An explicit key doesn't advance the column's sequence
+            conn.execute(text("SELECT setval(pg_get_serial_sequence('catalog_changes', 'generation'), :value)"),
+                         {'value': generation + 1})
+
+
+def state_statement():
+    """Return a statement selecting ``(generation, changed_at)``."""
+    return (select(catalog_changes.c.generation, catalog_changes.c.changed_at)
+            .order_by(catalog_changes.c.generation.desc()).limit(1))
+
+
+def changes_statement(after, also=()):
+    """Return a statement selecting ``(generation, book_id, op, changed_at)`` after generation ``after``, and at ``also``, oldest first."""
+    generation = catalog_changes.c.generation
+    condition = generation > after
+    if also:
+        condition = condition | generation.in_(sorted(also))
+    return (select(generation, catalog_changes.c.book_id, catalog_changes.c.op, catalog_changes.c.changed_at)
+            .where(condition).order_by(generation))
+
+
+def prune(engine, before):
+    """Delete the changes logged before the datetime ``before``, except the latest. Returns the number deleted."""
+    with engine.begin() as conn:
+        latest = conn.execute(select(catalog_changes.c.generation).order_by(
+            catalog_changes.c.generation.desc()).limit(1)).scalar()
+        if latest is None:
+            return 0
+        result = conn.execute(catalog_changes.delete().where(
+            (catalog_changes.c.changed_at < before) & (catalog_changes.c.generation < latest)
+        ))
+    return result.rowcount
+
+
+def current(session):
+    """Return the catalog's ``(generation, changed_at)``, or None if catalog_changes doesn't exist yet."""
+    try:
+        row = session.execute(state_statement()).first()
+    except SQLAlchemyError as e:
+        # A database behind the models (MIGRATE_ON_START=false); see "flask init-db"
+        logger.warning(f"Catalog generation unavailable: {e}")
+        session.rollback()
+        return None
+    return tuple(row) if row is not None else None
+
+
+def _make_listener(op):
+    def listener(mapper, connection, target):
+        session = Session.object_session(target)
+        if session is None:
+            return
+        # Updates are reported for every dirty object, even with no net change
+        if op == 'update' and not session.is_modified(target, include_collections=False):
+            return
+        connection.execute(catalog_changes.insert().values(book_id=target.id, op=op, changed_at=datetime.utcnow()))
+    return listener
+
+
+def track(model):
+    """Log every book of ``model`` a flush changes, moving the catalog to a new generation."""
+    if model in _tracked:
+        return
+    for op in ('insert', 'update', 'delete'):
+        event.listen(model, f'after_{op}', _make_listener(op))
+    _tracked.add(model)
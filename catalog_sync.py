@@ -0,0 +1,293 @@
+"""
+Catalog changes made by other processes.
+
+The in-process indexes (suggestions, fuzzy matching, bitmaps, the n-gram
+index, the catalog snapshot, BM25 statistics) and the caches follow committed
+changes through model_events, which only sees this process's own commits.
+Other gunicorn workers, the ASGI app and scripts write the same database.
+
+Every flush that changes a book logs it in ``catalog_changes`` under a new
+catalog generation (see catalog_generation.py). Warming the app up (see
+lazy_index.py), or else the first request, notes the latest generation
+before any index is built from the table. After that a background thread
+in each process reads the latest generation every ``CATALOG_SYNC_INTERVAL``
+seconds, one lookup at the end of the log's primary key on the primary.
+When it has moved, only the log rows after the last generation seen are
+read, and the books they name are read back by primary key and published
+through model_events as if they had been committed here. Changes this
+process committed were published already and are skipped. Requests never
+wait for this, except the first one a process serves, which catches up
+before it is handled. The ASGI app reads the generation from an async task
+instead, and hands only the replay to a worker thread (see asgi.py).
+
+PostgreSQL numbers log rows when they are inserted, not when they commit, so
+a generation skipped over may still belong to a transaction in flight. Such
+gaps are read again on each check for ``GAP_TIMEOUT`` seconds. The thread
+also prunes log rows older than ``CATALOG_CHANGE_RETENTION`` seconds.
+
+As with the generation, writes that bypass the ORM aren't seen. A read-only
+catalog file (see readonly_catalog.py) never changes and isn't followed.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import inspect, select
+from sqlalchemy.exc import SQLAlchemyError
+
+import catalog_generation
+import lazy_index
+import model_events
+import readonly_catalog
+
+logger = logging.getLogger(__name__)
+
+# Changed books read back per query when replaying
+FETCH_BATCH_SIZE = 500
+
+# Seconds a skipped generation is read again, waiting for its transaction to commit
+GAP_TIMEOUT = 60
+
+# Most skipped generations waited for at once
+MAX_GAPS = 1000
+
+# Seconds between prunes of the change log
+PRUNE_INTERVAL = 3600
+
+_MISSING = object()
+
+
+class CatalogSync:
+    """Replays the changes other processes commit to ``model`` through model_events."""
+
+    def __init__(self, db, model, interval=1.0, retention=86400):
+        self.db = db
+        self.model = model
+        self.columns = [getattr(model, attr.key) for attr in inspect(model).column_attrs]
+        self.interval = interval
+        self.retention = retention
+        # (generation, changed_at) the indexes reflect; None until start()
+        self.state = None
+        # Generations skipped by the last checks, and when each was first skipped
+        self._gaps = {}
+        # Versions committed by this process since the last check; None for a deleted book
+        self._local = {}
+        self._lock = threading.RLock()
+        self._follower_pid = None
+        self._checked_at = None
+        self._pruned_at = None
+        self.app = None
+        self.replayed = 0
+
+    def _read_state(self):
+        with self.db.engine.connect() as conn:
+            row = conn.execute(catalog_generation.state_statement()).first()
+        return tuple(row) if row is not None else None
+
+    def start(self):
+        """Note the generation the indexes are built from. Call before they load."""
+        with self._lock:
+            if self.state is not None:
+                return
+            state = self._read_state()
+            # The indexes will have this process's commits so far
+            self._local = {}
+            self._checked_at = time.time()
+            self.state = state
+
+    def changed(self, op, row):
+        """model_events subscriber noting this process's own commits."""
+        with self._lock:
+            self._local[row['id']] = None if op == 'delete' else (row.get('version') or 0)
+
+    def _read_changes(self):
+        """Return the change log rows after the current generation and in its gaps, oldest first."""
+        now = time.monotonic()
+        self._gaps = {generation: since for generation, since in self._gaps.items() if now - since < GAP_TIMEOUT}
+        with self.db.engine.connect() as conn:
+            rows = conn.execute(catalog_generation.changes_statement(self.state[0], self._gaps)).all()
+        expected = self.state[0] + 1
+        for generation, *_ in rows:
+            self._gaps.pop(generation, None)
+            if generation < expected:
+                continue
+            for skipped in range(expected, min(generation, expected + MAX_GAPS)):
+                self._gaps.setdefault(skipped, now)
+            expected = generation + 1
+        return rows
+
+    def _collapse(self, rows, local):
+        """Return the ``(inserted, updated, deleted)`` ids of the logged changes that weren't this process's own."""
+        first, last = {}, {}
+        for generation, book_id, op, changed_at in rows:
+            if book_id is None:
+                continue
+            first.setdefault(book_id, op)
+            last[book_id] = op
+
+        deleted = [book_id for book_id, op in last.items()
+                   if op == 'delete' and first[book_id] != 'insert' and local.get(book_id, _MISSING) is not None]
+        present = [book_id for book_id, op in last.items() if op != 'delete']
+        inserted, updated = [], []
+        for book_id in present:
+            (inserted if first[book_id] == 'insert' else updated).append(book_id)
+        return inserted, updated, deleted
+
+    def _publish(self, op, ids, local):
+        """Publish the current rows of ``ids``, except those at the version this process committed. Returns the count."""
+        keys = [column.key for column in self.columns]
+        published = 0
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            batch = ids[start:start + FETCH_BATCH_SIZE]
+            with self.db.engine.connect() as conn:
+                rows = conn.execute(select(*self.columns).where(self.model.id.in_(batch))).all()
+            for row in rows:
+                values = dict(zip(keys, row))
+                if local.get(values['id'], _MISSING) == (values.get('version') or 0):
+                    continue
+                model_events.publish(self.model, op, values)
+                published += 1
+            # A book missing here was deleted since; its delete is logged after this check's rows
+        return published
+
+    def behind(self, state):
+        """Whether the indexes are behind a catalog at ``state``, or may be."""
+        return self.state is None or state != self.state or bool(self._gaps)
+
+    @property
+    def prune_due(self):
+        """Whether the change log was last pruned over ``PRUNE_INTERVAL`` seconds ago."""
+        return self._pruned_at is None or time.monotonic() - self._pruned_at > PRUNE_INTERVAL
+
+    def check(self, state=None):
+        """
+        Bring the indexes up to the catalog's current generation.
+
+        ``state`` is the catalog's ``(generation, changed_at)`` if the caller
+        read it already. Returns the ``(generation, changed_at)`` the indexes
+        reflect afterwards, or None if the generation can't be read.
+        """
+        try:
+            if self.state is None:
+                self.start()
+                return self.state
+            if state is None:
+                state = self._read_state()
+        except SQLAlchemyError as e:
+            logger.warning(f"Catalog generation unavailable: {e}")
+            return None
+        if not self.behind(state):
+            self._checked_at = time.time()
+            return state
+        with self._lock:
+            if self._checked_at is not None and time.time() - self._checked_at > self.retention:
+                logger.error(f"Catalog not checked for over {self.retention}s; changes pruned from the log "
+                             f"since then are missing until the process restarts")
+            try:
+                rows = self._read_changes()
+            except SQLAlchemyError as e:
+                logger.warning(f"Catalog changes unavailable: {e}")
+                return None
+            self._checked_at = time.time()
+            if not rows:
+                return self.state
+            local, self._local = self._local, {}
+            inserted, updated, deleted = self._collapse(rows, local)
+            replayed = self._publish('insert', inserted, local) + self._publish('update', updated, local)
+            for book_id in deleted:
+                model_events.publish(self.model, 'delete', {'id': book_id})
+            replayed += len(deleted)
+            newest = max(rows, key=lambda row: row[0])
+            if newest[0] > self.state[0]:
+                self.state = (newest[0], newest[3])
+            self.replayed += replayed
+            state = self.state
+        if replayed:
+            logger.info(f"Catalog generation {state[0]}: replayed {replayed} changed books")
+        return state
+
+    def prune(self):
+        """Delete change log rows older than the retention. Returns the number deleted."""
+        deleted = catalog_generation.prune(self.db.engine, datetime.utcnow() - timedelta(seconds=self.retention))
+        self._pruned_at = time.monotonic()
+        if deleted:
+            logger.info(f"Pruned {deleted} catalog changes")
+        return deleted
+
+    @property
+    def following(self):
+        """Whether this process has started its background check."""
+        return self._follower_pid == os.getpid()
+
+    def ensure_following(self):
+        """
+        Start this process's background check, catching up first if it is the first.
+
+        Returns whether the thread was started here.
+        """
+        # Threads don't survive fork, so each worker process starts its own
+        if self.following or self.app is None:
+            return False
+        with self._lock:
+            if self.following:
+                return False
+            self._follower_pid = os.getpid()
+        self.check()
+        if self.interval > 0:
+            threading.Thread(target=self._follow_loop, name='catalog-sync', daemon=True).start()
+        return True
+
+    def maintain(self, state=None):
+        """Run a check, and prune the change log when it is due. Call in an app context."""
+        self.check(state)
+        if self.prune_due:
+            self.prune()
+
+    def _follow_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.maintain()
+            except Exception as e:
+                logger.error(f"Catalog sync failed: {e}")
+
+
+def init_app(app, db, model):
+    """
+    Follow other processes' changes to ``model`` from a background thread.
+
+    Call before the indexes are registered, so the starting generation is
+    the first warm-up step and none of the changes made while they load is
+    missed. Returns None when the database keeps no change log or is a
+    read-only catalog file.
+    """
+    if readonly_catalog.serving(app):
+        return None
+    with app.app_context():
+        if catalog_generation.current(db.session) is None:
+            return None
+    sync = CatalogSync(
+        db, model,
+        interval=app.config.get('CATALOG_SYNC_INTERVAL', 1.0),
+        retention=app.config.get('CATALOG_CHANGE_RETENTION', 86400)
+    )
+    sync.app = app
+    lazy_index.on_warm_up(app, sync.start)
+    model_events.subscribe(model, sync.changed)
+
+    @app.before_request
+    def follow_catalog():
+        if request.endpoint != 'static':
+            sync.ensure_following()
+
+    app.extensions['catalog_sync'] = sync
+    return sync
+
+
+def get_catalog_sync():
+    """Return the catalog sync registered on the current app, or None."""
+    return current_app.extensions.get('catalog_sync')
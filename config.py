@@ -1,12 +1,88 @@
 import os
 
+
+def database_url():
+    """Return DATABASE_URL, with the postgres:// scheme Render hands out renamed for SQLAlchemy."""
+    url = os.environ.get("DATABASE_URL", "sqlite:///library.db")
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
 class Config:
-    """Base configuration class."""
-    DEBUG = False
+    """
+    Base configuration class: every setting's default, read from the environment.
+
+    app.py's ``create_app`` and direct.py load it before any overrides.
+    """
+    # DEBUG is left to Flask, which reads FLASK_DEBUG
     TESTING = False
     SECRET_KEY = os.environ.get("SESSION_SECRET", "dev-secret-key")
-    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "sqlite:///library.db")
+    SQLALCHEMY_DATABASE_URI = database_url()
+    # Prebuilt read-only catalog file (see catalog_builder.py), used instead of DATABASE_URL when it exists
+    CATALOG_DATABASE = os.environ.get("CATALOG_DATABASE")
+    # Optional comma-separated read replica URLs; read-only requests are spread across them
+    DATABASE_READ_URLS = os.environ.get("DATABASE_READ_URLS", "")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    # Search settings: "fulltext" (word search) or "substring" (partial-word search)
+    SEARCH_MODE = os.environ.get("SEARCH_MODE", "fulltext")
+    SEARCH_SIMILARITY_THRESHOLD = float(os.environ.get("SEARCH_SIMILARITY_THRESHOLD", "0.3"))
+    SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", "20"))
+    SEARCH_COUNT_CAP = int(os.environ.get("SEARCH_COUNT_CAP", "1000"))
+    SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "512"))
+    SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", "300"))
+    # Most matches one /api/search request streams (also its default limit)
+    SEARCH_API_MAX_LIMIT = int(os.environ.get("SEARCH_API_MAX_LIMIT", "10000"))
+    # Rendered book pages kept per worker, and seconds before one is rendered again
+    PAGE_CACHE_SIZE = int(os.environ.get("PAGE_CACHE_SIZE", "1024"))
+    PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", "300"))
+    # Cache-Control of book and search pages, and a value mixed into their ETags (defaults to the deployed commit)
+    HTTP_CACHE_MAX_AGE = int(os.environ.get("HTTP_CACHE_MAX_AGE", "0"))
+    HTTP_CACHE_STALE_WHILE_REVALIDATE = int(os.environ.get("HTTP_CACHE_STALE_WHILE_REVALIDATE", "60"))
+    HTTP_CACHE_SALT = os.environ.get("HTTP_CACHE_SALT", os.environ.get("RENDER_GIT_COMMIT", os.environ.get("VERCEL_GIT_COMMIT_SHA", "")))
+    SUGGEST_LIMIT = int(os.environ.get("SUGGEST_LIMIT", "8"))
+    FUZZY_MAX_DISTANCE = int(os.environ.get("FUZZY_MAX_DISTANCE", "2"))
+    FUZZY_MIN_RESULTS = int(os.environ.get("FUZZY_MIN_RESULTS", "3"))
+    # Relevance ranking: "bm25" or "none"
+    SEARCH_RANKING = os.environ.get("SEARCH_RANKING", "bm25")
+    BM25_FIELD_WEIGHTS = os.environ.get("BM25_FIELD_WEIGHTS", "title:3,author:2,category:1,description:0.5")
+    BM25_CANDIDATE_LIMIT = int(os.environ.get("BM25_CANDIDATE_LIMIT", "1000"))
+    BM25_REBUILD_INTERVAL = int(os.environ.get("BM25_REBUILD_INTERVAL", "60"))
+    BM25_STATS_PATH = os.environ.get("BM25_STATS_PATH")
+    # Directory for lock files that coalesce identical searches across workers (unset: per worker)
+    SEARCH_COALESCE_LOCK_DIR = os.environ.get("SEARCH_COALESCE_LOCK_DIR")
+    # Seconds a worker waits for another's identical search before running it itself
+    SEARCH_COALESCE_TIMEOUT = float(os.environ.get("SEARCH_COALESCE_TIMEOUT", "5"))
+    # Apply schema migrations and create missing indexes at startup if the schema changed (otherwise run "flask init-db")
+    MIGRATE_ON_START = os.environ.get("MIGRATE_ON_START", "true").lower() == "true"
+    # Connection pool of the async engine used by asgi.py
+    ASYNC_POOL_SIZE = int(os.environ.get("ASYNC_POOL_SIZE", "20"))
+    ASYNC_MAX_OVERFLOW = int(os.environ.get("ASYNC_MAX_OVERFLOW", "20"))
+    # Pick-list routing: floor-plan distances in metres and the largest batch accepted
+    PICK_AISLE_SPACING = float(os.environ.get("PICK_AISLE_SPACING", "3.0"))
+    PICK_COLUMN_WIDTH = float(os.environ.get("PICK_COLUMN_WIDTH", "1.0"))
+    PICK_SHELVES_PER_AISLE = int(os.environ.get("PICK_SHELVES_PER_AISLE", "2"))
+    PICK_CROSS_AISLES = os.environ.get("PICK_CROSS_AISLES", "front,back")
+    PICK_FLOOR_PLAN = os.environ.get("PICK_FLOOR_PLAN")
+    PICK_LIST_MAX_STOPS = int(os.environ.get("PICK_LIST_MAX_STOPS", "500"))
+    # Serve search results and book details from a columnar in-memory copy of the catalog
+    CATALOG_SNAPSHOT = os.environ.get("CATALOG_SNAPSHOT", "false").lower() == "true"
+    # Compiled templates saved across processes ("" to turn off), and whether to compile them all at warm-up
+    TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".jinja_cache"))
+    TEMPLATE_PRECOMPILE = os.environ.get("TEMPLATE_PRECOMPILE", "true").lower() == "true"
+    # Read replicas: lag before one is taken out of rotation, seconds between health checks,
+    # and how long a client reads from the primary after making a change
+    REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", "10"))
+    REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", "5"))
+    READ_YOUR_WRITES_SECONDS = float(os.environ.get("READ_YOUR_WRITES_SECONDS", "5"))
+    # Seconds between checks for other processes' catalog changes (0: only on the first request),
+    # and how long changes are kept in the log for processes that fall behind
+    CATALOG_SYNC_INTERVAL = float(os.environ.get("CATALOG_SYNC_INTERVAL", "1"))
+    CATALOG_CHANGE_RETENTION = int(os.environ.get("CATALOG_CHANGE_RETENTION", "86400"))
 
 class DevelopmentConfig(Config):
     """Development configuration."""
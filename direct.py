@@ -1,5 +1,4 @@
 import os
-import sys
 import logging
 from pathlib import Path
 from datetime import datetime
@@ -15,16 +14,22 @@ def main():
     This uses a direct approach to create a Flask app without complexity.
     """
     # Import Flask and required dependencies
-    from flask import Flask, render_template, request, redirect, url_for, flash
+    from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
     from flask_sqlalchemy import SQLAlchemy
-    from sqlalchemy.orm import DeclarativeBase
+    from sqlalchemy.orm import DeclarativeBase, validates
+    from isbn import canonical_isbn, to_isbn13
+    import config
+    import migrations
+    import normalize
+    import read_replicas
+    import readonly_catalog
     
     # Base class for SQLAlchemy
     class Base(DeclarativeBase):
         pass
     
-    # Initialize SQLAlchemy
-    db = SQLAlchemy(model_class=Base)
+    # Initialize SQLAlchemy; sessions send read-only requests to replicas
+    db = SQLAlchemy(model_class=Base, session_options={"class_": read_replicas.RoutingSession})
     
     # Create the Flask application with explicit template folder
     app = Flask(__name__)
@@ -34,42 +39,18 @@ def main():
     template_dir = os.path.join(base_dir, 'templates')
     static_dir = os.path.join(base_dir, 'static')
     
-    # Verify template and static directories
-    logger.info(f"Base directory: {base_dir}")
-    if os.environ.get('RENDER') == 'true':
-        logger.info("Running on Render platform")
-    else:
-        logger.info("Running in local environment")
-    
     logger.info(f"Setting template_folder={template_dir}, static_folder={static_dir}")
     app.template_folder = template_dir
     app.static_folder = static_dir
     
-    # Log diagnostics about the template directory
-    logger.info(f"Current working directory: {os.getcwd()}")
-    logger.info(f"Template directory exists: {os.path.exists(template_dir)}")
-    if os.path.exists(template_dir):
-        logger.info(f"Template files: {os.listdir(template_dir)}")
-    
-    # Log application startup information
-    logger.info(f"Python version: {sys.version}")
-    
-    # Set secret key
-    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
-    
-    # Configure database connection
-    database_url = os.environ.get("DATABASE_URL", "sqlite:///library.db")
-    if database_url and database_url.startswith("postgres://"):
-        database_url = database_url.replace("postgres://", "postgresql://", 1)
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
+    # Settings and their defaults, read from the environment
+    app.config.from_object(config.Config)
+    app.config["SQLALCHEMY_BINDS"] = read_replicas.replica_binds(app.config["DATABASE_READ_URLS"])
     
-    # Initialize the database
+    # Initialize the database, from the prebuilt catalog file if there is one
+    readonly_catalog.configure(app)
     db.init_app(app)
+    readonly_catalog.init_app(app, db)
     
     # Define embedded templates for the app (will override filesystem templates if needed)
     embedded_templates = {
@@ -198,6 +179,39 @@ def main():
             feather.replace();
         });
     </script>
+    <script>
+        // Search-as-you-type suggestions for the search box
+        document.addEventListener('DOMContentLoaded', function() {
+            var input = document.getElementById('search-input');
+            if (!input) return;
+            var list = document.createElement('datalist');
+            list.id = 'search-suggestions';
+            document.body.appendChild(list);
+            input.setAttribute('list', list.id);
+            input.setAttribute('autocomplete', 'off');
+            var pending = null;
+            input.addEventListener('input', function() {
+                var prefix = input.value.trim();
+                if (pending) pending.abort();
+                if (!prefix) {
+                    list.innerHTML = '';
+                    return;
+                }
+                pending = new AbortController();
+                fetch('{{ url_for('suggest_completions') }}?prefix=' + encodeURIComponent(prefix), {signal: pending.signal})
+                    .then(function(response) { return response.json(); })
+                    .then(function(data) {
+                        list.innerHTML = '';
+                        data.suggestions.forEach(function(suggestion) {
+                            var option = document.createElement('option');
+                            option.value = suggestion.text;
+                            list.appendChild(option);
+                        });
+                    })
+                    .catch(function() {});
+            });
+        });
+    </script>
     {% block extra_scripts %}{% endblock %}
 </body>
 </html>''',
@@ -284,6 +298,34 @@ def main():
 
         'search_results.html': '''{% extends 'base.html' %}
 
+{% macro book_card(book) %}
+    <div class="col">
+        <div class="card h-100 book-card">
+            <div class="card-body">
+                <h5 class="card-title">{{ book.title }}</h5>
+                <h6 class="card-subtitle mb-2 text-muted">{{ book.author }}</h6>
+                
+                <div class="mt-3">
+                    <span class="badge bg-{{ 'success' if book.status == 'available' else 'danger' if book.status == 'issued' else 'warning' if book.status == 'reserved' else 'secondary' }} status-badge status-{{ book.status }}">
+                        {{ book.status_display }}
+                    </span>
+                </div>
+                
+                <p class="card-text mt-3">
+                    <strong>Location:</strong> {{ book.location_display }}
+                </p>
+                
+                <p class="card-text">
+                    <small class="text-muted">ISBN: {{ book.isbn }}</small>
+                </p>
+            </div>
+            <div class="card-footer">
+                <a href="{{ url_for('book_details', book_id=book.id) }}" class="btn btn-outline-primary btn-sm">View Details</a>
+            </div>
+        </div>
+    </div>
+{% endmacro %}
+
 {% block title %}Search Results for "{{ query }}" - Library Book Locator{% endblock %}
 
 {% block content %}
@@ -291,7 +333,7 @@ def main():
     <div class="row mb-4">
         <div class="col-12">
             <h1>Search Results</h1>
-            <p class="lead">Found {{ books|length }} result(s) for "{{ query }}"</p>
+            <p class="lead">Found {{ page.total_display }} result(s) for "{{ query }}"</p>
             
             <!-- Quick search form -->
             <form id="search-form" action="{{ url_for('search') }}" method="get" class="mb-4">
@@ -305,39 +347,47 @@ def main():
                     </button>
                 </div>
             </form>
+            
+            {% if facets %}
+                <div id="search-facets" class="mb-2">
+                    {% for facet in facets %}
+                        <div class="mb-2">
+                            <strong class="me-2">{{ facet.label }}:</strong>
+                            {% for item in facet['values'] %}
+                                <a href="{{ url_for('search', query=query, **item.params) }}" class="badge rounded-pill text-decoration-none me-1 {{ 'bg-primary' if item.selected else 'bg-secondary' }}">
+                                    {{ item.label }} ({{ item.count }}){% if item.selected %} &times;{% endif %}
+                                </a>
+                            {% endfor %}
+                        </div>
+                    {% endfor %}
+                </div>
+            {% endif %}
         </div>
     </div>
     
     {% if books %}
         <div class="row row-cols-1 row-cols-md-2 row-cols-lg-3 g-4">
             {% for book in books %}
-                <div class="col">
-                    <div class="card h-100 book-card">
-                        <div class="card-body">
-                            <h5 class="card-title">{{ book.title }}</h5>
-                            <h6 class="card-subtitle mb-2 text-muted">{{ book.author }}</h6>
-                            
-                            <div class="mt-3">
-                                <span class="badge bg-{{ 'success' if book.status == 'available' else 'danger' if book.status == 'issued' else 'warning' if book.status == 'reserved' else 'secondary' }} status-badge status-{{ book.status }}">
-                                    {{ book.status_display() }}
-                                </span>
-                            </div>
-                            
-                            <p class="card-text mt-3">
-                                <strong>Location:</strong> {{ book.location_display() }}
-                            </p>
-                            
-                            <p class="card-text">
-                                <small class="text-muted">ISBN: {{ book.isbn }}</small>
-                            </p>
-                        </div>
-                        <div class="card-footer">
-                            <a href="{{ url_for('book_details', book_id=book.id) }}" class="btn btn-outline-primary btn-sm">View Details</a>
-                        </div>
-                    </div>
-                </div>
+                {{ book_card(book) }}
             {% endfor %}
         </div>
+        
+        {% if page.next_token or request.args.get('after') %}
+            <nav aria-label="Search result pages" class="mt-4">
+                <ul class="pagination justify-content-center">
+                    {% if request.args.get('after') %}
+                        <li class="page-item">
+                            <a class="page-link" href="{{ url_for('search', query=query, **filters) }}">First page</a>
+                        </li>
+                    {% endif %}
+                    {% if page.next_token %}
+                        <li class="page-item">
+                            <a class="page-link" href="{{ url_for('search', query=query, after=page.next_token, **filters) }}">Next page</a>
+                        </li>
+                    {% endif %}
+                </ul>
+            </nav>
+        {% endif %}
     {% else %}
         <div class="alert alert-info" role="alert">
             <h4 class="alert-heading">No books found!</h4>
@@ -352,6 +402,20 @@ def main():
             </a>
         </div>
     {% endif %}
+    
+    {% if close_books %}
+        <div class="row mt-5 mb-3">
+            <div class="col-12">
+                <h4>Close matches</h4>
+                <p class="text-muted">Books with a title or author spelled like "{{ query }}".</p>
+            </div>
+        </div>
+        <div class="row row-cols-1 row-cols-md-2 row-cols-lg-3 g-4">
+            {% for book in close_books %}
+                {{ book_card(book) }}
+            {% endfor %}
+        </div>
+    {% endif %}
 </div>
 {% endblock %}''',
 
@@ -486,6 +550,23 @@ def main():
                     </div>
                 </div>
                 <div class="card-footer">
+                    <div class="d-flex justify-content-between mb-2" id="shelf-neighbors">
+                        {% if previous_book %}
+                            <a href="{{ url_for('book_details', book_id=previous_book.id) }}" class="btn btn-outline-secondary btn-sm" title="{{ previous_book.title }}">
+                                <i data-feather="chevron-left"></i> Previous on shelf
+                            </a>
+                        {% else %}
+                            <span></span>
+                        {% endif %}
+                        {% if next_book %}
+                            <a href="{{ url_for('book_details', book_id=next_book.id) }}" class="btn btn-outline-secondary btn-sm" title="{{ next_book.title }}">
+                                Next on shelf <i data-feather="chevron-right"></i>
+                            </a>
+                        {% endif %}
+                    </div>
+                    <a href="{{ url_for('shelf_view', shelf=book.shelf, column=book.column) }}" class="btn btn-outline-primary btn-sm">
+                        <i data-feather="grid"></i> Browse shelf {{ book.shelf }}
+                    </a>
                     <a href="{{ url_for('index') }}" class="btn btn-outline-secondary btn-sm">
                         <i data-feather="arrow-left"></i> Back to Search
                     </a>
@@ -494,6 +575,92 @@ def main():
         </div>
     </div>
 </div>
+{% endblock %}''',
+
+        'shelf.html': '''{% extends 'base.html' %}
+
+{% block title %}Shelf {{ shelf }} - Library Book Locator{% endblock %}
+
+{% block content %}
+<div class="container">
+    <div class="row mb-4">
+        <div class="col-12">
+            <nav aria-label="breadcrumb">
+                <ol class="breadcrumb">
+                    <li class="breadcrumb-item"><a href="{{ url_for('index') }}">Home</a></li>
+                    {% if column %}
+                        <li class="breadcrumb-item"><a href="{{ url_for('shelf_view', shelf=shelf) }}">Shelf {{ shelf }}</a></li>
+                        <li class="breadcrumb-item active" aria-current="page">Column {{ column }}</li>
+                    {% else %}
+                        <li class="breadcrumb-item active" aria-current="page">Shelf {{ shelf }}</li>
+                    {% endif %}
+                </ol>
+            </nav>
+            <h1>Shelf {{ shelf }}{% if column %}, Column {{ column }}{% endif %}</h1>
+            <p class="lead">{{ page.total_display }} book(s) in shelf order</p>
+            
+            <div id="shelf-columns" class="mb-2">
+                <strong class="me-2">Column:</strong>
+                {% for value, count in column_counts %}
+                    <a href="{{ url_for('shelf_view', shelf=shelf, column=None if value == column else value) }}" class="badge rounded-pill text-decoration-none me-1 {{ 'bg-primary' if value == column else 'bg-secondary' }}">
+                        {{ value }} ({{ count }}){% if value == column %} &times;{% endif %}
+                    </a>
+                {% endfor %}
+            </div>
+        </div>
+    </div>
+    
+    {% if books %}
+        <table class="table table-striped align-middle" id="shelf-books">
+            <thead>
+                <tr>
+                    <th scope="col">Column</th>
+                    <th scope="col">Row</th>
+                    <th scope="col">Title</th>
+                    <th scope="col">Author</th>
+                    <th scope="col">Status</th>
+                </tr>
+            </thead>
+            <tbody>
+                {% for book in books %}
+                    <tr>
+                        <td>{{ book.column }}</td>
+                        <td>{{ book.row }}</td>
+                        <td><a href="{{ url_for('book_details', book_id=book.id) }}">{{ book.title }}</a></td>
+                        <td>{{ book.author }}</td>
+                        <td>
+                            <span class="badge bg-{{ 'success' if book.status == 'available' else 'danger' if book.status == 'issued' else 'warning' if book.status == 'reserved' else 'secondary' }} status-badge status-{{ book.status }}">
+                                {{ book.status_display }}
+                            </span>
+                        </td>
+                    </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+        
+        {% if page.next_token or request.args.get('after') %}
+            <nav aria-label="Shelf pages" class="mt-4">
+                <ul class="pagination justify-content-center">
+                    {% if request.args.get('after') %}
+                        <li class="page-item">
+                            <a class="page-link" href="{{ url_for('shelf_view', shelf=shelf, column=column) }}">First page</a>
+                        </li>
+                    {% endif %}
+                    {% if page.next_token %}
+                        <li class="page-item">
+                            <a class="page-link" href="{{ url_for('shelf_view', shelf=shelf, column=column, after=page.next_token) }}">Next page</a>
+                        </li>
+                    {% endif %}
+                </ul>
+            </nav>
+        {% endif %}
+    {% else %}
+        <div class="alert alert-info" role="alert">
+            <h4 class="alert-heading">No books on this shelf!</h4>
+            <p class="mb-0">There are no books catalogued at shelf {{ shelf }}{% if column %}, column {{ column }}{% endif %}.</p>
+        </div>
+    {% endif %}
+</div>
 {% endblock %}''',
 
         'error.html': '''{% extends 'base.html' %}
@@ -542,11 +709,31 @@ def main():
         app.jinja_loader = DictLoader(embedded_templates)
         logger.info("Falling back to embedded templates only")
     
+    # Template bytecode cache, and compiling every template before the first request
+    import template_cache
+    template_cache.init_app(app)
+    
     # Import models and create tables
     with app.app_context():
         # Define Book model
         class Book(db.Model):
             """Book model representing a library book with location information."""
+            # Secondary indexes for the catalog's access paths, created on existing
+            # databases by migrations.sync_indexes
+            __table_args__ = (
+                # Facet filters: status within category and category within status
+                db.Index('ix_book_category_status', 'category', 'status'),
+                db.Index('ix_book_status_category', 'status', 'category'),
+                # Shelf browsing in physical order, and previous/next on a shelf (see shelf_browse.py)
+                db.Index('ix_book_shelf_order', 'shelf', 'column', 'row', 'id'),
+                # Author listings
+                db.Index('ix_book_author_title', 'author', 'title'),
+                # Recently added books
+                db.Index('ix_book_date_added', 'date_added'),
+                # Row versions, read by id and version alone
+                db.Index('ix_book_id_version', 'id', 'version'),
+            )
+            
             id = db.Column(db.Integer, primary_key=True)
             title = db.Column(db.String(200), nullable=False)
             author = db.Column(db.String(100), nullable=False)
@@ -572,9 +759,26 @@ def main():
             category = db.Column(db.String(50))
             description = db.Column(db.Text)
             
+            # Normalized copies of title and author for searching (see normalize.py)
+            title_norm = db.Column(db.String(400), index=True)
+            author_norm = db.Column(db.String(200), index=True)
+            
+            # Time of the row's last change, sent as Last-Modified (see http_cache.py)
+            updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+            
+            # Row version, bumped by every update; cached pages and ETags are keyed on it
+            # (see page_cache.py and http_cache.py)
+            version = db.Column(db.Integer)
+            __mapper_args__ = {'version_id_col': version}
+            
             def __repr__(self):
                 return f"<Book {self.title} by {self.author}>"
             
+            @validates('isbn')
+            def validate_isbn(self, key, value):
+                """Store valid ISBNs in canonical ISBN-13 form."""
+                return canonical_isbn(value)
+            
             def location_display(self):
                 """Return a formatted string of the book's location."""
                 return f"Shelf {self.shelf}, Column {self.column}, Row {self.row}"
@@ -582,12 +786,11 @@ def main():
             def status_display(self):
                 """Return a human-readable status."""
                 return self.STATUS_CHOICES.get(self.status, self.status)
-                
-        # Create all tables
-        db.create_all()
         
-        # Seed database if empty
-        if Book.query.count() == 0:
+        normalize.track(Book)
+                
+        def seed_catalog():
+            """Add the sample books to the catalog."""
             logger.info("Seeding database with initial data...")
             
             books = [
@@ -728,6 +931,75 @@ def main():
             
             db.session.commit()
             logger.info("Database seeded successfully.")
+        
+        migrations.init_app(app, db, Book, seed=seed_catalog)
+        
+        # Create tables and apply migrations unless this schema is already in place;
+        # a new database is seeded, an existing one only by "flask seed"
+        migrations.ensure_schema(db, Book, migrate_on_start=app.config["MIGRATE_ON_START"],
+                                 seed=seed_catalog)
+    
+    # Replay other processes' changes into the in-process indexes registered below
+    import catalog_sync
+    catalog_sync.init_app(app, db, Book)
+    
+    # Set up the full-text search backend for the configured database, and the
+    # result cache in front of it
+    import search_engine
+    import search_cache
+    import suggest
+    book_search = search_engine.init_app(app, db, Book)
+    result_cache = search_cache.init_app(app, Book)
+    
+    # Rendered book pages, keyed on the row version
+    import page_cache
+    book_pages = page_cache.init_app(app, Book)
+    
+    # Read-only requests go to the read replicas, if any are configured
+    read_replicas.init_app(app, db)
+    
+    # Identical concurrent searches share one execution
+    import single_flight
+    search_flight = single_flight.init_app(app, Book)
+    
+    # Relevance ranking of search candidates
+    if app.config["SEARCH_RANKING"] == "bm25":
+        import ranking
+        ranking.init_app(app, db, Book)
+    
+    # In-memory prefix index behind the search box suggestions
+    suggest_index = suggest.init_app(app, db, Book)
+    
+    # Typo-tolerant index used when a search finds few results
+    import fuzzy
+    fuzzy_index = fuzzy.init_app(app, db, Book)
+    
+    # Streaming JSON search API
+    import search_api
+    
+    # Facet counts for the search filter bar
+    import facets
+    catalog_facets = facets.init_app(app, Book)
+    
+    # Bitsets per status, category, shelf, column and row for filter-only lookups
+    import bitmap_index
+    book_bitmaps = bitmap_index.init_app(app, db, Book)
+    
+    # Shelf listings in physical order and previous/next on a shelf
+    import shelf_browse
+    
+    # Walking routes for pick lists
+    import pick_list
+    floor_plan = pick_list.init_app(app)
+    
+    # Columnar in-memory copy of the catalog that search result pages are filled from
+    if app.config["CATALOG_SNAPSHOT"]:
+        import catalog_snapshot
+        catalog_snapshot.init_app(app, db, Book)
+    
+    # ETag, Last-Modified and Cache-Control of book and search pages, and the catalog generation
+    import http_cache
+    page_validators = http_cache.init_app(app, db, Book)
     
     # Define routes with error handling
     @app.route('/')
@@ -801,15 +1073,60 @@ def main():
             flash('Please enter a search term.', 'warning')
             return redirect(url_for('index'))
         
-        # Search for books by title, author, or ISBN
-        books = Book.query.filter(
-            (Book.title.ilike(f'%{search_query}%')) | 
-            (Book.author.ilike(f'%{search_query}%')) | 
-            (Book.isbn.ilike(f'%{search_query}%'))
-        ).all()
+        # ISBN-shaped queries are resolved with one lookup on the unique index
+        canonical = to_isbn13(search_query)
+        if canonical:
+            book = Book.query.filter_by(isbn=canonical).first()
+            if book:
+                return redirect(url_for('book_details', book_id=book.id))
+        
+        suggest_index.record_search(search_query)
+        
+        # Answer 304 without searching when the client has this page of the current catalog
+        catalog = page_validators.catalog_state(db.session)
+        validators = page_validators.catalog_validators(catalog)
+        page_validators.abort_if_current(validators)
+        generation = catalog[0] if catalog is not None else None
+        
+        # Search for books by title, author, or ISBN, one page at a time
+        cursor = request.values.get('after')
+        page_size = app.config["SEARCH_PAGE_SIZE"]
+        filters = facets.parse_filters(request.values)
+        page = result_cache.get_or_set(
+            search_cache.cache_key(search_query, after=cursor, page_size=page_size,
+                                   generation=generation, **filters),
+            lambda: book_search.paginate(
+                search_query,
+                cursor=cursor,
+                page_size=page_size,
+                count_cap=app.config["SEARCH_COUNT_CAP"],
+                summaries=True,
+                filters=filters
+            )
+        )
+        
+        # Category, status and shelf counts for the filter bar
+        facet_counts = result_cache.get_or_set(
+            search_cache.cache_key(search_query, facets=True, generation=generation, **filters),
+            lambda: book_search.facets(search_query, filters)
+        )
+        books = page.items
+        
+        # Fall back to typo-tolerant matching when the search finds little
+        close_books = []
+        if not cursor and not filters and page.total < app.config["FUZZY_MIN_RESULTS"]:
+            close_books = fuzzy.close_matches(
+                fuzzy_index, Book, search_query,
+                exclude_ids=[book.id for book in books],
+                limit=page_size
+            )
         
         try:
-            return render_template('search_results.html', books=books, query=search_query)
+            return page_validators.respond(render_template(
+                'search_results.html', books=books, page=page,
+                close_books=close_books, query=search_query, filters=filters,
+                facets=facets.facet_groups(facet_counts, filters, Book.STATUS_CHOICES)
+            ), validators)
         except Exception as e:
             logger.error(f"Error rendering search results template: {e}")
             # Fallback search results
@@ -843,8 +1160,8 @@ def main():
                                 <h5 class="card-title">{book.title}</h5>
                                 <h6 class="card-subtitle mb-2 text-muted">{book.author}</h6>
                                 <p class="card-text">
-                                    <strong>Location:</strong> {book.location_display()}<br>
-                                    <strong>Status:</strong> <span class="badge bg-{status_class}">{book.status_display()}</span><br>
+                                    <strong>Location:</strong> {book.location_display}<br>
+                                    <strong>Status:</strong> <span class="badge bg-{status_class}">{book.status_display}</span><br>
                                     <small>ISBN: {book.isbn}</small>
                                 </p>
                             </div>
@@ -874,9 +1191,21 @@ def main():
     @app.route('/book/<int:book_id>')
     def book_details(book_id):
         """Display detailed information about a specific book."""
-        try:
+        def render_page():
             book = Book.query.get_or_404(book_id)
-            return render_template('book_details.html', book=book)
+            previous_book, next_book = shelf_browse.neighbors(Book, book)
+            # Answer 304 without rendering when the client has this version of the page
+            validators = page_validators.book_validators(book, (previous_book, next_book))
+            page_validators.abort_if_current(validators)
+            page = render_template('book_details.html', book=book,
+                                   previous_book=previous_book, next_book=next_book)
+            return (page, validators), book, (previous_book, next_book)
+        
+        try:
+            page, validators = book_pages.get_or_render('book_details', book_id, render_page)
+            return page_validators.respond(page, validators)
+        except http_cache.NotModified:
+            raise
         except Exception as e:
             logger.error(f"Error rendering book details template: {e}")
             # Try to get the book
@@ -986,6 +1315,144 @@ def main():
             </html>
             """
     
+    @app.route('/api/search')
+    def api_search():
+        """Stream search matches as NDJSON or a JSON array."""
+        return search_api.stream_search(
+            book_search,
+            request.args.get('query', ''),
+            fields=request.args.get('fields'),
+            output_format=request.args.get('format', 'ndjson'),
+            limit=request.args.get('limit'),
+            max_limit=app.config["SEARCH_API_MAX_LIMIT"]
+        )
+    
+    @app.route('/api/facets')
+    def api_facets():
+        """Return category, status and shelf counts for a search, or for the whole catalog."""
+        search_query = request.args.get('query', '')
+        filters = facets.parse_filters(request.args)
+        if search_query:
+            counts = book_search.facets(search_query, filters)
+        elif filters:
+            counts = book_bitmaps.facet_counts(facets.FACET_NAMES, filters)
+        else:
+            counts = catalog_facets.counts()
+        return jsonify(facets={
+            name: [{'value': value, 'count': count} for value, count in values]
+            for name, values in counts.items()
+        })
+    
+    @app.route('/api/books')
+    def api_books():
+        """Return a page of books matching status, category, shelf, column and row filters."""
+        after, error = bitmap_index.parse_after(request.args.get('after'))
+        if error:
+            return jsonify(error), 400
+        limit = min(request.args.get('limit', app.config["SEARCH_PAGE_SIZE"], type=int), 100)
+        total, records, next_after = bitmap_index.browse(
+            book_bitmaps, Book,
+            bitmap_index.parse_filters(request.args),
+            after=after,
+            limit=max(limit, 1)
+        )
+        return jsonify(total=total, results=records, next=next_after)
+    
+    @app.route('/shelf/<shelf>')
+    def shelf_view(shelf):
+        """List the books on a shelf in physical order, optionally one column."""
+        column = request.args.get('column')
+        page = shelf_browse.shelf_page(
+            Book, shelf, column,
+            cursor=request.args.get('after'),
+            page_size=app.config["SEARCH_PAGE_SIZE"],
+            count_cap=app.config["SEARCH_COUNT_CAP"]
+        )
+        column_counts = db.session.execute(shelf_browse.column_counts_statement(Book, shelf)).all()
+        try:
+            return render_template('shelf.html', shelf=shelf, column=column, page=page,
+                                   books=page.items, column_counts=column_counts)
+        except Exception as e:
+            logger.error(f"Error rendering shelf template: {e}")
+            # Fallback shelf listing
+            rows = "".join(
+                f"<tr><td>{book.column}</td><td>{book.row}</td>"
+                f"<td><a href=\"/book/{book.id}\">{book.title}</a></td>"
+                f"<td>{book.author}</td><td>{book.status_display}</td></tr>"
+                for book in page.items
+            )
+            return f"""
+            <!DOCTYPE html>
+            <html lang="en" data-bs-theme="dark">
+            <head>
+                <meta charset="UTF-8">
+                <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                <title>Shelf {shelf} - Library Book Locator</title>
+                <link rel="stylesheet" href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css">
+            </head>
+            <body>
+                <div class="container py-5">
+                    <h1>Shelf {shelf}</h1>
+                    <div class="mb-4">
+                        <a href="/" class="btn btn-outline-secondary">Back to Home</a>
+                    </div>
+                    <table class="table">
+                        <thead><tr><th>Column</th><th>Row</th><th>Title</th><th>Author</th><th>Status</th></tr></thead>
+                        <tbody>{rows}</tbody>
+                    </table>
+                </div>
+            </body>
+            </html>
+            """
+    
+    @app.route('/api/shelf/<shelf>')
+    def api_shelf(shelf):
+        """Return a page of the books on a shelf in physical order, with per-column counts."""
+        column = request.args.get('column')
+        limit = min(request.args.get('limit', app.config["SEARCH_PAGE_SIZE"], type=int), 100)
+        page = shelf_browse.shelf_page(
+            Book, shelf, column,
+            cursor=request.args.get('after'),
+            page_size=max(limit, 1),
+            count_cap=app.config["SEARCH_COUNT_CAP"]
+        )
+        column_counts = db.session.execute(shelf_browse.column_counts_statement(Book, shelf)).all()
+        return jsonify(shelf_browse.shelf_payload(shelf, column, page, column_counts))
+    
+    @app.route('/api/pick-list', methods=['GET', 'POST'])
+    def api_pick_list():
+        """Return the requested books in the order of a short walk through the stacks."""
+        ids, isbns, error = pick_list.parse_request(
+            request.args, request.get_json(silent=True), app.config["PICK_LIST_MAX_STOPS"]
+        )
+        if error:
+            return jsonify(error), 400
+        rows = db.session.execute(pick_list.lookup_statement(Book, ids, isbns)).all()
+        books, missing = pick_list.resolve(Book, rows, ids, isbns)
+        route = pick_list.plan_route(floor_plan, books)
+        return jsonify(pick_list.route_payload(route, missing))
+    
+    @app.route('/api/suggest')
+    def suggest_completions():
+        """Return title and author completions for a search-box prefix."""
+        prefix = request.args.get('prefix', '')
+        limit = min(request.args.get('limit', app.config["SUGGEST_LIMIT"], type=int), suggest.MAX_SUGGESTIONS)
+        completions = suggest_index.suggest(prefix, max(limit, 1))
+        return jsonify(
+            prefix=prefix,
+            suggestions=[{'text': text, 'type': field} for field, text in completions]
+        )
+    
+    @app.route('/api/stats')
+    def stats():
+        """Report cache, coalescing and read replica counters as JSON."""
+        return jsonify(
+            search_cache=result_cache.stats(),
+            page_cache=book_pages.stats(),
+            single_flight=search_flight.stats(),
+            read_replicas=read_replicas.replica_stats()
+        )
+    
     @app.errorhandler(404)
     def page_not_found(e):
         """Handle 404 errors."""
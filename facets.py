@@ -0,0 +1,132 @@
+"""
+Facet counts for the search results sidebar.
+
+Counts for category, status and shelf come from a single grouped query over
+the result set (``GROUP BY category, status, shelf``); the per-facet totals
+are then summed in Python, so adding a facet doesn't add a query. Counts for
+the whole, unfiltered catalog are cached and refreshed after any committed
+change to a book.
+"""
+import logging
+import threading
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import func
+
+import model_events
+
+logger = logging.getLogger(__name__)
+
+# (column, heading) for each facet, in display order
+FACET_FIELDS = (
+    ('category', 'Category'),
+    ('status', 'Status'),
+    ('shelf', 'Shelf'),
+)
+
+FACET_NAMES = tuple(name for name, label in FACET_FIELDS)
+
+
+def parse_filters(args):
+    """Return the facet filters present in request arguments, e.g. ``{'status': 'available'}``."""
+    return {name: args.get(name) for name in FACET_NAMES if args.get(name)}
+
+
+def apply_filters(books, model, filters):
+    """Narrow a query of books to those matching every facet filter."""
+    for name, value in (filters or {}).items():
+        books = books.filter(getattr(model, name) == value)
+    return books
+
+
+def facet_counts_query(books, model):
+    """Return the grouped query behind facet_counts: one row per category, status and shelf combination."""
+    columns = [getattr(model, name) for name in FACET_NAMES]
+    return books.order_by(None).with_entities(*columns, func.count()).group_by(*columns)
+
+
+def tally_facets(rows):
+    """
+    Sum the rows of facet_counts_query into per-facet counts.
+
+    Returns ``{facet: [(value, count), ...]}`` with the largest counts first.
+    """
+    counts = {name: Counter() for name in FACET_NAMES}
+    for row in rows:
+        for name, value in zip(FACET_NAMES, row):
+            if value is not None:
+                counts[name][value] += row[-1]
+    return {
+        name: sorted(counter.items(), key=lambda item: (-item[1], str(item[0])))
+        for name, counter in counts.items()
+    }
+
+
+def facet_counts(books, model):
+    """Count the books of a query per category, status and shelf in one grouped query (see tally_facets)."""
+    return tally_facets(facet_counts_query(books, model).all())
+
+
+def facet_groups(counts, filters, status_choices):
+    """
+    Shape facet counts for the template.
+
+    Each value carries the query-string filters its link should apply;
+    clicking a selected value removes that filter again.
+    """
+    groups = []
+    for name, label in FACET_FIELDS:
+        values = []
+        for value, count in counts.get(name, ()):
+            selected = filters.get(name) == value
+            params = dict(filters)
+            if selected:
+                params.pop(name)
+            else:
+                params[name] = value
+            values.append({
+                'value': value,
+                'label': status_choices.get(value, value) if name == 'status' else value,
+                'count': count,
+                'selected': selected,
+                'params': params,
+            })
+        if values:
+            groups.append({'name': name, 'label': label, 'values': values})
+    return groups
+
+
+class CatalogFacets:
+    """Cached facet counts for the unfiltered catalog."""
+
+    def __init__(self, model):
+        self.model = model
+        self._counts = None
+        self._lock = threading.Lock()
+
+    def counts(self):
+        """Return the catalog-wide counts, computing them on first use after a change."""
+        counts = self._counts
+        if counts is None:
+            with self._lock:
+                if self._counts is None:
+                    self._counts = facet_counts(self.model.query, self.model)
+                counts = self._counts
+        return counts
+
+    def invalidate(self):
+        self._counts = None
+
+
+def init_app(app, model):
+    """Register cached catalog facets for an app, invalidated on every change to ``model``."""
+    catalog = CatalogFacets(model)
+    model_events.subscribe(model, lambda op, row: catalog.invalidate())
+    app.extensions['catalog_facets'] = catalog
+    return catalog
+
+
+def get_catalog_facets():
+    """Return the catalog facets registered on the current app."""
+    return current_app.extensions['catalog_facets']
@@ -0,0 +1,226 @@
+"""
+Typo-tolerant matching of title and author words.
+
+A SymSpell-style index: every indexed word is stored under each variant
+obtained by deleting up to ``max_distance`` characters from its first
+``prefix_length`` characters. A misspelled query word generates its own
+deletes, and any word sharing one of them is a candidate within the edit
+distance, confirmed with a bounded Damerau-Levenshtein check. Lookup cost
+depends on the query word, not on the size of the catalog.
+
+Only used when the regular search returns few results.
+"""
+import logging
+import re
+import threading
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import select
+
+import lazy_index
+import model_events
+import projection
+
+logger = logging.getLogger(__name__)
+
+FUZZY_FIELDS = ('title', 'author')
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def words(value):
+    """Split a value into lowercase words."""
+    return _WORD_RE.findall((value or '').casefold())
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance between ``a`` and ``b``.
+
+    Returns ``max_distance + 1`` as soon as the distance is known to exceed
+    ``max_distance``.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous_previous is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class SymSpellIndex(lazy_index.LazyIndex):
+    """Deletion-neighborhood index from words to the books containing them."""
+
+    def __init__(self, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self._deletes = defaultdict(set)
+        self._postings = defaultdict(set)
+        self._books = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._postings)
+
+    def _distance_for(self, word):
+        """Allowed edits for a word: none for very short words, fewer for short ones."""
+        if len(word) < 3:
+            return 0
+        if len(word) <= 5:
+            return min(1, self.max_distance)
+        return self.max_distance
+
+    def _variants(self, word, distance):
+        prefix = word[:self.prefix_length]
+        variants = {prefix}
+        frontier = {prefix}
+        for _ in range(distance):
+            next_frontier = set()
+            for variant in frontier:
+                for i in range(len(variant)):
+                    next_frontier.add(variant[:i] + variant[i + 1:])
+            variants |= next_frontier
+            frontier = next_frontier
+        return variants
+
+    def _add_word(self, word, book_id):
+        ids = self._postings[word]
+        if not ids:
+            for variant in self._variants(word, self.max_distance):
+                self._deletes[variant].add(word)
+        ids.add(book_id)
+
+    def _remove_word(self, word, book_id):
+        ids = self._postings.get(word)
+        if ids is None:
+            return
+        ids.discard(book_id)
+        if ids:
+            return
+        del self._postings[word]
+        for variant in self._variants(word, self.max_distance):
+            candidates = self._deletes.get(variant)
+            if candidates is not None:
+                candidates.discard(word)
+                if not candidates:
+                    del self._deletes[variant]
+
+    def add_book(self, book_id, values):
+        """Index the words of a book, replacing any earlier version."""
+        book_words = {word for value in values for word in words(value)}
+        with self._lock:
+            for word in self._books.pop(book_id, ()):
+                self._remove_word(word, book_id)
+            for word in book_words:
+                self._add_word(word, book_id)
+            self._books[book_id] = book_words
+
+    def remove_book(self, book_id):
+        """Drop a book from the index if it is present."""
+        with self._lock:
+            for word in self._books.pop(book_id, ()):
+                self._remove_word(word, book_id)
+
+    def apply_change(self, op, row):
+        if op == 'delete':
+            self.remove_book(row['id'])
+        else:
+            self.add_book(row['id'], [row.get(field) for field in FUZZY_FIELDS])
+
+    def corrections(self, word):
+        """Return ``{indexed_word: distance}`` for words within the allowed distance."""
+        distance = self._distance_for(word)
+        if distance == 0:
+            return {word: 0} if word in self._postings else {}
+        found = {}
+        for variant in self._variants(word, distance):
+            for candidate in self._deletes.get(variant, ()):
+                if candidate in found:
+                    continue
+                d = edit_distance(word, candidate, distance)
+                if d <= distance:
+                    found[candidate] = d
+        return found
+
+    def search(self, query, limit=20):
+        """
+        Return up to ``limit`` book ids matching every query word within the
+        allowed edit distance, closest first.
+        """
+        query_words = words(query)
+        if not query_words:
+            return []
+        self.ensure_loaded()
+        with self._lock:
+            scores = None
+            for word in query_words:
+                word_scores = {}
+                for candidate, distance in self.corrections(word).items():
+                    for book_id in self._postings.get(candidate, ()):
+                        best = word_scores.get(book_id)
+                        if best is None or distance < best:
+                            word_scores[book_id] = distance
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {book_id: scores[book_id] + distance
+                              for book_id, distance in word_scores.items() if book_id in scores}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (item[1], item[0]))
+        return [book_id for book_id, distance in ranked[:limit]]
+
+
+def close_match_ids(index, query, exclude_ids=(), limit=20):
+    """Return up to ``limit`` ids of books close to the query, closest first, skipping ``exclude_ids``."""
+    exclude_ids = set(exclude_ids)
+    return [book_id for book_id in index.search(query, limit + len(exclude_ids))
+            if book_id not in exclude_ids][:limit]
+
+
+def close_matches(index, model, query, exclude_ids=(), limit=20):
+    """
+    Return BookSummary records for books whose words are within the edit
+    distance of the query, closest first.
+    """
+    ids = close_match_ids(index, query, exclude_ids, limit)
+    if not ids:
+        return []
+    rows = model.query.session.execute(projection.summaries_by_id(model, ids)).all()
+    make_summary = projection.summary_factory(model)
+    return [make_summary(row) for row in rows]
+
+
+def init_app(app, db, model):
+    """Register a fuzzy-match index for an app, built from ``model`` on first use and kept current."""
+    index = SymSpellIndex(max_distance=app.config.get('FUZZY_MAX_DISTANCE', 2))
+    fields = [getattr(model, field) for field in FUZZY_FIELDS]
+
+    def build(index):
+        with app.app_context():
+            with db.engine.connect() as conn:
+                for row in conn.execute(select(model.id, *fields)):
+                    index.add_book(row[0], row[1:])
+        logger.info(f"Built fuzzy-match index with {len(index)} words")
+
+    index.defer(build)
+    lazy_index.on_warm_up(app, index.ensure_loaded)
+    model_events.subscribe(model, index.changed)
+    app.extensions['fuzzy_index'] = index
+    return index
+
+
+def get_fuzzy_index():
+    """Return the fuzzy-match index registered on the current app."""
+    return current_app.extensions['fuzzy_index']
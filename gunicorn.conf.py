@@ -0,0 +1,50 @@
+"""
+Gunicorn settings, read automatically from the working directory.
+
+With ``preload_app`` the application is imported once in the master, and
+``when_ready`` warms it up there (see lazy_index.py): the in-memory indexes
+are built and the templates compiled before any worker starts. Every worker
+is a fork of it, ready for its first request, instead of repeating that
+work. Database connections must not be shared across processes, so
+``post_fork`` drops the pooled connections each worker inherits; it opens its
+own on first use. Set ``GUNICORN_PRELOAD=false`` to import the app in each
+worker instead, where ``post_worker_init`` warms it up.
+"""
+import os
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def _warm_up(app):
+    # ASGI workers serve asgi.py, which warms the Flask app up in its lifespan
+    if not hasattr(app, 'extensions'):
+        return
+    # Imported here: the app's directory is on sys.path once the app is loaded
+    from lazy_index import warm_up
+    warm_up(app)
+
+
+def when_ready(server):
+    """Warm up a preloaded app in the master, before the workers are forked."""
+    if server.cfg.preload_app:
+        _warm_up(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    """Warm up the app a worker loaded itself."""
+    if not worker.cfg.preload_app:
+        _warm_up(worker.wsgi)
+
+
+def post_fork(server, worker):
+    """Discard the database connections a preloaded worker inherits from the master."""
+    if not server.cfg.preload_app:
+        return
+    app = worker.app.wsgi()
+    db = getattr(app, 'extensions', {}).get('sqlalchemy')
+    if db is None:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the sockets to the master rather than closing them under it
+            engine.dispose(close=False)
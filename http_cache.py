@@ -0,0 +1,188 @@
+"""
+Conditional requests and Cache-Control for book and search pages.
+
+Browsers, kiosks and any CDN in front of the app keep their copy of a page and
+revalidate it with ``If-None-Match`` or ``If-Modified-Since``. When the copy
+is current the app answers 304 before running the search or rendering a
+template.
+
+* A book page's strong ETag hashes the book's row version (``Book.version``)
+  and the id and title of the neighbours it links to. Its Last-Modified is the
+  book's ``updated_at``, which doesn't move when only a neighbour changes, so
+  only the ETag catches that.
+* A search page depends on the whole catalog and is validated against the
+  catalog generation (see catalog_generation.py). Search results are cached
+  under the generation too, and the in-process indexes, the catalog snapshot
+  among them, catch up with other processes' changes before each request
+  (see catalog_sync.py), so a page never carries a newer ETag than its
+  results.
+
+Every ETag also covers the app's templates, the schema fingerprint (data
+rewritten by a migration is fetched again) and ``HTTP_CACHE_SALT``, which
+defaults to the deployed commit on Render and Vercel. Responses say
+``Cache-Control: public, max-age=HTTP_CACHE_MAX_AGE,
+stale-while-revalidate=HTTP_CACHE_STALE_WHILE_REVALIDATE``: a cache may keep
+serving a copy that has just gone stale while it revalidates in the
+background. Pages showing flash messages belong to one client and are sent
+with ``no-store`` instead.
+"""
+import hashlib
+import logging
+from datetime import timezone
+
+from flask import current_app, make_response, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+import catalog_generation
+import migrations
+import page_cache
+
+logger = logging.getLogger(__name__)
+
+# Methods a conditional request is answered with 304 for
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+def last_modified_time(value):
+    """Return a naive UTC datetime as the aware, whole-second time HTTP dates carry."""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def is_current(headers, validators):
+    """
+    Return whether the copy a conditional request holds is still current.
+
+    ``validators`` is the page's ``(etag, last_modified)``. As in RFC 9110,
+    ``If-None-Match`` is compared weakly with the ETag, and only without it is
+    ``If-Modified-Since`` compared with the Last-Modified time.
+    """
+    etag, last_modified = validators
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    if_modified_since = parse_date(headers.get('If-Modified-Since'))
+    return last_modified is not None and if_modified_since is not None and last_modified <= if_modified_since
+
+
+def release_salt(app, db, salt=''):
+    """Return a hash of ``salt``, the schema fingerprint and the source of every template the app can load."""
+    digest = hashlib.sha256(salt.encode())
+    with app.app_context():
+        digest.update(migrations.schema_fingerprint(db).encode())
+    env = app.jinja_env
+    try:
+        names = env.list_templates()
+    except TypeError:
+        # A loader that can't list its templates
+        logger.warning("Template sources not covered by ETags: the template loader can't list them")
+        names = []
+    for name in names:
+        source, _, _ = env.loader.get_source(env, name)
+        digest.update(name.encode())
+        digest.update(source.encode())
+    return digest.hexdigest()[:16]
+
+
+class NotModified(HTTPException):
+    """Raised to answer a request with 304 before its page is rendered."""
+
+    code = 304
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+    def get_response(self, environ=None, scope=None):
+        return self.response
+
+
+class HttpCache:
+    """Validators and caching headers for an app's pages."""
+
+    def __init__(self, salt, max_age=0, stale_while_revalidate=60, catalog=True):
+        self.salt = salt
+        # Whether the database keeps a catalog generation
+        self.catalog = catalog
+        directives = ['public', f'max-age={max_age}']
+        if stale_while_revalidate:
+            directives.append(f'stale-while-revalidate={stale_while_revalidate}')
+        self.cache_control = ', '.join(directives)
+
+    def _etag(self, *parts):
+        digest = hashlib.sha256(self.salt.encode())
+        for part in parts:
+            digest.update(repr(part).encode())
+        return digest.hexdigest()[:32]
+
+    def book_validators(self, book, neighbors):
+        """Return ``(etag, last_modified)`` for a book's page, which links ``neighbors`` (None at a shelf end)."""
+        links = [(other.id, other.title) if other is not None else None for other in neighbors]
+        return self._etag('book', book.id, book.version, links), last_modified_time(book.updated_at)
+
+    def catalog_state(self, session):
+        """Return the catalog's ``(generation, changed_at)`` as ``session`` sees it, or None without one."""
+        return catalog_generation.current(session) if self.catalog else None
+
+    def catalog_validators(self, state):
+        """Return ``(etag, last_modified)`` for a page of the whole catalog at ``state``, or None without one."""
+        if state is None:
+            return None
+        generation, changed_at = state
+        return self._etag('catalog', generation), last_modified_time(changed_at)
+
+    def headers(self, validators):
+        """Return the caching headers of a page with ``validators``."""
+        if validators is None:
+            return {}
+        etag, last_modified = validators
+        headers = {'ETag': quote_etag(etag), 'Cache-Control': self.cache_control}
+        if last_modified is not None:
+            headers['Last-Modified'] = http_date(last_modified)
+        return headers
+
+    def _conditional(self, validators):
+        return (validators is not None and request.method in CONDITIONAL_METHODS
+                and page_cache.cacheable() and is_current(request.headers, validators))
+
+    def not_modified(self, validators):
+        """Return a 304 response for a page with ``validators``."""
+        return make_response('', 304, self.headers(validators))
+
+    def abort_if_current(self, validators):
+        """Raise NotModified if the client's copy of the page is current, so the page isn't rendered."""
+        if self._conditional(validators):
+            raise NotModified(self.not_modified(validators))
+
+    def respond(self, page, validators):
+        """Return the response for a rendered page: 304 if the client's copy is current, else the page with its validators."""
+        if not page_cache.cacheable():
+            return make_response(page, {'Cache-Control': 'no-store'})
+        if self._conditional(validators):
+            return self.not_modified(validators)
+        return make_response(page, self.headers(validators))
+
+
+def init_app(app, db, model):
+    """Validate an app's pages against ``model``'s row versions and the catalog generation it keeps."""
+    with app.app_context():
+        catalog = catalog_generation.current(db.session) is not None
+    if catalog:
+        catalog_generation.track(model)
+    else:
+        logger.warning("Search pages are sent without validators until \"flask init-db\" creates catalog_changes")
+    cache = HttpCache(
+        release_salt(app, db, app.config.get('HTTP_CACHE_SALT') or ''),
+        max_age=app.config.get('HTTP_CACHE_MAX_AGE', 0),
+        stale_while_revalidate=app.config.get('HTTP_CACHE_STALE_WHILE_REVALIDATE', 60),
+        catalog=catalog
+    )
+    app.extensions['http_cache'] = cache
+    return cache
+
+
+def get_http_cache():
+    """Return the HTTP cache settings registered on the current app."""
+    return current_app.extensions['http_cache']
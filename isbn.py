@@ -0,0 +1,57 @@
+"""
+ISBN parsing and normalization.
+
+Scanner stations send ISBNs with hyphens or spaces, in ISBN-10 form, or with
+a lowercase 'x' check digit. ``to_isbn13`` turns any valid form into the
+canonical 13-digit string stored in ``Book.isbn``, so a lookup is a single
+equality match on the unique index.
+"""
+import re
+
+_SEPARATORS_RE = re.compile(r"[\s\-]")
+_PREFIX_RE = re.compile(r"^isbn(?:-1[03])?:?", re.IGNORECASE)
+_ISBN10_RE = re.compile(r"^\d{9}[\dX]$")
+_ISBN13_RE = re.compile(r"^97[89]\d{10}$")
+
+
+def _compact(value):
+    value = _PREFIX_RE.sub('', value.strip())
+    return _SEPARATORS_RE.sub('', value).upper()
+
+
+def isbn10_check_digit(first_nine):
+    """Return the ISBN-10 check character for nine digits."""
+    total = sum((10 - i) * int(digit) for i, digit in enumerate(first_nine))
+    check = (11 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+
+def isbn13_check_digit(first_twelve):
+    """Return the ISBN-13 check digit for twelve digits."""
+    total = sum(int(digit) * (1 if i % 2 == 0 else 3) for i, digit in enumerate(first_twelve))
+    return str((10 - total % 10) % 10)
+
+
+def to_isbn13(value):
+    """
+    Return the canonical ISBN-13 for ``value``, or None if it isn't a valid ISBN.
+
+    Accepts ISBN-10 and ISBN-13, with or without hyphens, spaces or an "ISBN"
+    prefix. The check digit must be correct.
+    """
+    if not value:
+        return None
+    compact = _compact(value)
+    if _ISBN13_RE.match(compact):
+        return compact if isbn13_check_digit(compact[:12]) == compact[12] else None
+    if _ISBN10_RE.match(compact):
+        if isbn10_check_digit(compact[:9]) != compact[9]:
+            return None
+        first_twelve = '978' + compact[:9]
+        return first_twelve + isbn13_check_digit(first_twelve)
+    return None
+
+
+def canonical_isbn(value):
+    """Return the canonical ISBN-13 for a valid ISBN, or the value unchanged otherwise."""
+    return to_isbn13(value) or value
@@ -0,0 +1,124 @@
+"""
+In-process indexes built on first use, and warming them up ahead of it.
+
+The suggestion, fuzzy-match, bitmap and n-gram indexes, the catalog snapshot
+and the BM25 statistics are built by reading the book table. Creating the app
+doesn't build them: importing ``app`` (under gunicorn, uvicorn or a Vercel
+cold start) only checks the schema. Each index is built by the first call
+that reads it, or ahead of the first request by ``warm_up``, which
+gunicorn.conf.py calls once the app is loaded (in the master with
+``preload_app``, so workers fork with the indexes built) and asgi.py calls at
+startup.
+
+Committed changes arrive through model_events while an index builds. Until
+the build starts they are dropped, as the table it reads already has them;
+while it runs they are queued and applied once it finishes, since the build
+may have read the rows before the change.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LazyIndex:
+    """
+    Mixin for an index that ``defer`` leaves to be built on first use.
+
+    Subclasses call ``ensure_loaded()`` before reading their data and
+    implement ``apply_change(op, row)`` for model_events changes, which
+    reach them through ``changed``. An index nobody deferred is complete as
+    constructed.
+    """
+
+    loaded = True
+    _build = None
+    _pending = None
+    _builder = None
+
+    def defer(self, build):
+        """Build the index with ``build(self)`` when it is first needed, instead of now."""
+        self._build = build
+        self._pending = None
+        self._build_lock = threading.RLock()
+        self._change_lock = threading.Lock()
+        self.loaded = False
+
+    def ensure_loaded(self):
+        """Build the index now if it was deferred and isn't built yet."""
+        if self.loaded:
+            return
+        with self._build_lock:
+            # Built by another thread meanwhile, or by this one further up the stack
+            if self.loaded or self._pending is not None:
+                return
+            with self._change_lock:
+                self._pending = []
+            start = time.perf_counter()
+            try:
+                self._build(self)
+            except Exception:
+                with self._change_lock:
+                    self._pending = None
+                raise
+            with self._change_lock:
+                for op, row in self._pending:
+                    self.apply_change(op, row)
+                self._pending = None
+                self.loaded = True
+            logger.info(f"Built {type(self).__name__} in {time.perf_counter() - start:.2f}s")
+
+    def ready(self):
+        """
+        Return whether the index is built, starting its build in a background thread if not.
+
+        For callers that can do without the index until then rather than wait for it.
+        """
+        if self.loaded:
+            return True
+        with self._change_lock:
+            if self._builder is None or not self._builder.is_alive():
+                self._builder = threading.Thread(target=self._build_quietly, daemon=True,
+                                                 name=f'{type(self).__name__}-build')
+                self._builder.start()
+        return False
+
+    def _build_quietly(self):
+        try:
+            self.ensure_loaded()
+        except Exception as e:
+            # Retried by the next ready() or ensure_loaded()
+            logger.error(f"Could not build {type(self).__name__}: {e}")
+
+    def changed(self, op, row):
+        """model_events subscriber: apply a committed change, queue it during the build, or drop it before."""
+        if not self.loaded:
+            with self._change_lock:
+                if self._pending is not None:
+                    self._pending.append((op, row))
+                    return
+                if not self.loaded:
+                    return
+        self.apply_change(op, row)
+
+    def apply_change(self, op, row):
+        raise NotImplementedError
+
+
+def on_warm_up(app, step):
+    """Have ``warm_up(app)`` call ``step()``; steps run in the order they were added."""
+    app.extensions.setdefault('warm_up', []).append(step)
+
+
+def warm_up(app):
+    """Build an app's deferred indexes and run its other warm-up steps, in an app context."""
+    start = time.perf_counter()
+    with app.app_context():
+        for step in app.extensions.get('warm_up', ()):
+            try:
+                step()
+            except Exception as e:
+                # Whatever failed is retried on first use
+                logger.error(f"Warm-up step {getattr(step, '__qualname__', step)} failed: {e}")
+    logger.info(f"Warmed up in {time.perf_counter() - start:.2f}s")
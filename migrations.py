@@ -0,0 +1,429 @@
+"""
+Online schema migrations for the book table.
+
+``db.create_all()`` creates missing tables but never changes an existing
+one, so columns and indexes added to the model after a catalog was created
+are applied here:
+
+* Numbered migrations in ``MIGRATIONS`` run once each, in order, and are
+  recorded in the ``schema_migrations`` table. Data changes are made by
+  ``backfill`` in small batches walked by primary key, each batch in its own
+  transaction, so a live catalog is never locked for the whole table.
+* Indexes are declared on the model (``index=True`` and ``__table_args__``);
+  ``sync_indexes`` creates whichever are missing. On PostgreSQL this uses
+  ``CREATE INDEX CONCURRENTLY``, which doesn't block writes, and rebuilds
+  indexes left invalid by an interrupted concurrent build.
+
+Workers starting together take turns: on PostgreSQL through an advisory
+lock, and on SQLite through an ``flock`` on a file next to the database, so
+workers started without ``preload_app`` never migrate at once. On
+PostgreSQL, DDL also waits at most ``LOCK_TIMEOUT`` for its lock instead of
+queueing behind long-running queries. Runs as ``flask init-db`` (or ``flask migrate``)
+and, when ``MIGRATE_ON_START`` is set, at startup.
+
+Startup doesn't inspect the database: ``ensure_schema`` hashes the DDL of the
+models and the list of migrations, and looks the hash up in
+``schema_migrations`` with one query. Only a database that hasn't been
+brought up to this exact schema gets ``create_all`` and ``migrate``, so that
+work happens once per deployment rather than once per worker.
+"""
+import hashlib
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, bindparam, column, inspect, select, text, update
+from sqlalchemy import table as table_clause
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import catalog_generation
+from isbn import canonical_isbn
+from normalize import NORMALIZED_COLUMNS, normalize_text
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Rows read and written per backfill transaction
+BACKFILL_BATCH_SIZE = 500
+
+# Longest a PostgreSQL DDL statement waits for its table lock
+LOCK_TIMEOUT = '5s'
+
+# Key of the PostgreSQL advisory lock held while migrating
+ADVISORY_LOCK_KEY = 7265431
+
+# Suffix of the file locked next to a SQLite database while migrating
+SQLITE_LOCK_SUFFIX = '.migrate-lock'
+
+# Prefix of the schema_migrations rows that record a schema fingerprint
+FINGERPRINT_PREFIX = 'schema:'
+
+_metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('id', String(100), primary_key=True),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# (id, function) in the order they run
+MIGRATIONS = []
+
+
+def migration(migration_id):
+    """Register ``func(db, model)`` as the migration ``migration_id``."""
+    def register(func):
+        MIGRATIONS.append((migration_id, func))
+        return func
+    return register
+
+
+def _is_postgres(db):
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _quote(db, name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+
+def add_column(db, model, name):
+    """Add the model's column ``name`` to its table if the table doesn't have it yet."""
+    table = model.__table__
+    existing = {col['name'] for col in inspect(db.engine).get_columns(table.name)}
+    if name in existing:
+        return
+    column_type = table.c[name].type.compile(dialect=db.engine.dialect)
+    with db.engine.begin() as conn:
+        if _is_postgres(db):
+            conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        # Nullable and without a default, so no database rewrites the table
+        conn.execute(text(f"ALTER TABLE {_quote(db, table.name)} ADD COLUMN {_quote(db, name)} {column_type}"))
+    logger.info(f"Added column {table.name}.{name}")
+
+
+def drop_index(db, name):
+    """Drop an index if it exists, without blocking writes on PostgreSQL."""
+    if _is_postgres(db):
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f"SET lock_timeout = '{LOCK_TIMEOUT}'"))
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(db, name)}"))
+    else:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {_quote(db, name)}"))
+    logger.info(f"Dropped index {name}")
+
+
+def _update_rows(table_name, names):
+    """
+    Return an UPDATE of the columns ``names`` in the row ``:row_id``, to the values ``:new_<name>``.
+
+    Unlike ``Table.update()`` it leaves ``onupdate`` columns such as
+    ``updated_at`` alone, since earlier migrations run before they exist.
+    """
+    target = table_clause(table_name, column('id'), *(column(name) for name in names))
+    return update(target).where(target.c.id == bindparam('row_id')).values(
+        {name: bindparam(f'new_{name}') for name in names})
+
+
+def backfill(db, model, columns, transform, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Rewrite rows of ``model`` in batches.
+
+    ``columns`` are read for every row in primary key order and
+    ``transform(values)`` returns a dict of new column values, or None to
+    leave the row alone. Each batch is committed separately, and its rows
+    are written with one executemany per set of columns changed. Returns
+    the number of rows changed.
+    """
+    table = model.__table__
+    read = [table.c.id] + [table.c[name] for name in columns]
+    last_id = None
+    changed = 0
+    while True:
+        with db.engine.begin() as conn:
+            query = select(*read).order_by(table.c.id).limit(batch_size)
+            if last_id is not None:
+                query = query.where(table.c.id > last_id)
+            rows = conn.execute(query).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = {}
+            for row in rows:
+                values = transform(dict(zip(columns, row[1:])))
+                if values:
+                    params = {f'new_{name}': value for name, value in values.items()}
+                    updates.setdefault(tuple(sorted(values)), []).append(dict(params, row_id=row[0]))
+            for names, params in updates.items():
+                conn.execute(_update_rows(table.name, names), params)
+                changed += len(params)
+    return changed
+
+
+@migration('0001_normalized_search_columns')
+def add_normalized_search_columns(db, model):
+    """Add title_norm and author_norm (see normalize.py) and fill them in."""
+    for name in NORMALIZED_COLUMNS.values():
+        add_column(db, model, name)
+
+    def normalized(values):
+        updates = {}
+        for source, name in NORMALIZED_COLUMNS.items():
+            value = normalize_text(values[source])
+            if values[name] != value:
+                updates[name] = value
+        return updates
+
+    columns = list(NORMALIZED_COLUMNS) + list(NORMALIZED_COLUMNS.values())
+    changed = backfill(db, model, columns, normalized)
+    logger.info(f"Normalized search columns for {changed} rows")
+
+
+@migration('0002_canonical_isbns')
+def canonicalize_isbns(db, model):
+    """Store ISBNs written before validation was added in canonical ISBN-13 form."""
+    with db.engine.connect() as conn:
+        taken = set(conn.execute(select(model.__table__.c.isbn)).scalars())
+
+    def canonical(values):
+        isbn = canonical_isbn(values['isbn'])
+        if isbn == values['isbn']:
+            return None
+        if isbn in taken:
+            logger.warning(f"Leaving ISBN {values['isbn']!r} as is: {isbn} belongs to another book")
+            return None
+        taken.add(isbn)
+        return {'isbn': isbn}
+
+    changed = backfill(db, model, ['isbn'], canonical)
+    logger.info(f"Canonicalized {changed} ISBNs")
+
+
+@migration('0003_drop_location_index')
+def drop_location_index(db, model):
+    """ix_book_location is superseded by ix_book_shelf_order, which ends with id for keyset seeks."""
+    drop_index(db, 'ix_book_location')
+
+
+@migration('0004_row_versions')
+def add_row_versions(db, model):
+    """Add the version column SQLAlchemy bumps on every update, starting existing rows at 1."""
+    add_column(db, model, 'version')
+    changed = backfill(db, model, ['version'],
+                       lambda values: {'version': 1} if values['version'] is None else None)
+    logger.info(f"Set the row version of {changed} rows")
+
+
+@migration('0005_updated_at')
+def add_updated_at(db, model):
+    """Add the time of each row's last change, starting existing rows at the time they were added."""
+    add_column(db, model, 'updated_at')
+    changed = backfill(db, model, ['date_added', 'updated_at'],
+                       lambda values: {'updated_at': values['date_added'] or datetime.utcnow()}
+                       if values['updated_at'] is None else None)
+    logger.info(f"Set the update time of {changed} rows")
+
+
+@migration('0006_catalog_generation')
+def add_catalog_generation(db, model):
+    """Create the catalog_state row that counts changes to the catalog (see catalog_generation.py)."""
+    catalog_generation.create(db.engine)
+
+
+@migration('0007_catalog_change_log')
+def add_catalog_change_log(db, model):
+    """Log changed books with their generation instead of counting changes in one row (see catalog_generation.py)."""
+    catalog_generation.create_change_log(db.engine)
+
+
+def _invalid_indexes(conn, table_name):
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_class t ON t.oid = i.indrelid "
+        "WHERE t.relname = :table AND NOT i.indisvalid"
+    ), {'table': table_name})
+    return {row[0] for row in rows}
+
+
+def sync_indexes(db, model):
+    """Create the indexes declared on ``model`` that its table doesn't have yet."""
+    table = model.__table__
+    postgres = _is_postgres(db)
+    existing = {index['name'] for index in inspect(db.engine).get_indexes(table.name)}
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if postgres:
+            conn.execute(text(f"SET lock_timeout = '{LOCK_TIMEOUT}'"))
+            for name in _invalid_indexes(conn, table.name):
+                logger.warning(f"Rebuilding invalid index {name}")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {_quote(db, name)}"))
+                existing.discard(name)
+
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            columns = ', '.join(_quote(db, col.name) for col in index.columns)
+            unique = 'UNIQUE ' if index.unique else ''
+            concurrently = 'CONCURRENTLY ' if postgres else ''
+            conn.execute(text(
+                f"CREATE {unique}INDEX {concurrently}IF NOT EXISTS {_quote(db, index.name)} "
+                f"ON {_quote(db, table.name)} ({columns})"
+            ))
+            logger.info(f"Created index {index.name}")
+
+
+def _sqlite_lock_path(db):
+    database = db.engine.url.database
+    if not database or database == ':memory:':
+        return None
+    # URI filenames, like the read-only catalog's (see readonly_catalog.py)
+    if database.startswith('file:'):
+        database = database[len('file:'):]
+    return database + SQLITE_LOCK_SUFFIX
+
+
+@contextmanager
+def _migration_lock(db):
+    """Hold the lock that makes processes migrate one at a time."""
+    if _is_postgres(db):
+        lock = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {'key': ADVISORY_LOCK_KEY})
+        try:
+            yield
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': ADVISORY_LOCK_KEY})
+            lock.close()
+        return
+    path = _sqlite_lock_path(db) if db.engine.dialect.name == 'sqlite' and fcntl is not None else None
+    if path is None:
+        yield
+        return
+    try:
+        lock_file = open(path, 'a+b')
+    except OSError as e:
+        logger.warning(f"Migrating without a lock; could not open {path}: {e}")
+        yield
+        return
+    with lock_file:
+        # Released when the file is closed
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _migrate(db, model):
+    _metadata.create_all(db.engine)
+    with db.engine.connect() as conn:
+        applied = set(conn.execute(select(schema_migrations.c.id)).scalars())
+    for migration_id, func in MIGRATIONS:
+        if migration_id in applied:
+            continue
+        logger.info(f"Applying migration {migration_id}")
+        func(db, model)
+        with db.engine.begin() as conn:
+            conn.execute(schema_migrations.insert().values(id=migration_id, applied_at=datetime.utcnow()))
+    sync_indexes(db, model)
+
+
+def migrate(db, model):
+    """Apply pending migrations and create missing indexes. Safe to run repeatedly."""
+    with _migration_lock(db):
+        _migrate(db, model)
+
+
+def schema_fingerprint(db):
+    """Return a hash of the DDL of every model table and index, and of the migration ids."""
+    dialect = db.engine.dialect
+    digest = hashlib.sha256()
+    for table in db.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=dialect)).encode())
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            digest.update(str(CreateIndex(index).compile(dialect=dialect)).encode())
+    for migration_id, _ in MIGRATIONS:
+        digest.update(migration_id.encode())
+    return FINGERPRINT_PREFIX + digest.hexdigest()[:32]
+
+
+def schema_is_current(db, fingerprint):
+    """Return whether the database has been brought up to the schema with ``fingerprint``."""
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(
+                select(schema_migrations.c.id).where(schema_migrations.c.id == fingerprint)
+            ).first() is not None
+    except SQLAlchemyError:
+        # No schema_migrations table: a new database
+        return False
+
+
+def init_db(db, model):
+    """
+    Create missing tables, apply migrations and record the resulting schema.
+
+    Returns whether the book table had to be created.
+    """
+    with _migration_lock(db):
+        created = not inspect(db.engine).has_table(model.__table__.name)
+        # The primary only: read replicas (see read_replicas.py) follow it, and may be down
+        db.create_all(bind_key=None)
+        _migrate(db, model)
+        fingerprint = schema_fingerprint(db)
+        if not schema_is_current(db, fingerprint):
+            with db.engine.begin() as conn:
+                conn.execute(schema_migrations.insert().values(id=fingerprint, applied_at=datetime.utcnow()))
+    return created
+
+
+def ensure_schema(db, model, migrate_on_start=True, seed=None):
+    """
+    Bring the database up to the models' schema at startup, unless it already is.
+
+    When ``migrate_on_start`` is false, only missing tables are created and a
+    database behind the models is left for ``flask init-db``. ``seed()`` runs
+    when the book table has just been created, so a new database starts with
+    the sample catalog.
+    """
+    if schema_is_current(db, schema_fingerprint(db)):
+        return
+    if migrate_on_start:
+        created = init_db(db, model)
+    else:
+        created = not inspect(db.engine).has_table(model.__table__.name)
+        db.create_all(bind_key=None)
+        logger.warning("Database schema is behind the models; run \"flask init-db\"")
+    if created and seed is not None:
+        seed()
+        logger.info("Database seeded with initial book data.")
+
+
+def init_app(app, db, model, seed=None):
+    """Register the ``flask init-db``, ``flask migrate`` and, given a ``seed()`` function, ``flask seed`` commands."""
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the tables, apply schema migrations and create missing indexes."""
+        with app.app_context():
+            init_db(db, model)
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations and create missing indexes."""
+        with app.app_context():
+            migrate(db, model)
+
+    if seed is not None:
+        @app.cli.command('seed')
+        def seed_command():
+            """Add the sample books to an empty catalog."""
+            with app.app_context():
+                if db.session.query(model.id).first() is not None:
+                    print("The catalog already has books; not seeding.")
+                    return
+                seed()
+                print("Database seeded with initial book data.")
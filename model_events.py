@@ -0,0 +1,69 @@
+"""
+Commit-time change notifications for models.
+
+In-process indexes (n-gram index, caches, ...) subscribe to a model with
+``subscribe(model, callback)``. Row values are captured at flush time and the
+callbacks run only once the transaction commits, so a rolled-back change never
+reaches an index. Each callback is called as ``callback(op, row)`` where ``op``
+is 'insert', 'update' or 'delete' and ``row`` is a dict of column values.
+Changes committed by other processes are published too (see catalog_sync.py).
+"""
+import logging
+from collections import defaultdict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_subscribers = defaultdict(list)
+_PENDING_KEY = 'model_events_pending'
+
+
+def _snapshot(mapper, target):
+    """Capture the column values of a flushed object without triggering loads."""
+    state_dict = inspect(target).dict
+    return {attr.key: state_dict.get(attr.key) for attr in mapper.column_attrs}
+
+
+def _make_listener(op):
+    def listener(mapper, connection, target):
+        session = Session.object_session(target)
+        if session is None:
+            return
+        pending = session.info.setdefault(_PENDING_KEY, [])
+        pending.append((mapper.class_, op, _snapshot(mapper, target)))
+    return listener
+
+
+def publish(model, op, row):
+    """Call every subscriber of ``model`` with a committed change, as a commit does."""
+    for callback in _subscribers.get(model, ()):
+        try:
+            callback(op, row)
+        except Exception as e:
+            logger.error(f"Error in {op} subscriber for {model.__name__}: {e}")
+
+
+def _after_commit(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    for model, op, row in pending:
+        publish(model, op, row)
+
+
+def _after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
+
+
+def subscribe(model, callback):
+    """Call ``callback(op, row)`` after every committed change to ``model``."""
+    if model not in _subscribers:
+        for op in ('insert', 'update', 'delete'):
+            event.listen(model, f'after_{op}', _make_listener(op))
+    _subscribers[model].append(callback)
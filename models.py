@@ -1,10 +1,29 @@
 from app import db
 from datetime import datetime
+from sqlalchemy.orm import validates
+from isbn import canonical_isbn
+import normalize
 
 class Book(db.Model):
     """
     Book model representing a library book with location information.
     """
+    # Secondary indexes for the catalog's access paths, created on existing
+    # databases by migrations.sync_indexes
+    __table_args__ = (
+        # Facet filters: status within category and category within status
+        db.Index('ix_book_category_status', 'category', 'status'),
+        db.Index('ix_book_status_category', 'status', 'category'),
+        # Shelf browsing in physical order, and previous/next on a shelf (see shelf_browse.py)
+        db.Index('ix_book_shelf_order', 'shelf', 'column', 'row', 'id'),
+        # Author listings
+        db.Index('ix_book_author_title', 'author', 'title'),
+        # Recently added books
+        db.Index('ix_book_date_added', 'date_added'),
+        # Row versions, read by id and version alone
+        db.Index('ix_book_id_version', 'id', 'version'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     author = db.Column(db.String(100), nullable=False)
@@ -29,10 +48,27 @@ class Book(db.Model):
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
     category = db.Column(db.String(50))
     description = db.Column(db.Text)
+    
+    # Normalized copies of title and author for searching (see normalize.py)
+    title_norm = db.Column(db.String(400), index=True)
+    author_norm = db.Column(db.String(200), index=True)
+    
+    # Time of the row's last change, sent as Last-Modified (see http_cache.py)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Row version, bumped by every update; cached pages and ETags are keyed on it
+    # (see page_cache.py and http_cache.py)
+    version = db.Column(db.Integer)
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f"<Book {self.title} by {self.author}>"
     
+    @validates('isbn')
+    def validate_isbn(self, key, value):
+        """Store valid ISBNs in canonical ISBN-13 form."""
+        return canonical_isbn(value)
+    
     @property
     def location_display(self):
         """Return a formatted string of the book's location."""
@@ -42,3 +78,6 @@ class Book(db.Model):
     def status_display(self):
         """Return a human-readable status."""
         return self.STATUS_CHOICES.get(self.status, 'Unknown')
+
+
+normalize.track(Book)
@@ -0,0 +1,176 @@
+"""
+In-process character n-gram index for substring search.
+
+Used by the substring search mode on SQLite, which has no equivalent of
+PostgreSQL's pg_trgm. Each document is a tuple of field values; every field is
+padded with NUL characters so that any substring shorter than ``n`` is still
+the prefix of some indexed gram.
+
+Postings hold one key per field of a document (``doc_id * FIELD_SLOTS +
+field``), and the number of distinct grams of each field is kept alongside.
+Counting a query's grams over its posting lists then gives the trigram
+(Jaccard) similarity of every field that shares one, without looking at the
+text, and the best matches are picked with a heap rather than sorting them all.
+"""
+import heapq
+from collections import Counter, defaultdict
+
+import lazy_index
+
+PAD = '\x00'
+
+# Fields a document may have; posting keys are doc_id * FIELD_SLOTS + field position
+FIELD_SLOTS = 8
+
+
+def _best_first(item):
+    doc_id, score = item
+    return -score, doc_id
+
+
+class NgramIndex(lazy_index.LazyIndex):
+    """Map from character n-grams to the fields of the documents containing them."""
+
+    def __init__(self, n=3, fields=()):
+        self.n = n
+        # Keys of the row fields a document is made of, for apply_change
+        self.fields = fields
+        self.postings = defaultdict(set)
+        # Distinct grams of each indexed field, by posting key
+        self.sizes = {}
+        self.docs = {}
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _padded(self, value):
+        pad = PAD * (self.n - 1)
+        return f'{pad}{value}{pad}'
+
+    def grams(self, value, padded=True):
+        """Return the set of n-grams of a string."""
+        if padded:
+            value = self._padded(value)
+        return {value[i:i + self.n] for i in range(len(value) - self.n + 1)}
+
+    def add(self, doc_id, fields):
+        """Index a document, replacing any earlier version with the same id."""
+        self.remove(doc_id)
+        fields = tuple((value or '').lower() for value in fields)
+        if len(fields) > FIELD_SLOTS:
+            raise ValueError(f"A document has at most {FIELD_SLOTS} fields")
+        self.docs[doc_id] = fields
+        for position, value in enumerate(fields):
+            key = doc_id * FIELD_SLOTS + position
+            grams = self.grams(value)
+            self.sizes[key] = len(grams)
+            for gram in grams:
+                self.postings[gram].add(key)
+
+    def remove(self, doc_id):
+        """Drop a document from the index if it is present."""
+        fields = self.docs.pop(doc_id, None)
+        if fields is None:
+            return
+        for position, value in enumerate(fields):
+            key = doc_id * FIELD_SLOTS + position
+            self.sizes.pop(key, None)
+            for gram in self.grams(value):
+                keys = self.postings.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.postings[gram]
+
+    def apply_change(self, op, row):
+        if op == 'delete':
+            self.remove(row['id'])
+        else:
+            self.add(row['id'], [row.get(field) for field in self.fields])
+
+    def similarity(self, query, doc_id):
+        """Best trigram (Jaccard) similarity between the query and any field of a document."""
+        query_grams = self.grams(query.lower())
+        best = 0.0
+        for value in self.docs.get(doc_id, ()):
+            field_grams = self.grams(value)
+            union = len(query_grams | field_grams)
+            if union:
+                best = max(best, len(query_grams & field_grams) / union)
+        return best
+
+    def _substring_keys(self, query):
+        """Return the posting keys of the fields containing ``query``."""
+        if len(query) < self.n:
+            # Short queries: every gram starting with the query belongs to a match
+            keys = set()
+            for gram, posting in self.postings.items():
+                if gram.startswith(query):
+                    keys |= posting
+            return keys
+
+        posting_lists = sorted(
+            (self.postings.get(gram, set()) for gram in self.grams(query, padded=False)),
+            key=len
+        )
+        candidates = set(posting_lists[0])
+        for keys in posting_lists[1:]:
+            candidates &= keys
+            if not candidates:
+                break
+        # Grams can co-occur without forming the substring, so verify each hit
+        return {key for key in candidates
+                if query in self.docs[key // FIELD_SLOTS][key % FIELD_SLOTS]}
+
+    def scores(self, query, threshold=0.3, allowed=None):
+        """
+        Return ``{doc_id: score}`` for the documents matching the query.
+
+        Documents containing the query as a substring always match; others
+        match when their similarity reaches ``threshold`` (0 disables this).
+        ``allowed``, a set of ids, limits the documents considered.
+        """
+        query = query.lower()
+        if not query:
+            return {}
+        self.ensure_loaded()
+
+        query_grams = self.grams(query)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self.postings.get(gram, ()))
+
+        # A field's similarity is its shared grams over the union of both gram sets
+        best = {}
+        for key, count in shared.items():
+            doc_id = key // FIELD_SLOTS
+            score = count / (len(query_grams) + self.sizes[key] - count)
+            if score > best.get(doc_id, -1.0):
+                best[doc_id] = score
+        if allowed is not None:
+            best = {doc_id: score for doc_id, score in best.items() if doc_id in allowed}
+
+        matches = {}
+        for key in self._substring_keys(query):
+            doc_id = key // FIELD_SLOTS
+            if allowed is None or doc_id in allowed:
+                matches[doc_id] = best.get(doc_id, 0.0)
+        if threshold > 0:
+            matches.update((doc_id, score) for doc_id, score in best.items() if score >= threshold)
+        return matches
+
+    def top(self, query, threshold=0.3, limit=None, allowed=None):
+        """
+        Return ``(matches, total)``: the best ``limit`` matches and how many documents matched.
+
+        ``matches`` are ``(doc_id, score)`` pairs, best first and then by id;
+        all of them when ``limit`` is None. See ``scores`` for the arguments.
+        """
+        scores = self.scores(query, threshold, allowed)
+        if limit is None:
+            return sorted(scores.items(), key=_best_first), len(scores)
+        return heapq.nsmallest(limit, scores.items(), key=_best_first), len(scores)
+
+    def search(self, query, threshold=0.3):
+        """Return ``(doc_id, score)`` pairs for every document matching the query, best first."""
+        return self.top(query, threshold)[0]
@@ -0,0 +1,46 @@
+"""
+Pre-normalized copies of the searchable text columns.
+
+Each normalized column holds the case-folded text of its source column with
+accents stripped and runs of punctuation and whitespace collapsed to a single
+space, so "Brontë, Charlotte" is stored as "bronte charlotte". The values are
+written by ``before_insert``/``before_update`` mapper events, and searches
+compare a normalized query against them with plain LIKE instead of applying
+``lower()`` to every row. Rows written before the columns existed are filled
+in by a migration (see migrations.py).
+"""
+import logging
+import re
+import unicodedata
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Source column -> normalized shadow column
+NORMALIZED_COLUMNS = {
+    'title': 'title_norm',
+    'author': 'author_norm',
+}
+
+_SEPARATOR_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_text(value):
+    """Case-fold ``value``, strip its accents and collapse punctuation and whitespace."""
+    if value is None:
+        return None
+    decomposed = unicodedata.normalize('NFKD', value)
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _SEPARATOR_RE.sub(' ', stripped.casefold()).strip()
+
+
+def _fill(mapper, connection, target):
+    for source, normalized in NORMALIZED_COLUMNS.items():
+        setattr(target, normalized, normalize_text(getattr(target, source)))
+
+
+def track(model):
+    """Keep the normalized columns of ``model`` current on every insert and update."""
+    event.listen(model, 'before_insert', _fill)
+    event.listen(model, 'before_update', _fill)
@@ -0,0 +1,172 @@
+"""
+In-process cache of rendered book pages.
+
+A page is stored under its route, the book's id, its row version and the
+generation of its shelf:
+
+* ``Book.version`` is bumped by every update of the row (SQLAlchemy's
+  ``version_id_col``), so a changed book stops matching its old pages.
+* A detail page also links the previous and next books on the shelf. Every
+  committed insert, update or delete of a book moves its shelf, and the shelf
+  it left if it moved, to a new generation, so that shelf's pages are
+  rendered again.
+
+Superseded pages are never looked up again and age out of the LRU. The
+version and shelf of each book a cached page shows or links are kept in
+memory and updated through model_events, so a hit needs neither a query nor
+an ORM object. They are dropped with the last such page evicted, so they
+never outnumber the pages cached. Changes committed by other processes
+reach them the same way before the next request (see catalog_sync.py).
+
+Flash messages are part of the page, so while any are waiting for the client
+pages are neither served from the cache nor stored. Hits and misses are
+counted per route and reported by /api/stats.
+"""
+import threading
+from collections import Counter, defaultdict
+
+from flask import current_app, get_flashed_messages, has_request_context
+
+import model_events
+from search_cache import SearchCache
+
+_UNKNOWN = object()
+
+
+def cacheable():
+    """Return whether the page for the current request may come from, or go into, the cache."""
+    # Flask keeps the flashes it takes from the session for the rest of the
+    # request, so the answer is the same before and after the page is rendered
+    return not (has_request_context() and get_flashed_messages())
+
+
+class PageCache:
+    """Rendered pages keyed by route, book id, row version and shelf generation."""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.pages = SearchCache(max_size=max_size, ttl=ttl)
+        self.pages.on_evict = self._evicted
+        # Latest row version and shelf of each book shown or linked by a cached page
+        self.versions = {}
+        self.shelves = {}
+        # Ids of the books each cached page shows or links, and how many cached pages do
+        self._page_books = {}
+        self._references = Counter()
+        self.generations = defaultdict(int)
+        # Committed changes seen; a page rendered across one isn't stored
+        self.changes = 0
+        self.routes = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self._lock = threading.Lock()
+
+    def _key(self, route, book_id):
+        version = self.versions.get(book_id, _UNKNOWN)
+        if version is _UNKNOWN:
+            return None
+        shelf = self.shelves.get(book_id)
+        return route, book_id, version, shelf, self.generations[shelf]
+
+    def _evicted(self, key):
+        """Forget the books of an evicted page that no other cached page shows or links."""
+        with self._lock:
+            for book_id in self._page_books.pop(key, ()):
+                self._references[book_id] -= 1
+                if not self._references[book_id]:
+                    del self._references[book_id]
+                    self.versions.pop(book_id, None)
+                    self.shelves.pop(book_id, None)
+
+    def get(self, route, book_id):
+        """Return the cached page for a book, or None."""
+        with self._lock:
+            key = self._key(route, book_id)
+        page = self.pages.get(key) if key is not None else None
+        with self._lock:
+            self.routes[route]['hits' if page is not None else 'misses'] += 1
+        return page
+
+    def put(self, route, book, page, neighbors=(), since=None):
+        """
+        Cache the page rendered for ``book``, which links ``neighbors`` on its shelf.
+
+        ``since`` is the value of ``changes`` before the book was read; if a
+        change has been committed since, the page may be out of date already
+        and is not stored.
+        """
+        with self._lock:
+            if since is not None and since != self.changes:
+                return
+            self.versions[book.id] = book.version
+            shown = [other for other in (book, *neighbors) if other is not None]
+            for other in shown:
+                self.shelves[other.id] = other.shelf
+            key = self._key(route, book.id)
+            if key not in self._page_books:
+                self._page_books[key] = [other.id for other in shown]
+                self._references.update(self._page_books[key])
+        self.pages.set(key, page)
+
+    def get_or_render(self, route, book_id, render):
+        """
+        Return the page for a book from the cache, or from ``render()``.
+
+        ``render()`` returns ``(page, book, neighbors)``; exceptions it raises,
+        such as a 404, pass through and nothing is cached.
+        """
+        if not cacheable():
+            return render()[0]
+        page = self.get(route, book_id)
+        if page is not None:
+            return page
+        since = self.changes
+        page, book, neighbors = render()
+        self.put(route, book, page, neighbors, since)
+        return page
+
+    def changed(self, op, row):
+        """Move to new keys for a committed insert, update or delete of a book."""
+        book_id = row['id']
+        with self._lock:
+            for shelf in {self.shelves.get(book_id), row.get('shelf')}:
+                if shelf is not None:
+                    self.generations[shelf] += 1
+            if op == 'delete':
+                self.versions.pop(book_id, None)
+                self.shelves.pop(book_id, None)
+            elif book_id in self._references:
+                # Books no cached page shows or links are read again when one is rendered
+                self.versions[book_id] = row.get('version')
+                self.shelves[book_id] = row.get('shelf')
+            self.changes += 1
+
+    def stats(self):
+        """Return the size of the cache and the hit ratio of each route."""
+        with self._lock:
+            routes = {
+                route: dict(counts, hit_ratio=counts['hits'] / (counts['hits'] + counts['misses'])
+                            if counts['hits'] + counts['misses'] else 0.0)
+                for route, counts in self.routes.items()
+            }
+        pages = self.pages.stats()
+        return {
+            'size': pages['size'],
+            'max_size': pages['max_size'],
+            'ttl': pages['ttl'],
+            'evictions': pages['evictions'],
+            'routes': routes,
+        }
+
+
+def init_app(app, model):
+    """Create the page cache for an app and move it to new keys on every change to ``model``."""
+    cache = PageCache(
+        max_size=app.config.get('PAGE_CACHE_SIZE', 1024),
+        ttl=app.config.get('PAGE_CACHE_TTL', 300)
+    )
+    model_events.subscribe(model, cache.changed)
+    app.extensions['page_cache'] = cache
+    return cache
+
+
+def get_page_cache():
+    """Return the page cache registered on the current app."""
+    return current_app.extensions['page_cache']
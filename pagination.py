@@ -0,0 +1,135 @@
+"""
+Keyset (cursor) pagination for search results.
+
+A page is fetched with ``WHERE (sort keys) > (last row's sort keys)`` and a
+LIMIT, so every page costs the same as the first regardless of depth. The
+position is handed to clients as an opaque token, and the total is a count
+capped at ``count_cap`` rather than an exact ``COUNT(*)`` over all matches.
+"""
+import base64
+import binascii
+import json
+import logging
+
+from sqlalchemy import func, literal_column, select, tuple_
+
+logger = logging.getLogger(__name__)
+
+
+class Page:
+    """One page of results plus what's needed to render navigation."""
+
+    def __init__(self, items, next_token, total, total_capped):
+        self.items = items
+        self.next_token = next_token
+        self.total = total
+        self.total_capped = total_capped
+
+    @property
+    def total_display(self):
+        """Total for display, e.g. '42' or '1000+' when the count was capped."""
+        return f"{self.total}+" if self.total_capped else str(self.total)
+
+
+def encode_cursor(values):
+    """Encode the sort-key values of the last row on a page as an opaque token."""
+    payload = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token from ``encode_cursor``. Returns None for missing or malformed tokens."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError) as e:
+        logger.warning(f"Ignoring invalid page token {token!r}: {e}")
+        return None
+    return values if isinstance(values, list) else None
+
+
+def cursor_matches(values, sort_keys):
+    """Return whether decoded cursor values can stand for ``sort_keys``: one value of each key's type."""
+    if len(values) != len(sort_keys):
+        return False
+    for value, key in zip(values, sort_keys):
+        try:
+            expected = key.type.python_type
+        except NotImplementedError:
+            continue
+        if expected is float:
+            expected = (int, float)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, expected)):
+            return False
+    return True
+
+
+def capped_count_statement(query, count_cap):
+    """Return a statement counting the rows of a query, stopping at ``count_cap + 1``."""
+    # The rows are only counted, so the subquery selects none of their columns
+    limited = query.order_by(None).with_entities(literal_column('1')).limit(count_cap + 1).subquery()
+    return select(func.count()).select_from(limited)
+
+
+def capped_count(query, count_cap):
+    """
+    Count the rows of a query, stopping at ``count_cap``.
+
+    Returns ``(total, capped)`` where ``capped`` is True if there are more
+    than ``count_cap`` rows.
+    """
+    count = query.session.execute(capped_count_statement(query, count_cap)).scalar()
+    return min(count, count_cap), count > count_cap
+
+
+def keyset_query(query, sort_keys, cursor=None, page_size=20, columns=None):
+    """
+    Return ``(query, width)`` selecting one page after ``cursor``, plus one row.
+
+    Each row holds ``width`` leading item columns followed by the sort keys;
+    the extra row tells make_page whether there is a next page.
+    """
+    after = decode_cursor(cursor)
+    if after is not None and cursor_matches(after, sort_keys):
+        query = query.filter(tuple_(*sort_keys) > tuple_(*after))
+    elif after is not None:
+        logger.warning(f"Ignoring page token {cursor!r}, which doesn't fit the sort keys")
+
+    labelled = [key.label(f'sort_key_{i}') for i, key in enumerate(sort_keys)]
+    if columns is None:
+        query = query.add_columns(*labelled)
+        width = 1
+    else:
+        query = query.with_entities(*columns, *labelled)
+        width = len(columns)
+    return query.order_by(*sort_keys).limit(page_size + 1), width
+
+
+def make_page(rows, width, page_size, count, count_cap, make_item=None):
+    """Turn the rows of a keyset_query and an uncapped count into a Page."""
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_token = encode_cursor(rows[-1][width:]) if has_more else None
+    if make_item is None:
+        items = [row[0] for row in rows]
+    else:
+        items = [make_item(row[:width]) for row in rows]
+    return Page(items, next_token, min(count, count_cap), count > count_cap)
+
+
+def keyset_page(query, sort_keys, cursor=None, page_size=20, count_cap=1000,
+                columns=None, make_item=None):
+    """
+    Return a Page of ``query`` ordered by ``sort_keys``.
+
+    ``sort_keys`` are ascending SQL expressions whose combination is unique
+    per row (the last one is normally the primary key). If ``columns`` is
+    given, only those columns are selected and each row of them is passed to
+    ``make_item`` instead of loading full model objects.
+    """
+    count = query.session.execute(capped_count_statement(query, count_cap)).scalar()
+    page_query, width = keyset_query(query, sort_keys, cursor, page_size, columns)
+    return make_page(page_query.all(), width, page_size, count, count_cap,
+                     make_item if columns is not None else None)
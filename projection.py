@@ -0,0 +1,54 @@
+"""
+Lightweight book records for list views.
+
+Search result cards only need a handful of columns. Selecting just those and
+wrapping each row in a ``__slots__`` record avoids loading ``description``,
+``publisher`` and ``date_added`` and skips identity-map bookkeeping for every
+hit. It also makes cached result pages safe to share, since nothing in them
+is tied to a session.
+"""
+from sqlalchemy import case, select
+
+# Columns rendered by the search result cards
+LIST_FIELDS = ('id', 'title', 'author', 'status', 'shelf', 'column', 'row', 'isbn')
+
+
+class BookSummary:
+    """Read-only record holding the list-view columns of a book."""
+
+    __slots__ = LIST_FIELDS + ('_status_choices',)
+
+    def __init__(self, row, status_choices):
+        for field, value in zip(LIST_FIELDS, row):
+            setattr(self, field, value)
+        self._status_choices = status_choices
+
+    def __repr__(self):
+        return f"<BookSummary {self.title} by {self.author}>"
+
+    @property
+    def location_display(self):
+        """Return a formatted string of the book's location."""
+        return f"Shelf {self.shelf}, Column {self.column}, Row {self.row}"
+
+    @property
+    def status_display(self):
+        """Return a human-readable status."""
+        return self._status_choices.get(self.status, 'Unknown')
+
+
+def list_columns(model):
+    """Return the model columns selected for list views, in LIST_FIELDS order."""
+    return [getattr(model, field) for field in LIST_FIELDS]
+
+
+def summary_factory(model):
+    """Return a function turning a row of ``list_columns(model)`` into a BookSummary."""
+    status_choices = model.STATUS_CHOICES
+    return lambda row: BookSummary(row, status_choices)
+
+
+def summaries_by_id(model, ids):
+    """Return a statement selecting the list-view columns of ``ids``, in the order given."""
+    rank = case({book_id: position for position, book_id in enumerate(ids)}, value=model.id)
+    return select(*list_columns(model)).where(model.id.in_(ids)).order_by(rank)
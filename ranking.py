@@ -0,0 +1,331 @@
+"""
+BM25 relevance ranking of search candidates.
+
+Term statistics for title, author, category and description are held in
+NumPy arrays: per field, each term maps to the positions of the books that
+contain it and the term frequencies. A candidate set is scored in one pass
+per query term with ``searchsorted`` lookups instead of a Python loop per row,
+using BM25F-style per-field weights.
+
+The statistics are pickled to ``BM25_STATS_PATH`` (the instance folder by
+default) so workers load them at warm-up (see lazy_index.py) instead of
+re-tokenizing the catalog. A search made before they are loaded doesn't
+wait for them: it starts loading them in the background and keeps the
+search engine's own relevance order.
+A stored file is reused while its book count, highest id and catalog
+generation still match the database. Committed changes mark the statistics
+stale, and they are rebuilt at most once per ``BM25_REBUILD_INTERVAL``
+seconds, in a background thread while the old statistics keep serving.
+
+Each search's ranked candidates are cached (see ``SearchEngine.ranking``), so
+paging through the results slices one ranking instead of sorting the matches
+again for every page.
+"""
+import logging
+import math
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+import catalog_generation
+import lazy_index
+import model_events
+from search_cache import SearchCache
+from search_engine import tokenize
+
+logger = logging.getLogger(__name__)
+
+RANK_FIELDS = ('title', 'author', 'category', 'description')
+
+DEFAULT_FIELD_WEIGHTS = {
+    'title': 3.0,
+    'author': 2.0,
+    'category': 1.0,
+    'description': 0.5,
+}
+
+# Bump when the pickled layout or the tokenizer changes so old files are rebuilt
+STATS_VERSION = 2
+
+
+def parse_field_weights(value):
+    """
+    Parse field weights written as "title:3,author:2".
+
+    Fields that aren't mentioned keep their default weight.
+    """
+    weights = dict(DEFAULT_FIELD_WEIGHTS)
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        field, _, weight = item.partition(':')
+        field = field.strip()
+        if field not in weights:
+            logger.warning(f"Ignoring weight for unknown field {field!r}")
+            continue
+        weights[field] = float(weight)
+    return weights
+
+
+def catalog_fingerprint(db, model):
+    """
+    Return ``(book count, highest id, version)``, used to tell whether stored statistics are current.
+
+    The version is the catalog generation, which moves with every edit; a
+    database without catalog_changes falls back to the latest ``updated_at``.
+    """
+    with db.engine.connect() as conn:
+        count, max_id, updated_at = conn.execute(
+            select(func.count(model.id), func.max(model.id), func.max(model.updated_at))
+        ).one()
+    with db.engine.connect() as conn:
+        try:
+            state = conn.execute(catalog_generation.state_statement()).first()
+        except SQLAlchemyError:
+            state = None
+    return count, max_id, state[0] if state is not None else updated_at
+
+
+class Bm25Stats:
+    """Inverted index statistics for the ranked fields."""
+
+    def __init__(self, doc_ids, lengths, postings, doc_freq, fingerprint):
+        self.doc_ids = doc_ids
+        self.lengths = lengths
+        self.postings = postings
+        self.doc_freq = doc_freq
+        self.fingerprint = fingerprint
+        self.avg_lengths = {
+            field: float(field_lengths.mean()) if len(field_lengths) and field_lengths.mean() else 1.0
+            for field, field_lengths in lengths.items()
+        }
+
+    @classmethod
+    def build(cls, rows, fingerprint):
+        """Build statistics from ``(id, title, author, category, description)`` rows."""
+        rows = sorted(rows, key=lambda row: row[0])
+        doc_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        lengths = {field: np.zeros(len(rows), dtype=np.float32) for field in RANK_FIELDS}
+        building = {field: defaultdict(lambda: ([], [])) for field in RANK_FIELDS}
+        doc_freq = Counter()
+
+        for position, row in enumerate(rows):
+            terms = set()
+            for field, value in zip(RANK_FIELDS, row[1:]):
+                tokens = tokenize(value or '')
+                lengths[field][position] = len(tokens)
+                for term, count in Counter(tokens).items():
+                    positions, counts = building[field][term]
+                    positions.append(position)
+                    counts.append(count)
+                    terms.add(term)
+            doc_freq.update(terms)
+
+        postings = {
+            field: {
+                term: (np.array(positions, dtype=np.int32), np.array(counts, dtype=np.float32))
+                for term, (positions, counts) in terms.items()
+            }
+            for field, terms in building.items()
+        }
+        return cls(doc_ids, lengths, postings, dict(doc_freq), fingerprint)
+
+    def save(self, path):
+        """Write the statistics to ``path`` atomically."""
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        payload = {
+            'version': STATS_VERSION,
+            'doc_ids': self.doc_ids,
+            'lengths': self.lengths,
+            'postings': self.postings,
+            'doc_freq': self.doc_freq,
+            'fingerprint': self.fingerprint,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # mkstemp creates the file owner-only; a file shipped in a bundle is read by another user
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read statistics written by ``save``. Returns None if missing or outdated."""
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read BM25 statistics from {path}: {e}")
+            return None
+        if payload.get('version') != STATS_VERSION:
+            return None
+        return cls(payload['doc_ids'], payload['lengths'], payload['postings'],
+                   payload['doc_freq'], tuple(payload['fingerprint']))
+
+
+class Bm25Ranker(lazy_index.LazyIndex):
+    """Scores candidate books against a query with BM25F."""
+
+    def __init__(self, stats, field_weights=None, k1=1.2, b=0.75, candidate_limit=1000,
+                 loader=None, rebuild_interval=60):
+        self.stats = stats
+        self.field_weights = field_weights or dict(DEFAULT_FIELD_WEIGHTS)
+        self.k1 = k1
+        self.b = b
+        self.candidate_limit = candidate_limit
+        # Callable returning fresh Bm25Stats, used when the catalog changes
+        self.loader = loader
+        self.rebuild_interval = rebuild_interval
+        self._stale = False
+        self._built_at = time.monotonic()
+        # Held by the rebuild thread while it runs
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def mark_stale(self):
+        self._stale = True
+
+    def apply_change(self, op, row):
+        self.mark_stale()
+
+    @property
+    def fingerprint(self):
+        """The catalog fingerprint the current statistics were built for."""
+        self.ensure_loaded()
+        return self.stats.fingerprint
+
+    def _refresh(self):
+        if not self._stale or self.loader is None:
+            return
+        if time.monotonic() - self._built_at < self.rebuild_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        self._stale = False
+        self._thread = threading.Thread(target=self._rebuild, name='bm25-rebuild', daemon=True)
+        self._thread.start()
+
+    def _rebuild(self):
+        try:
+            self.stats = self.loader()
+        except Exception as e:
+            self._stale = True
+            logger.error(f"Could not rebuild BM25 statistics: {e}")
+        finally:
+            self._built_at = time.monotonic()
+            self._lock.release()
+
+    def wait(self, timeout=None):
+        """Block until a rebuild in progress, if any, has replaced the statistics."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def scores(self, ids, query):
+        """Return a float array of BM25 scores aligned with ``ids``."""
+        self.ensure_loaded()
+        self._refresh()
+        stats = self.stats
+        ids = np.asarray(ids, dtype=np.int64)
+        total = np.zeros(len(ids), dtype=np.float64)
+        doc_count = len(stats.doc_ids)
+        if not len(ids) or not doc_count:
+            return total
+
+        positions = np.minimum(np.searchsorted(stats.doc_ids, ids), doc_count - 1)
+        known = stats.doc_ids[positions] == ids
+
+        for term in set(tokenize(query)):
+            df = stats.doc_freq.get(term, 0)
+            if not df:
+                continue
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            tf = np.zeros(len(ids), dtype=np.float64)
+            for field, weight in self.field_weights.items():
+                posting = stats.postings[field].get(term)
+                if posting is None or not weight:
+                    continue
+                doc_positions, counts = posting
+                index = np.minimum(np.searchsorted(doc_positions, positions), len(doc_positions) - 1)
+                hit = known & (doc_positions[index] == positions)
+                field_lengths = stats.lengths[field][positions[hit]]
+                norm = 1 - self.b + self.b * field_lengths / stats.avg_lengths[field]
+                tf[hit] += weight * counts[index[hit]] / norm
+            total += idf * tf / (self.k1 + tf)
+        return total
+
+    def rank(self, ids, query):
+        """Return ``ids`` reordered by descending score; ties keep their input order."""
+        if not ids:
+            return []
+        order = np.argsort(-self.scores(ids, query), kind='stable')
+        return [ids[i] for i in order]
+
+
+def init_app(app, db, model):
+    """Attach a BM25 ranker to the app's search engine; on first use it loads the stored statistics if current."""
+    path = app.config.get('BM25_STATS_PATH') or os.path.join(app.instance_path, 'bm25_stats.pickle')
+    fields = [getattr(model, field) for field in RANK_FIELDS]
+
+    def load_stats():
+        with app.app_context():
+            fingerprint = catalog_fingerprint(db, model)
+            with db.engine.connect() as conn:
+                rows = conn.execute(select(model.id, *fields)).all()
+        stats = Bm25Stats.build(rows, fingerprint)
+        try:
+            stats.save(path)
+        except OSError as e:
+            logger.warning(f"Could not store BM25 statistics at {path}: {e}")
+        logger.info(f"Built BM25 statistics for {len(stats.doc_ids)} books")
+        return stats
+
+    def build(ranker):
+        with app.app_context():
+            stats = Bm25Stats.load(path)
+            if stats is None or stats.fingerprint != catalog_fingerprint(db, model):
+                stats = load_stats()
+            else:
+                logger.info(f"Loaded BM25 statistics from {path}")
+        ranker.stats = stats
+
+    ranker = Bm25Ranker(
+        None,
+        field_weights=parse_field_weights(app.config.get('BM25_FIELD_WEIGHTS')),
+        candidate_limit=app.config.get('BM25_CANDIDATE_LIMIT', 1000),
+        loader=load_stats,
+        rebuild_interval=app.config.get('BM25_REBUILD_INTERVAL', 60)
+    )
+    rankings = SearchCache(
+        max_size=app.config.get('SEARCH_CACHE_SIZE', 512),
+        ttl=app.config.get('SEARCH_CACHE_TTL', 300)
+    )
+
+    def on_change(op, row):
+        ranker.changed(op, row)
+        rankings.clear()
+
+    ranker.defer(build)
+    lazy_index.on_warm_up(app, ranker.ensure_loaded)
+    model_events.subscribe(model, on_change)
+    engine = app.extensions['search_engine']
+    engine.ranker = ranker
+    engine.rankings = rankings
+    app.extensions['bm25_ranker'] = ranker
+    return ranker
+
+
+def get_ranker():
+    """Return the BM25 ranker registered on the current app."""
+    return current_app.extensions['bm25_ranker']
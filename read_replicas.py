@@ -0,0 +1,246 @@
+"""
+Read replicas for read-only requests.
+
+Each URL in ``DATABASE_READ_URLS`` becomes a Flask-SQLAlchemy bind
+(``replica_0``, ``replica_1``, ...). ``RoutingSession`` sends the queries of
+read-only requests (GET, HEAD and OPTIONS) to one of them and everything
+else to the primary:
+
+* Replicas are taken in turn, skipping any that is unhealthy. A background
+  thread checks each one every ``REPLICA_CHECK_INTERVAL`` seconds and takes
+  it out of rotation while it is unreachable or, on PostgreSQL, replaying
+  more than ``REPLICA_MAX_LAG`` seconds behind the primary. A connection
+  error on a replica takes it out at once. With no healthy replica, reads go
+  to the primary.
+* One request reads from one replica throughout.
+* Flushes always go to the primary, and once a session has written, the
+  rest of its reads do too.
+* Read your writes: after a request commits a change, the client's reads go
+  to the primary for ``READ_YOUR_WRITES_SECONDS``, long enough for the
+  replicas to catch up. The deadline travels in the signed session cookie,
+  so it follows the client across workers.
+
+Code outside a request (startup, CLI commands, the in-memory indexes) uses
+``db.engine`` and so the primary.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session as client_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+# HTTP methods whose requests are read-only
+READ_ONLY_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+# Key of the read-your-writes deadline in the session cookie
+PRIMARY_UNTIL_KEY = '_primary_until'
+
+# session.info key set once a session has flushed changes
+_WROTE_KEY = 'read_replicas_wrote'
+
+# Seconds a PostgreSQL replica is behind the primary; 0 when it has replayed everything it received
+_POSTGRES_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def normalize_url(url):
+    """Return a database URL with the ``postgres://`` scheme some hosts use spelled ``postgresql://``."""
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+def replica_binds(read_urls):
+    """Return the ``SQLALCHEMY_BINDS`` entries for a comma-separated list of replica URLs."""
+    urls = [url.strip() for url in (read_urls or '').split(',') if url.strip()]
+    return {f'replica_{i}': normalize_url(url) for i, url in enumerate(urls)}
+
+
+class Replica:
+    """Health of one replica bind."""
+
+    def __init__(self, key):
+        self.key = key
+        self.healthy = True
+        self.lag = None
+        self.error = None
+        self.reads = 0
+
+
+class ReplicaRouter:
+    """Round-robin choice among the healthy replicas, with a background health check."""
+
+    def __init__(self, db, keys, max_lag=10.0, check_interval=5.0):
+        self.db = db
+        self.replicas = [Replica(key) for key in keys]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._checker_pid = None
+        self.app = None
+
+    def choose(self):
+        """Return the bind key of the next healthy replica, or None to use the primary."""
+        self._ensure_checker()
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            if not healthy:
+                return None
+            replica = healthy[next(self._turn) % len(healthy)]
+            replica.reads += 1
+        return replica.key
+
+    def mark_down(self, key, error):
+        """Take a replica out of rotation until a health check passes again."""
+        for replica in self.replicas:
+            if replica.key == key and replica.healthy:
+                replica.healthy = False
+                replica.error = str(error)
+                logger.warning(f"Read replica {key} taken out of rotation: {error}")
+
+    def check(self):
+        """Probe every replica once and update its health."""
+        for replica in self.replicas:
+            engine = self.db.engines[replica.key]
+            try:
+                with engine.connect() as conn:
+                    if engine.dialect.name == 'postgresql':
+                        lag = conn.execute(_POSTGRES_LAG).scalar()
+                    else:
+                        lag = conn.execute(text("SELECT 0")).scalar()
+            except Exception as e:
+                self.mark_down(replica.key, e)
+                continue
+            replica.lag = float(lag or 0)
+            if replica.lag > self.max_lag:
+                self.mark_down(replica.key, f"{replica.lag:.1f}s behind the primary")
+            elif not replica.healthy:
+                replica.healthy = True
+                replica.error = None
+                logger.info(f"Read replica {replica.key} back in rotation")
+
+    def _ensure_checker(self):
+        # Threads don't survive fork, so each worker process starts its own
+        if self._checker_pid == os.getpid() or self.app is None:
+            return
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+        threading.Thread(target=self._check_loop, name='replica-health', daemon=True).start()
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                with self.app.app_context():
+                    self.check()
+            except Exception as e:
+                logger.error(f"Read replica health check failed: {e}")
+
+    def stats(self):
+        """Return the health and read count of each replica."""
+        return [
+            {'bind': replica.key, 'healthy': replica.healthy, 'lag': replica.lag,
+             'reads': replica.reads, 'error': replica.error}
+            for replica in self.replicas
+        ]
+
+
+class RoutingSession(Session):
+    """Session that reads from a replica during read-only requests and writes to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not self.info.get(_WROTE_KEY):
+            key = _request_replica()
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _request_replica():
+    """Return the replica bind key chosen for the current request, choosing one on first use."""
+    if not has_request_context() or not g.get('read_replica_allowed'):
+        return None
+    if 'read_replica' not in g:
+        router = current_app.extensions.get('read_replicas')
+        g.read_replica = router.choose() if router is not None else None
+    return g.read_replica
+
+
+def _after_flush(session, flush_context):
+    if session.new or session.dirty or session.deleted:
+        session.info[_WROTE_KEY] = True
+
+
+def _after_commit(session):
+    if session.info.pop(_WROTE_KEY, False) and has_request_context():
+        # Stay on the primary for the rest of this request, and for this client for a while
+        g.read_replica_allowed = False
+        g.read_replicas_wrote = True
+
+
+def _after_rollback(session):
+    session.info.pop(_WROTE_KEY, None)
+
+
+event.listen(RoutingSession, 'after_flush', _after_flush)
+event.listen(RoutingSession, 'after_commit', _after_commit)
+event.listen(RoutingSession, 'after_rollback', _after_rollback)
+
+
+def init_app(app, db):
+    """Route the read-only requests of an app to its replica binds, if it has any."""
+    keys = [key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith('replica_')]
+    if not keys:
+        return None
+    router = ReplicaRouter(
+        db, keys,
+        max_lag=app.config.get('REPLICA_MAX_LAG', 10.0),
+        check_interval=app.config.get('REPLICA_CHECK_INTERVAL', 5.0)
+    )
+    router.app = app
+    window = app.config.get('READ_YOUR_WRITES_SECONDS', 5.0)
+
+    with app.app_context():
+        for key in keys:
+            engine = db.engines[key]
+
+            def on_error(context, key=key):
+                if context.is_disconnect or context.connection is None:
+                    router.mark_down(key, context.original_exception)
+
+            event.listen(engine, 'handle_error', on_error)
+            # Per-connection search settings (e.g. the pg_trgm threshold) apply to replicas too
+            if 'search_engine' in app.extensions:
+                app.extensions['search_engine'].attach(engine)
+
+    @app.before_request
+    def allow_replica_reads():
+        g.read_replica_allowed = (request.method in READ_ONLY_METHODS
+                                  and client_session.get(PRIMARY_UNTIL_KEY, 0) < time.time())
+
+    @app.after_request
+    def remember_write(response):
+        if g.get('read_replicas_wrote'):
+            client_session[PRIMARY_UNTIL_KEY] = time.time() + window
+        return response
+
+    app.extensions['read_replicas'] = router
+    logger.info(f"Routing read-only requests to {len(keys)} read replica(s)")
+    return router
+
+
+def replica_stats():
+    """Return the health of the current app's read replicas; empty if it has none."""
+    router = current_app.extensions.get('read_replicas')
+    return router.stats() if router is not None else []
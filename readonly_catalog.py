@@ -0,0 +1,69 @@
+"""
+Prebuilt read-only catalog for serverless deployments.
+
+A platform that starts a fresh process for each cold start (Vercel) would
+otherwise create the schema and seed the catalog before serving its first
+request. Instead ``catalog_builder.py`` writes the whole catalog at build
+time to one SQLite file, with its indexes, FTS5 index, planner statistics and
+schema fingerprint, and it ships with the bundle. Setting
+``CATALOG_DATABASE`` to that file makes the app open it in place of
+``DATABASE_URL``:
+
+* ``mode=ro&immutable=1``: SQLite takes no file locks, never checks whether
+  another process changed the file and needs no journal, so the file can sit
+  on a read-only filesystem.
+* ``PRAGMA mmap_size`` maps the file into memory, so pages are read straight
+  from the page cache instead of copied by ``read()`` calls.
+
+Startup finds the recorded schema fingerprint (see ``migrations.ensure_schema``)
+and writes nothing. Anything that does try to write fails with "attempt to
+write a readonly database".
+"""
+import logging
+import os
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the part of the catalog file mapped into memory
+MMAP_LIMIT = 1 << 30
+
+
+def database_url(path):
+    """Return the SQLAlchemy URL that opens the SQLite file at ``path`` read-only and immutable."""
+    return f"sqlite:///file:{os.path.abspath(path)}?mode=ro&immutable=1&uri=true"
+
+
+def configure(app):
+    """Point an app at its ``CATALOG_DATABASE`` file, if it has one that exists. Call before ``db.init_app``."""
+    path = app.config.get('CATALOG_DATABASE')
+    if not path:
+        return None
+    if not os.path.exists(path):
+        logger.warning(f"Catalog file {path} not found; using {app.config['SQLALCHEMY_DATABASE_URI']}")
+        return None
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url(path)
+    logger.info(f"Serving the read-only catalog in {path}")
+    return path
+
+
+def serving(app):
+    """Return whether ``configure`` pointed an app at its read-only catalog file."""
+    path = app.config.get('CATALOG_DATABASE')
+    return bool(path) and app.config['SQLALCHEMY_DATABASE_URI'] == database_url(path)
+
+
+def init_app(app, db):
+    """Memory-map the catalog file on each new connection, if ``configure`` chose one."""
+    if not serving(app):
+        return
+    path = app.config['CATALOG_DATABASE']
+    mmap_size = min(os.path.getsize(path), MMAP_LIMIT)
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def map_catalog(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"PRAGMA mmap_size = {mmap_size}")
+            cursor.close()
@@ -6,13 +6,16 @@ import sys
 from pathlib import Path
 import logging
 
+import template_cache
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("render_builder")
 
 def main():
     """
-    Explicitly copy template and static files to the correct location for Render.
+    Explicitly copy template and static files to the correct location for Render,
+    and precompile the templates there.
     This script should be run as part of the build process.
     """
     logger.info("Starting Render build script")
@@ -74,6 +77,11 @@ def main():
         logger.error("No template files found after copying")
         return 1
     
+    # Compile the templates into the bytecode cache the app will load them from
+    cache_dir = target_root / '.jinja_cache'
+    compiled = template_cache.precompile_folder(target_templates, cache_dir)
+    logger.info(f"Precompiled {compiled} templates into {cache_dir}")
+    
     logger.info("Build process completed successfully")
     return 0
 
@@ -0,0 +1,151 @@
+"""
+Streaming JSON search API for kiosk and mobile clients.
+
+Matches are read from a server-side cursor in batches (``yield_per``) and
+written out as they arrive, either as NDJSON (one object per line) or as a
+chunked JSON array. Memory use doesn't grow with the number of results, and
+clients get their first bytes before the query has finished. Clients can ask
+for a subset of fields with ``fields=isbn,status,shelf`` and for at most
+``limit`` matches, which defaults to and may not exceed
+``SEARCH_API_MAX_LIMIT``.
+"""
+import logging
+from datetime import date, datetime
+
+from flask import Response, jsonify, stream_with_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
+import projection
+
+logger = logging.getLogger(__name__)
+
+# Fields clients may request
+API_FIELDS = (
+    'id', 'title', 'author', 'isbn', 'publication_year', 'publisher',
+    'shelf', 'column', 'row', 'status', 'category', 'description', 'date_added',
+)
+
+# Rows fetched from the cursor per round trip
+STREAM_BATCH_SIZE = 500
+
+# Most matches one request streams, unless SEARCH_API_MAX_LIMIT says otherwise
+DEFAULT_MAX_LIMIT = 10000
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(obj):
+        """Serialize ``obj`` to JSON bytes."""
+        return orjson.dumps(obj, default=_default)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj):
+        """Serialize ``obj`` to JSON bytes."""
+        return _encoder.encode(obj).encode('utf-8')
+
+
+def parse_fields(value):
+    """
+    Parse a comma-separated field list.
+
+    Returns ``(fields, unknown)``. With no value the list-view fields are used.
+    """
+    if not value:
+        return list(projection.LIST_FIELDS), []
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in API_FIELDS]
+    return fields, unknown
+
+
+def parse_limit(value, max_limit=DEFAULT_MAX_LIMIT):
+    """
+    Parse the ``limit`` parameter.
+
+    Returns ``(limit, error)``: ``max_limit`` when no value is given, and the
+    JSON body of a 400 response unless the value is a whole number from 1 to
+    ``max_limit``.
+    """
+    if value is None or value == '':
+        return max_limit, None
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= max_limit:
+        return None, {'error': f"The 'limit' parameter must be a whole number from 1 to {max_limit}."}
+    return limit, None
+
+
+def _records(books, fields, limit):
+    rows = books.execution_options(yield_per=STREAM_BATCH_SIZE).limit(limit)
+    for row in rows:
+        yield dict(zip(fields, row))
+
+
+def _ndjson(records):
+    for record in records:
+        yield dumps(record) + b'\n'
+
+
+def _json_array(records):
+    yield b'{"results":['
+    first = True
+    for record in records:
+        if not first:
+            yield b','
+        first = False
+        yield dumps(record)
+    yield b']}'
+
+
+def check_request(query, fields, output_format):
+    """
+    Validate the parameters of a search stream.
+
+    Returns ``(fields, error)`` where ``fields`` is the parsed field list and
+    ``error`` the JSON body of a 400 response, or None if the request is good.
+    """
+    if not query:
+        return None, {'error': "The 'query' parameter is required."}
+    fields, unknown = parse_fields(fields)
+    if unknown:
+        return None, {'error': f"Unknown fields: {', '.join(unknown)}", 'allowed': list(API_FIELDS)}
+    if output_format not in ('ndjson', 'json'):
+        return None, {'error': "The 'format' parameter must be 'ndjson' or 'json'."}
+    return fields, None
+
+
+def stream_search(engine, query, fields=None, output_format='ndjson', limit=None,
+                  max_limit=DEFAULT_MAX_LIMIT):
+    """
+    Return a streaming Response with the matches of ``query``, best first.
+
+    ``output_format`` is 'ndjson' or 'json', and ``limit`` the raw parameter
+    (see parse_limit). Bad requests get a 400 JSON error.
+    """
+    fields, error = check_request(query, fields, output_format)
+    if not error:
+        limit, error = parse_limit(limit, max_limit)
+    if error:
+        return jsonify(error), 400
+
+    model = engine.model
+    books = engine.search(query, limit=limit).with_entities(*(getattr(model, field) for field in fields))
+    records = _records(books, fields, limit)
+
+    if output_format == 'ndjson':
+        body, mimetype = _ndjson(records), 'application/x-ndjson'
+    else:
+        body, mimetype = _json_array(records), 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype)
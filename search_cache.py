@@ -0,0 +1,137 @@
+"""
+In-process cache of search result pages.
+
+Entries are keyed on the normalized query text plus any filters (page
+cursor, page size, ...), evicted least-recently-used once the cache is full,
+and expire after a TTL. Every committed insert, update or delete of a Book
+clears the cache through model_events. Misses go through the optional
+``single_flight`` (see single_flight.py), so identical concurrent searches
+run once.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+import model_events
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def normalize_query(query):
+    """Case-fold a query and collapse its whitespace."""
+    return ' '.join(query.casefold().split())
+
+
+def cache_key(query, **filters):
+    """Build a cache key from the search text and the filters applied to it."""
+    return normalize_query(query), tuple(sorted(filters.items()))
+
+
+class SearchCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size=512, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Optional single_flight.SingleFlight that coalesces concurrent misses
+        self.single_flight = None
+        # Optional function called with the key of each entry evicted, expired or cleared
+        self.on_evict = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key``, or ``default`` if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self._evicted(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries if full."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                self._evicted(evicted)
+
+    def _evicted(self, key):
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def get_or_set(self, key, compute):
+        """Return the cached value for ``key``, computing and storing it on a miss."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.single_flight is None:
+            return self._compute_and_set(key, compute)
+        return self.single_flight.do(key, lambda: self._compute_and_set(key, compute))
+
+    def _compute_and_set(self, key, compute):
+        value = compute()
+        self.set(key, value)
+        return value
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            keys = list(self._entries) if self.on_evict is not None else ()
+            self._entries.clear()
+            self.invalidations += 1
+            for key in keys:
+                self._evicted(key)
+
+    def stats(self):
+        """Return the counters used to size the cache."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+def init_app(app, model):
+    """Create the search cache for an app and invalidate it on every change to ``model``."""
+    cache = SearchCache(
+        max_size=app.config.get('SEARCH_CACHE_SIZE', 512),
+        ttl=app.config.get('SEARCH_CACHE_TTL', 300)
+    )
+    model_events.subscribe(model, lambda op, row: cache.clear())
+    app.extensions['search_cache'] = cache
+    return cache
+
+
+def get_search_cache():
+    """Return the search cache registered on the current app."""
+    return current_app.extensions['search_cache']
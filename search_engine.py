@@ -0,0 +1,637 @@
+"""
+Full-text search backends for the book catalog.
+
+Both app.py and direct.py run their searches through a SearchEngine instead
+of building ILIKE filters themselves. The backend is picked from the database
+dialect and the ``SEARCH_MODE`` setting:
+
+* ``fulltext`` (default): SQLite gets an FTS5 external-content table kept in
+  sync by triggers, PostgreSQL gets a GIN index over a tsvector expression.
+* ``substring``: partial-word matching. PostgreSQL uses pg_trgm GIN indexes,
+  SQLite uses the in-process n-gram index from ngram_index.py.
+
+Title and author are searched through their normalized copies (see
+normalize.py), so "bronte" finds "Brontë" without per-row ``lower()``.
+"""
+import logging
+import re
+
+from flask import current_app
+from sqlalchemy import Float, Integer, case, column, event, false, func, literal_column, or_, select, text
+
+import lazy_index
+import model_events
+import projection
+from facets import apply_filters, facet_counts
+from ngram_index import NgramIndex
+from normalize import NORMALIZED_COLUMNS, normalize_text
+from pagination import Page, capped_count, decode_cursor, encode_cursor, keyset_page
+from search_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+# Columns that take part in free-text search
+SEARCH_FIELDS = ('title', 'author', 'isbn')
+
+# Columns actually compared: the normalized copy where there is one
+SEARCH_COLUMNS = tuple(NORMALIZED_COLUMNS.get(field, field) for field in SEARCH_FIELDS)
+
+_ISBN_SEPARATOR_RE = re.compile(r"[\s-]+")
+
+# First value of a page token holding a position in the ranked candidates
+RANKED_TOKEN = 'ranked'
+
+
+def tokenize(query):
+    """Split text into normalized word tokens (see normalize.normalize_text)."""
+    return normalize_text(query).split()
+
+
+def compact_isbn(query):
+    """
+    Strip the spaces and hyphens people type inside ISBNs.
+
+    A query without digits can't be part of an ISBN, and gives ''.
+    """
+    if not any(ch.isdigit() for ch in query):
+        return ''
+    return _ISBN_SEPARATOR_RE.sub('', query).upper()
+
+
+def escape_like(value):
+    """Escape the LIKE wildcards in ``value``, for a pattern with ``escape='\\'``."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class Ranking:
+    """
+    The ranked candidates of one search.
+
+    ``ids`` are the first ``candidate_limit`` matches in the engine's own
+    order, which is its own relevance score where it has one, reordered by
+    the ranker. When more books matched, ``rest`` holds the sort-key values
+    of the last candidate in the engine's order, after which the remaining
+    matches are paged by keyset; otherwise it is None.
+    """
+
+    __slots__ = ('ids', 'rest')
+
+    def __init__(self, ids, rest=None):
+        self.ids = ids
+        self.rest = rest
+
+
+class SearchEngine:
+    """
+    Plain ILIKE search over the search fields.
+
+    This is the fallback used when the database offers no full-text support;
+    the dialect-specific engines below override ``criterion``.
+    """
+    name = 'like'
+    # Whether matches are ranked in Python and paged by offset (see SQLiteSubstringEngine)
+    ranks_in_memory = False
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+        self.table_name = model.__tablename__
+        # Optional relevance ranker (see ranking.py) applied to the candidates
+        self.ranker = None
+        # Optional in-memory catalog (see catalog_snapshot.py) that result pages are filled from
+        self.snapshot = None
+        # Optional cache of Rankings by search (see ranking.py), so later pages don't rank again
+        self.rankings = None
+
+    def install(self):
+        """Create any database objects the engine needs. Safe to call repeatedly."""
+
+    def warm_up(self):
+        """Build any in-process index the engine searches, ahead of the first search."""
+
+    def attach(self, engine):
+        """Apply any per-connection settings the engine needs to another SQLAlchemy engine."""
+
+    def search_columns(self):
+        """Return the compared columns, in SEARCH_FIELDS order."""
+        return [getattr(self.model, name) for name in SEARCH_COLUMNS]
+
+    def like_criterion(self, query):
+        """Return a substring filter comparing the normalized query with the normalized columns."""
+        normalized, isbn = normalize_text(query), compact_isbn(query)
+        clauses = []
+        for field, column_ in zip(SEARCH_FIELDS, self.search_columns()):
+            value = isbn if field == 'isbn' else normalized
+            if value:
+                clauses.append(column_.like(f'%{escape_like(value)}%', escape='\\'))
+        return or_(*clauses) if clauses else false()
+
+    def criterion(self, query):
+        """Return a filter expression matching books for the given query."""
+        return self.like_criterion(query)
+
+    def sort_keys(self, query):
+        """Return the engine's own ascending sort keys, ending with the primary key."""
+        return [self.model.id]
+
+    def rank_keys(self, ids):
+        """Return sort keys that put ``ids`` first, in order, then everything else by id."""
+        if not ids:
+            return [self.model.id]
+        rank = case({doc_id: position for position, doc_id in enumerate(ids)},
+                    value=self.model.id, else_=len(ids))
+        return [rank, self.model.id]
+
+    def matches(self, query, filters=None, limit=None):
+        """
+        Return ``(books, sort_keys)`` for the search text before any ranking.
+
+        ``books`` is an unordered query of the matches, narrowed by any facet
+        ``filters``, and ``sort_keys`` the ascending expressions that put the
+        best match first, ending with the primary key so the order is total.
+        ``limit`` is how many of the best matches the caller reads at most;
+        an engine that ranks in memory returns only those.
+        """
+        books = apply_filters(self.model.query.filter(self.criterion(query)), self.model, filters)
+        return books, self.sort_keys(query)
+
+    def candidates(self, books, sort_keys):
+        """
+        Return a query of the first ``candidate_limit`` matches, plus one, for the ranker.
+
+        Each row holds the id followed by the values of ``sort_keys``.
+        """
+        labelled = [key.label(f'sort_key_{i}') for i, key in enumerate(sort_keys)]
+        return (books.with_entities(self.model.id, *labelled).order_by(*sort_keys)
+                .limit(self.ranker.candidate_limit + 1))
+
+    def rank_candidates(self, query, rows):
+        """
+        Return the Ranking of the rows of a ``candidates`` query.
+
+        Until the ranker's statistics are loaded, which starts them loading
+        in the background, the candidates keep the engine's order.
+        """
+        limit = self.ranker.candidate_limit
+        rest = list(rows[limit - 1][1:]) if len(rows) > limit else None
+        ids = [row[0] for row in rows[:limit]]
+        return Ranking(self.ranker.rank(ids, query) if self.ranker.ready() else ids, rest)
+
+    def ranking_key(self, query, filters=None):
+        """Return the ``rankings`` key of a search under the ranker's current statistics."""
+        return cache_key(query, ranked=self.ranker.fingerprint, **(filters or {}))
+
+    def ranking(self, query, filters, books, sort_keys):
+        """Return the Ranking of a search whose ``matches`` are ``(books, sort_keys)``."""
+        def compute():
+            return self.rank_candidates(query, self.candidates(books, sort_keys).all())
+
+        # Rankings made before the statistics are loaded aren't kept
+        if self.rankings is None or not self.ranker.ready():
+            return compute()
+        return self.rankings.get_or_set(self.ranking_key(query, filters), compute)
+
+    def ranked_slice(self, ranking, cursor, page_size):
+        """
+        Return which ranked candidates fill the page after ``cursor``.
+
+        The result is ``(ids, next_token, rest_token, rest_size)``. When the
+        page runs past the ranked candidates into the remaining matches, its
+        other ``rest_size`` rows are the keyset page after ``rest_token``, which
+        also decides the next token; otherwise ``rest_token`` is None.
+        """
+        after = decode_cursor(cursor)
+        if after and after[0] == RANKED_TOKEN:
+            start = after[1] if len(after) == 2 and isinstance(after[1], int) and after[1] >= 0 else 0
+        elif after:
+            # Already past the ranked candidates
+            return [], None, cursor, page_size
+        else:
+            start = 0
+        end = start + page_size
+        ids = ranking.ids[start:end]
+        if end < len(ranking.ids):
+            return ids, encode_cursor([RANKED_TOKEN, end]), None, 0
+        if ranking.rest is None:
+            return ids, None, None, 0
+        if len(ids) == page_size:
+            # The page ends on the last candidate, and more matches follow
+            return ids, encode_cursor(ranking.rest), None, 0
+        return ids, None, encode_cursor(ranking.rest), page_size - len(ids)
+
+    def build(self, query, filters=None, limit=None):
+        """
+        Return ``(books, sort_keys)`` for the search text, as from ``matches``.
+
+        With a ranker, the first ``candidate_limit`` matches are reordered by
+        relevance.
+        """
+        books, sort_keys = self.matches(query, filters, limit)
+        if self.ranker is None:
+            return books, sort_keys
+        return books, self.rank_keys(self.ranking(query, filters, books, sort_keys).ids)
+
+    def search(self, query, filters=None, limit=None):
+        """Return a query of the books matching the search text, best first; see ``matches`` for ``limit``."""
+        books, sort_keys = self.build(query, filters, limit)
+        return books.order_by(*sort_keys)
+
+    def facets(self, query, filters=None):
+        """Return facet counts (see facets.facet_counts) for the books matching the search text."""
+        books = apply_filters(self.model.query.filter(self.criterion(query)), self.model, filters)
+        return facet_counts(books, self.model)
+
+    def paginate(self, query, cursor=None, page_size=20, count_cap=1000, summaries=False,
+                 filters=None):
+        """
+        Return one Page of the books matching the search text.
+
+        With ``summaries=True`` the page holds projection.BookSummary records
+        of the list-view columns instead of full Book objects. With a catalog
+        snapshot, only the ids of the page are selected and the records come
+        from the snapshot.
+
+        With a ranker, pages are sliced from the search's cached Ranking, and
+        only the matches beyond the ranked candidates are paged by keyset.
+        """
+        books, sort_keys = self.matches(query, filters)
+        if self.ranker is None:
+            return self._keyset_page(books, sort_keys, cursor, page_size, count_cap, summaries)
+        ranking = self.ranking(query, filters, books, sort_keys)
+        ids, next_token, rest_token, rest_size = self.ranked_slice(ranking, cursor, page_size)
+        items = self._items(ids, summaries)
+        if rest_token is not None:
+            page = self._keyset_page(books, sort_keys, rest_token, rest_size, count_cap, summaries)
+            page.items = items + page.items
+            return page
+        if ranking.rest is None:
+            total, capped = min(len(ranking.ids), count_cap), len(ranking.ids) > count_cap
+        else:
+            total, capped = capped_count(books, count_cap)
+        return Page(items, next_token, total, capped)
+
+    def _items(self, ids, summaries):
+        """Return the page items for ``ids``, in order."""
+        if not ids:
+            return []
+        if not summaries:
+            books = {book.id: book for book in self.model.query.filter(self.model.id.in_(ids))}
+            return [books[book_id] for book_id in ids if book_id in books]
+        if self.snapshot is not None:
+            return self.snapshot.summaries(ids)
+        make_summary = projection.summary_factory(self.model)
+        rows = self.db.session.execute(projection.summaries_by_id(self.model, ids))
+        return [make_summary(row) for row in rows]
+
+    def _keyset_page(self, books, sort_keys, cursor, page_size, count_cap, summaries):
+        if not summaries:
+            return keyset_page(books, sort_keys, cursor=cursor, page_size=page_size, count_cap=count_cap)
+        if self.snapshot is not None:
+            page = keyset_page(
+                books, sort_keys, cursor=cursor, page_size=page_size, count_cap=count_cap,
+                columns=[self.model.id], make_item=lambda row: row[0]
+            )
+            page.items = self.snapshot.summaries(page.items)
+            return page
+        return keyset_page(
+            books, sort_keys, cursor=cursor, page_size=page_size, count_cap=count_cap,
+            columns=projection.list_columns(self.model),
+            make_item=projection.summary_factory(self.model)
+        )
+
+
+class SQLiteSearchEngine(SearchEngine):
+    """
+    FTS5-backed search for SQLite.
+
+    The ``<table>_fts`` virtual table uses the book table as external content,
+    so only the index is stored. INSERT/UPDATE/DELETE triggers on the book table
+    keep it current, whichever code path writes the row.
+    """
+    name = 'sqlite-fts5'
+
+    @property
+    def fts_table(self):
+        return f'{self.table_name}_fts'
+
+    def install(self):
+        fields = ', '.join(SEARCH_FIELDS)
+        new_values = ', '.join(f'new.{field}' for field in SEARCH_FIELDS)
+        old_values = ', '.join(f'old.{field}' for field in SEARCH_FIELDS)
+        fts, table = self.fts_table, self.table_name
+
+        objects = {'fts': fts, 'ai': f'{fts}_ai', 'ad': f'{fts}_ad', 'au': f'{fts}_au'}
+
+        # Usually everything is in place: check with a read instead of taking the write lock for DDL
+        with self.db.engine.connect() as conn:
+            existing = set(conn.execute(
+                text("SELECT name FROM sqlite_master WHERE name IN (:fts, :ai, :ad, :au)"), objects
+            ).scalars())
+        if existing == set(objects.values()):
+            return
+
+        with self.db.engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"{fields}, content='{table}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, {fields}) VALUES (new.id, {new_values}); END"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {fields}) VALUES ('delete', old.id, {old_values}); END"
+            ))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {fields}) VALUES ('delete', old.id, {old_values}); "
+                f"INSERT INTO {fts}(rowid, {fields}) VALUES (new.id, {new_values}); END"
+            ))
+
+            # Index rows that were written before the FTS table existed
+            if fts not in existing:
+                conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+                logger.info(f"Built FTS5 index {fts}")
+
+    @staticmethod
+    def match_expression(tokens):
+        """Return the FTS5 query requiring every token, each as a prefix so partially typed words still hit."""
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def criterion(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return self.like_criterion(query)
+        matching_ids = text(
+            f"SELECT rowid FROM {self.fts_table} WHERE {self.fts_table} MATCH :fts_query"
+        ).bindparams(fts_query=self.match_expression(tokens)).columns(column('rowid'))
+        return self.model.id.in_(matching_ids)
+
+    def matches(self, query, filters=None, limit=None):
+        """Join the matches to their FTS5 ``bm25()`` score, so the best come first and are the ones ranked."""
+        tokens = tokenize(query)
+        if not tokens:
+            return super().matches(query, filters, limit)
+        fts = self.fts_table
+        scored = text(
+            f"SELECT rowid, bm25({fts}) AS score FROM {fts} WHERE {fts} MATCH :fts_query"
+        ).bindparams(fts_query=self.match_expression(tokens)).columns(
+            column('rowid', Integer), column('score', Float)
+        ).subquery('fts_matches')
+        books = self.model.query.join(scored, self.model.id == scored.c.rowid)
+        # bm25() is lower for better matches
+        return apply_filters(books, self.model, filters), [scored.c.score, self.model.id]
+
+
+class PostgresSearchEngine(SearchEngine):
+    """
+    tsvector-backed search for PostgreSQL.
+
+    The GIN index is built over the same expression the queries use, so
+    PostgreSQL maintains it on every insert and update without triggers or an
+    extra column.
+    """
+    name = 'postgres-tsvector'
+
+    @property
+    def document(self):
+        fields = " || ' ' || ".join(f"coalesce({name}, '')" for name in SEARCH_COLUMNS)
+        return f"to_tsvector('simple', {fields})"
+
+    def install(self):
+        with self.db.engine.begin() as conn:
+            # Superseded by the index over the normalized columns
+            conn.execute(text(f"DROP INDEX IF EXISTS ix_{self.table_name}_fts"))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{self.table_name}_norm_fts "
+                f"ON {self.table_name} USING GIN ({self.document})"
+            ))
+
+    @staticmethod
+    def ts_query(tokens):
+        """Return the tsquery text requiring every token, each as a prefix."""
+        return ' & '.join(f'{token}:*' for token in tokens)
+
+    def criterion(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return self.like_criterion(query)
+        return text(
+            f"{self.document} @@ to_tsquery('simple', :fts_query)"
+        ).bindparams(fts_query=self.ts_query(tokens))
+
+    def sort_keys(self, query):
+        """Best ``ts_rank`` first, so the candidates handed to the ranker are the most relevant matches."""
+        tokens = tokenize(query)
+        if not tokens:
+            return super().sort_keys(query)
+        rank = func.ts_rank(literal_column(self.document),
+                            func.to_tsquery(literal_column("'simple'"), self.ts_query(tokens)), type_=Float)
+        return [-rank, self.model.id]
+
+
+class PostgresSubstringEngine(SearchEngine):
+    """
+    pg_trgm-backed substring search for PostgreSQL.
+
+    Leading-wildcard ILIKE can use a trigram GIN index, so the legacy filter
+    becomes indexed. Rows that don't contain the query but are similar enough
+    (the ``%`` operator, governed by ``pg_trgm.similarity_threshold``) also
+    match, and results are ordered by similarity.
+    """
+    name = 'postgres-trgm'
+
+    def __init__(self, db, model, similarity_threshold=0.3):
+        super().__init__(db, model)
+        self.similarity_threshold = similarity_threshold
+
+    def install(self):
+        with self.db.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for field, name in zip(SEARCH_FIELDS, SEARCH_COLUMNS):
+                if name != field:
+                    # Superseded by the index over the normalized column
+                    conn.execute(text(f"DROP INDEX IF EXISTS ix_{self.table_name}_{field}_trgm"))
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{self.table_name}_{name}_trgm "
+                    f"ON {self.table_name} USING GIN ({name} gin_trgm_ops)"
+                ))
+
+        self.attach(self.db.engine)
+        # Pooled connections predate the listener; reopen them with the setting applied
+        self.db.engine.dispose()
+
+    def attach(self, engine):
+        threshold = float(self.similarity_threshold)
+
+        @event.listens_for(engine, 'connect')
+        def set_similarity_threshold(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET pg_trgm.similarity_threshold = {threshold}")
+            cursor.close()
+
+    def _compared(self, query):
+        """Pair each search column with the form of the query it is compared against."""
+        normalized, isbn = normalize_text(query), compact_isbn(query)
+        return [(column_, isbn if field == 'isbn' else normalized)
+                for field, column_ in zip(SEARCH_FIELDS, self.search_columns())]
+
+    def criterion(self, query):
+        similar = [column_.op('%')(value) for column_, value in self._compared(query) if value]
+        return or_(self.like_criterion(query), *similar)
+
+    def sort_keys(self, query):
+        similarity = func.greatest(*(
+            func.similarity(column_, value) for column_, value in self._compared(query)
+        ))
+        return [-similarity, self.model.id]
+
+
+class SQLiteSubstringEngine(SearchEngine):
+    """
+    Substring search for SQLite backed by an in-process n-gram index.
+
+    The index is built from the book table on first use (see lazy_index.py)
+    and kept current through model_events, which also carries other
+    processes' changes (see catalog_sync.py), so lookups intersect posting
+    lists instead of scanning rows.
+
+    Matches are ranked by similarity in Python, and only the ones up to the
+    page being read are picked out, with a heap. SQL then fetches just that
+    page's ids, so a query matching most of the catalog never sorts by a
+    ``CASE`` over every match. Pages are addressed by their offset into the
+    ranking, and the total is the number of matches the index found.
+    """
+    name = 'sqlite-ngram'
+    ranks_in_memory = True
+
+    def __init__(self, db, model, similarity_threshold=0.3):
+        super().__init__(db, model)
+        self.similarity_threshold = similarity_threshold
+        self.index = NgramIndex(fields=SEARCH_COLUMNS)
+
+    def install(self):
+        self.index.defer(self._build)
+        model_events.subscribe(self.model, self.index.changed)
+
+    def _build(self, index):
+        with self.db.engine.connect() as conn:
+            for row in conn.execute(select(self.model.id, *self.search_columns())):
+                index.add(row[0], row[1:])
+        logger.info(f"Built n-gram index over {len(index)} books")
+
+    def warm_up(self):
+        self.index.ensure_loaded()
+
+    def allowed_ids(self, filters):
+        """Return the set of ids passing the facet ``filters``, or None without any."""
+        if not filters:
+            return None
+        books = apply_filters(self.model.query, self.model, filters)
+        return {book_id for book_id, in books.with_entities(self.model.id)}
+
+    def ranked_ids(self, query, filters=None, limit=None):
+        """Return ``(ids, total)``: the best ``limit`` matching ids, most similar first, and the number of matches."""
+        matches, total = self.index.top(normalize_text(query), self.similarity_threshold,
+                                        limit, self.allowed_ids(filters))
+        return [doc_id for doc_id, score in matches], total
+
+    def ranked_head(self, query, filters=None):
+        """Return ``(ids, total)`` with the first ``candidate_limit`` matches reordered by the ranker."""
+        def compute():
+            ids, total = self.ranked_ids(query, filters, self.ranker.candidate_limit)
+            return self.ranker.rank(ids, query), total
+
+        if self.rankings is None:
+            return compute()
+        return self.rankings.get_or_set(self.ranking_key(query, filters), compute)
+
+    def ordered_ids(self, query, filters=None, limit=None):
+        """
+        Return ``(ids, total)`` as ``ranked_ids`` does, in the ranker's order over its candidates.
+
+        Until the ranker's statistics are loaded, matches stay in order of similarity.
+        """
+        if self.ranker is None or not self.ranker.ready():
+            return self.ranked_ids(query, filters, limit)
+        head, total = self.ranked_head(query, filters)
+        if total == len(head) or (limit is not None and limit <= len(head)):
+            return head[:limit], total
+        ids, total = self.ranked_ids(query, filters, limit)
+        return head + ids[len(head):], total
+
+    def criterion(self, query):
+        return self.model.id.in_(list(self.index.scores(normalize_text(query), self.similarity_threshold)))
+
+    def matches(self, query, filters=None, limit=None):
+        ids, total = self.ordered_ids(query, filters, limit)
+        return self.model.query.filter(self.model.id.in_(ids)), self.rank_keys(ids)
+
+    def build(self, query, filters=None, limit=None):
+        # matches() has applied the ranker already
+        return self.matches(query, filters, limit)
+
+    def page_ids(self, query, cursor=None, page_size=20, filters=None):
+        """Return ``(ids, next_token, total)`` for the page of matches after ``cursor``."""
+        after = decode_cursor(cursor)
+        start = 0
+        if after and after[0] == RANKED_TOKEN and len(after) == 2 and isinstance(after[1], int) and after[1] >= 0:
+            start = after[1]
+        end = start + page_size
+        ids, total = self.ordered_ids(query, filters, end)
+        next_token = encode_cursor([RANKED_TOKEN, end]) if end < total else None
+        return ids[start:end], next_token, total
+
+    def paginate(self, query, cursor=None, page_size=20, count_cap=1000, summaries=False,
+                 filters=None):
+        ids, next_token, total = self.page_ids(query, cursor, page_size, filters)
+        return Page(self._items(ids, summaries), next_token, min(total, count_cap), total > count_cap)
+
+
+ENGINES = {
+    ('sqlite', 'fulltext'): SQLiteSearchEngine,
+    ('postgresql', 'fulltext'): PostgresSearchEngine,
+    ('sqlite', 'substring'): SQLiteSubstringEngine,
+    ('postgresql', 'substring'): PostgresSubstringEngine,
+}
+
+
+def create_search_engine(db, model, mode='fulltext', similarity_threshold=0.3):
+    """
+    Build and install the search engine for the current database and mode.
+
+    Falls back to plain ILIKE matching if the search objects can't be
+    created (e.g. SQLite compiled without FTS5, or pg_trgm not available).
+    """
+    engine_class = ENGINES.get((db.engine.dialect.name, mode), SearchEngine)
+    if engine_class in (PostgresSubstringEngine, SQLiteSubstringEngine):
+        engine = engine_class(db, model, similarity_threshold=similarity_threshold)
+    else:
+        engine = engine_class(db, model)
+    try:
+        engine.install()
+    except Exception as e:
+        logger.error(f"Could not install {engine.name} search engine: {e}")
+        engine = SearchEngine(db, model)
+    logger.info(f"Using {engine.name} search engine")
+    return engine
+
+
+def init_app(app, db, model):
+    """Create the search engine for an app and register it on ``app.extensions``."""
+    with app.app_context():
+        engine = create_search_engine(
+            db, model,
+            mode=app.config.get('SEARCH_MODE', 'fulltext'),
+            similarity_threshold=app.config.get('SEARCH_SIMILARITY_THRESHOLD', 0.3)
+        )
+    lazy_index.on_warm_up(app, engine.warm_up)
+    app.extensions['search_engine'] = engine
+    return engine
+
+
+def get_search_engine():
+    """Return the search engine registered on the current app."""
+    return current_app.extensions['search_engine']
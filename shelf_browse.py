@@ -0,0 +1,77 @@
+"""
+Browsing a shelf in physical order.
+
+Books are ordered by ``(shelf, column, row, id)``, the columns of the
+``ix_book_shelf_order`` index. Listing a shelf is a range scan of that
+index, and stepping to the previous or next book is a single seek:
+``WHERE shelf = :shelf AND (column, row, id) > (:column, :row, :id)
+ORDER BY column, row, id LIMIT 1``. Column and row sort as their stored
+text, which for the catalog's values ("1"-"3"; "Bottom", "Middle", "Top")
+is their physical order, bottom row first.
+"""
+from sqlalchemy import func, select, tuple_
+
+import projection
+from pagination import keyset_page
+
+
+def order_keys(model):
+    """Return the ascending sort keys of books within a shelf."""
+    return [model.column, model.row, model.id]
+
+
+def shelf_query(model, shelf, column=None):
+    """Return a query of the books on a shelf, optionally narrowed to one column."""
+    books = model.query.filter(model.shelf == shelf)
+    if column:
+        books = books.filter(model.column == column)
+    return books
+
+
+def shelf_page(model, shelf, column=None, cursor=None, page_size=20, count_cap=1000):
+    """Return a pagination.Page of BookSummary records for a shelf, in physical order."""
+    return keyset_page(
+        shelf_query(model, shelf, column), order_keys(model),
+        cursor=cursor, page_size=page_size, count_cap=count_cap,
+        columns=projection.list_columns(model),
+        make_item=projection.summary_factory(model)
+    )
+
+
+def column_counts_statement(model, shelf):
+    """Return a statement counting the books in each column of a shelf."""
+    return (select(model.column, func.count())
+            .where(model.shelf == shelf)
+            .group_by(model.column)
+            .order_by(model.column))
+
+
+def neighbor_statements(model, book):
+    """Return ``(previous, next)`` statements selecting the list-view columns of a book's shelf neighbors."""
+    keys = order_keys(model)
+    here = tuple_(book.column, book.row, book.id)
+    on_shelf = select(*projection.list_columns(model)).where(model.shelf == book.shelf)
+    previous = on_shelf.where(tuple_(*keys) < here).order_by(*(key.desc() for key in keys)).limit(1)
+    following = on_shelf.where(tuple_(*keys) > here).order_by(*keys).limit(1)
+    return previous, following
+
+
+def neighbors(model, book):
+    """Return the BookSummary records before and after ``book`` on its shelf; None at either end."""
+    session = model.query.session
+    make_summary = projection.summary_factory(model)
+    rows = [session.execute(statement).first() for statement in neighbor_statements(model, book)]
+    return tuple(make_summary(row) if row is not None else None for row in rows)
+
+
+def shelf_payload(shelf, column, page, column_counts):
+    """Shape a shelf page for the JSON API."""
+    return {
+        'shelf': shelf,
+        'column': column,
+        'total': page.total,
+        'total_capped': page.total_capped,
+        'columns': [{'column': value, 'count': count} for value, count in column_counts],
+        'results': [{field: getattr(book, field) for field in projection.LIST_FIELDS} for book in page.items],
+        'next': page.next_token,
+    }
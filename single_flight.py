@@ -0,0 +1,276 @@
+"""
+Coalescing of identical concurrent searches.
+
+When many requests for the same normalized search arrive together (a reading
+list posted to a class, say), only the first runs the queries; the others
+wait for it and share its result. The SearchCache calls through a
+SingleFlight on every miss, so the key is the same normalized cache key.
+
+Across worker processes, ``lock_dir`` turns on a second stage: the leader of
+each worker takes an exclusive ``flock`` on the lock file of its key, the
+first to get it runs the search and writes the result next to it, and
+workers that had to wait read that result instead of repeating the queries.
+Each key has its own lock file, so unrelated searches never wait on each
+other, and a worker waits at most ``wait_timeout`` seconds before running
+the search itself, so one hung search doesn't stall the others. Lock and
+result files unused for ``RESULT_MAX_AGE`` seconds are removed.
+
+Results are shared as JSON, never unpickled: a Page of BookSummary records
+is stored as the list-view columns of each row, and facet counts as lists.
+Other results are not shared.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import current_app
+
+import pagination
+import projection
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Lock and result files unused for this many seconds are removed
+RESULT_MAX_AGE = 60
+
+# Seconds between attempts to take a lock another worker holds
+LOCK_POLL_INTERVAL = 0.01
+
+
+class _Call:
+    """A computation in flight in this process."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and hands its result to concurrent callers."""
+
+    def __init__(self, lock_dir=None, wait_timeout=5.0, model=None):
+        self.lock_dir = lock_dir
+        self.wait_timeout = wait_timeout
+        # Rebuilds shared BookSummary records; without it, pages aren't shared
+        self.make_summary = projection.summary_factory(model) if model is not None else None
+        if lock_dir and fcntl is None:
+            logger.warning("File locks are not available on this platform; coalescing within each worker only")
+            self.lock_dir = None
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+        self._calls = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+        self.executions = 0
+        self.coalesced = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def do(self, key, compute):
+        """Return ``compute()``, or the result of an identical call already running."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            if self.lock_dir:
+                call.value = self._do_shared(key, compute)
+            else:
+                call.value = self._execute(compute)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, compute):
+        """Coroutine version of ``do`` for the ASGI app; ``compute`` returns an awaitable."""
+        future = self._futures.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # Shielded so a cancelled follower doesn't cancel the shared call
+            return await asyncio.shield(future)
+
+        future = self._futures[key] = asyncio.get_running_loop().create_future()
+        try:
+            self.executions += 1
+            value = await compute()
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody was waiting
+            future.exception()
+            raise
+        finally:
+            del self._futures[key]
+
+    def _execute(self, compute):
+        with self._lock:
+            self.executions += 1
+        return compute()
+
+    def _do_shared(self, key, compute):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        lock_path = os.path.join(self.lock_dir, f'{digest}.lock')
+        result_path = os.path.join(self.lock_dir, f'{digest}.result')
+        started = time.time()
+
+        with open(lock_path, 'a+b') as lock_file:
+            if not self._try_lock(lock_file):
+                # Another worker is searching; wait for it and use its result if it was ours
+                if not self._wait_for_lock(lock_file):
+                    with self._lock:
+                        self.timeouts += 1
+                    logger.warning(f"Waited over {self.wait_timeout}s for another worker's search; running it here")
+                    return self._execute(compute)
+                value = self._read_result(result_path, key, started)
+                if value is not None:
+                    with self._lock:
+                        self.shared += 1
+                    return value
+            # Marks the lock file used, so pruning leaves it
+            os.utime(lock_path)
+            value = self._execute(compute)
+            self._write_result(result_path, key, value)
+        self._prune()
+        return value
+
+    @staticmethod
+    def _try_lock(lock_file):
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _wait_for_lock(self, lock_file):
+        """Take the lock within ``wait_timeout`` seconds; returns whether it was taken."""
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            if self._try_lock(lock_file):
+                return True
+        return False
+
+    def _encode(self, value):
+        """Return a JSON-serializable form of a result, or None if it isn't shared."""
+        if isinstance(value, pagination.Page):
+            if self.make_summary is None or not all(isinstance(item, projection.BookSummary) for item in value.items):
+                return None
+            return {'page': {
+                'items': [[getattr(item, field) for field in projection.LIST_FIELDS] for item in value.items],
+                'next_token': value.next_token,
+                'total': value.total,
+                'total_capped': value.total_capped,
+            }}
+        if isinstance(value, dict):
+            return {'value': value}
+        return None
+
+    def _decode(self, data):
+        page = data.get('page')
+        if page is None:
+            return data['value']
+        return pagination.Page([self.make_summary(row) for row in page['items']], page['next_token'],
+                               page['total'], page['total_capped'])
+
+    def _read_result(self, path, key, not_before):
+        try:
+            if os.path.getmtime(path) < not_before:
+                return None
+            with open(path, encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored['key'] != repr(key):
+                return None
+            return self._decode(stored['result'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.debug(f"No shared result at {path}: {e}")
+            return None
+
+    def _write_result(self, path, key, value):
+        result = self._encode(value)
+        if result is None:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.lock_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'key': repr(key), 'result': result}, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not share search result at {path}: {e}")
+
+    def _prune(self):
+        now = time.time()
+        if now - self._pruned_at < RESULT_MAX_AGE:
+            return
+        self._pruned_at = now
+        for entry in os.scandir(self.lock_dir):
+            try:
+                if now - entry.stat().st_mtime <= RESULT_MAX_AGE:
+                    continue
+                if entry.name.endswith(('.result', '.tmp')):
+                    os.remove(entry.path)
+                elif entry.name.endswith('.lock'):
+                    self._remove_lock(entry.path)
+            except OSError:
+                pass
+
+    def _remove_lock(self, path):
+        """Remove a lock file unless a worker holds it."""
+        with open(path, 'a+b') as lock_file:
+            if self._try_lock(lock_file):
+                # A worker that opened it before this can still lock the old file and search
+                # alongside one using a new file; the search then merely runs twice
+                os.remove(path)
+
+    def stats(self):
+        """Return how many searches ran and how many were served by another caller's run."""
+        return {
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'shared_across_workers': self.shared,
+            'wait_timeouts': self.timeouts,
+            'cross_worker': bool(self.lock_dir),
+        }
+
+
+def init_app(app, model):
+    """Route the app's search cache misses through a SingleFlight, sharing pages of ``model`` summaries."""
+    flight = SingleFlight(
+        lock_dir=app.config.get('SEARCH_COALESCE_LOCK_DIR'),
+        wait_timeout=app.config.get('SEARCH_COALESCE_TIMEOUT', 5.0),
+        model=model
+    )
+    app.extensions['search_cache'].single_flight = flight
+    app.extensions['single_flight'] = flight
+    return flight
+
+
+def get_single_flight():
+    """Return the SingleFlight registered on the current app."""
+    return current_app.extensions['single_flight']
@@ -0,0 +1,338 @@
+"""
+Search-as-you-type suggestions for titles and authors.
+
+Completions come from an in-memory sorted array searched with bisect, so a
+keystroke never reaches the database. Every title and author is indexed once
+per word start ("the great gatsby", "great gatsby", "gatsby"), so typing any
+word of it finds it. Completions are ranked by popularity: how often the term
+has been searched for, then how many books carry it.
+
+Every term under a prefix is ranked, not just the first few alphabetically.
+The short prefixes, with the most terms under them, are ranked when the
+index is built: the best completions of every prefix of up to
+``PRECOMPUTED_PREFIX_LENGTH`` characters are kept. Longer prefixes are
+ranked when first typed and kept in an LRU. Each list holds more
+completions than are returned (``KEPT_COMPLETIONS``). When a term is added,
+removed or searched for, it is moved to its new place in the kept lists of
+the prefixes it is found under, instead of the lists being ranked again. A
+list is only dropped, to be ranked again when next typed, when removals
+leave it with fewer than ``MAX_SUGGESTIONS`` known completions.
+"""
+import bisect
+import heapq
+import logging
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import select
+
+import lazy_index
+import model_events
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_FIELDS = ('title', 'author')
+
+# Most completions returned for one prefix
+MAX_SUGGESTIONS = 50
+
+# Completions kept per prefix: more than are returned, so removals rarely leave a list short
+KEPT_COMPLETIONS = 2 * MAX_SUGGESTIONS
+
+# Prefixes up to this long are ranked when the index is built
+PRECOMPUTED_PREFIX_LENGTH = 3
+
+# Longer prefixes whose ranked completions are kept
+PREFIX_CACHE_SIZE = 4096
+
+# Sorts after any character of a key, to bound the keys under a prefix
+_LAST_CHAR = '\U0010ffff'
+
+
+def normalize(value):
+    """Case-fold a value and collapse its whitespace."""
+    return ' '.join((value or '').casefold().split())
+
+
+class Completions:
+    """
+    The best terms under one prefix, best first.
+
+    They are the top ``len(terms)`` of every term under the prefix, and
+    ``complete`` when that is all of them.
+    """
+
+    __slots__ = ('terms', 'complete')
+
+    def __init__(self, terms, complete):
+        self.terms = terms
+        self.complete = complete
+
+    def place(self, term, rank, rank_key):
+        """
+        Move ``term`` to where ``rank`` puts it, or drop it for a rank of None.
+
+        Returns whether the list still holds at least ``MAX_SUGGESTIONS``
+        terms, or every term under the prefix.
+        """
+        terms = self.terms
+        if term in terms:
+            terms.remove(term)
+        # A term ranked after the last one kept may be behind others that weren't kept
+        if rank is not None and (self.complete or (terms and rank < rank_key(terms[-1]))):
+            bisect.insort(terms, term, key=rank_key)
+            if len(terms) > KEPT_COMPLETIONS:
+                terms.pop()
+                self.complete = False
+        return self.complete or len(terms) >= MAX_SUGGESTIONS
+
+
+class PrefixIndex(lazy_index.LazyIndex):
+    """
+    Sorted array of ``(key, term)`` pairs for prefix lookup.
+
+    A term is a ``(field, text)`` pair such as ``('author', 'George Orwell')``.
+    """
+
+    def __init__(self, cache_size=PREFIX_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._keys = []
+        self._counts = {}
+        self._hits = {}
+        self._terms_by_text = {}
+        self._books = {}
+        # Completions of the prefixes up to PRECOMPUTED_PREFIX_LENGTH characters
+        self._short = {}
+        # Completions of longer prefixes, least recently used first
+        self._ranked = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    @staticmethod
+    def _word_keys(text):
+        words = normalize(text).split()
+        return {' '.join(words[i:]) for i in range(len(words))}
+
+    @staticmethod
+    def _book_terms(values):
+        return tuple((field, value) for field, value in zip(SUGGEST_FIELDS, values) if value)
+
+    def _rank_key(self, term):
+        """Most searched for first, then on the most books, then alphabetically."""
+        return (-self._hits.get(term, 0), -self._counts.get(term, 0), term[1], term[0])
+
+    def _kept(self, prefix):
+        """Return the dict holding the kept completions of ``prefix``."""
+        return self._short if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH else self._ranked
+
+    def _reposition(self, term):
+        """Move the term to its current place in the kept completions of every prefix it is found under."""
+        if not self._short and not self._ranked:
+            return
+        rank = self._rank_key(term) if term in self._counts else None
+        prefixes = {key[:end] for key in self._word_keys(term[1]) for end in range(1, len(key) + 1)}
+        for prefix in prefixes:
+            kept = self._kept(prefix)
+            completions = kept.get(prefix)
+            if completions is not None and not completions.place(term, rank, self._rank_key):
+                # Too few known completions left: rank the prefix again when it is next typed
+                del kept[prefix]
+
+    def _completions(self, terms):
+        """Return the Completions of a prefix with ``terms`` under it."""
+        return Completions(heapq.nsmallest(KEPT_COMPLETIONS, terms, key=self._rank_key),
+                           len(terms) <= KEPT_COMPLETIONS)
+
+    def _precompute(self):
+        """
+        Rank the completions of every prefix up to PRECOMPUTED_PREFIX_LENGTH characters.
+
+        Every term is ranked once, and the keys are read once, for the longest
+        prefixes. A shorter prefix's best are then picked from the best of the
+        prefixes one character longer and of its own key, as a term among
+        the best under a prefix is among the best of whichever it comes from.
+        """
+        ranked = sorted(self._counts, key=self._rank_key)
+        position = {term: i for i, term in enumerate(ranked)}
+        keys = self._keys
+        # Per prefix: the positions of its best terms, and whether they are all of them
+        best = {}
+        # Positions of the terms under each key shorter than the longest prefixes
+        whole_keys = {}
+        start = 0
+        while start < len(keys):
+            prefix = keys[start][0][:PRECOMPUTED_PREFIX_LENGTH]
+            if len(prefix) < PRECOMPUTED_PREFIX_LENGTH:
+                end = bisect.bisect_right(keys, (prefix, (_LAST_CHAR,)), start)
+                whole_keys[prefix] = {position[term] for key, term in keys[start:end]}
+            else:
+                end = bisect.bisect_left(keys, (prefix + _LAST_CHAR,), start)
+                best[prefix] = self._best_positions([({position[term] for key, term in keys[start:end]}, True)])
+            start = end
+        for length in range(PRECOMPUTED_PREFIX_LENGTH - 1, 0, -1):
+            sources = {}
+            for prefix, kept in best.items():
+                if len(prefix) == length + 1:
+                    sources.setdefault(prefix[:length], []).append(kept)
+            for key, positions in whole_keys.items():
+                if len(key) == length:
+                    sources.setdefault(key, []).append((positions, True))
+            for prefix, kept in sources.items():
+                best[prefix] = self._best_positions(kept)
+        self._short = {prefix: Completions([ranked[i] for i in positions], complete)
+                       for prefix, (positions, complete) in best.items()}
+
+    @staticmethod
+    def _best_positions(sources):
+        """Return the best ``(positions, complete)`` among some ``(positions, complete)``."""
+        positions = set().union(*(kept for kept, complete in sources))
+        return (heapq.nsmallest(KEPT_COMPLETIONS, positions),
+                len(positions) <= KEPT_COMPLETIONS and all(complete for kept, complete in sources))
+
+    def _count_term(self, term):
+        """Count one more book carrying ``term``; returns whether the term is new."""
+        count = self._counts.get(term, 0)
+        self._counts[term] = count + 1
+        if not count:
+            self._terms_by_text.setdefault(normalize(term[1]), set()).add(term)
+        self._reposition(term)
+        return not count
+
+    def _add_term(self, term):
+        if self._count_term(term):
+            for key in self._word_keys(term[1]):
+                bisect.insort(self._keys, (key, term))
+
+    def _remove_term(self, term):
+        count = self._counts.get(term, 0)
+        if count > 1:
+            self._counts[term] = count - 1
+            self._reposition(term)
+            return
+        self._counts.pop(term, None)
+        self._hits.pop(term, None)
+        self._reposition(term)
+        same_text = self._terms_by_text.get(normalize(term[1]), set())
+        same_text.discard(term)
+        if not same_text:
+            self._terms_by_text.pop(normalize(term[1]), None)
+        for key in self._word_keys(term[1]):
+            position = bisect.bisect_left(self._keys, (key, term))
+            if position < len(self._keys) and self._keys[position] == (key, term):
+                del self._keys[position]
+
+    def add_book(self, book_id, values):
+        """Index a book's titles and authors, replacing any earlier version."""
+        terms = self._book_terms(values)
+        with self._lock:
+            if self._books.get(book_id) == terms:
+                return
+            for term in self._books.pop(book_id, ()):
+                self._remove_term(term)
+            for term in terms:
+                self._add_term(term)
+            self._books[book_id] = terms
+
+    def add_books(self, rows):
+        """
+        Index many books from ``(id, title, author)`` rows, as add_book does.
+
+        The keys of new terms are sorted into the array once, instead of
+        being inserted one at a time, and the short prefixes are ranked
+        again afterwards.
+        """
+        with self._lock:
+            # Ranked again below, rather than updated term by term
+            self._short = {}
+            self._ranked.clear()
+            new_keys = []
+            for book_id, *values in rows:
+                terms = self._book_terms(values)
+                for term in self._books.pop(book_id, ()):
+                    self._remove_term(term)
+                for term in terms:
+                    if self._count_term(term):
+                        new_keys.extend((key, term) for key in self._word_keys(term[1]))
+                self._books[book_id] = terms
+            self._keys.extend(new_keys)
+            self._keys.sort()
+            self._precompute()
+
+    def remove_book(self, book_id):
+        """Drop a book from the index if it is present."""
+        with self._lock:
+            for term in self._books.pop(book_id, ()):
+                self._remove_term(term)
+
+    def apply_change(self, op, row):
+        if op == 'delete':
+            self.remove_book(row['id'])
+        else:
+            self.add_book(row['id'], [row.get(field) for field in SUGGEST_FIELDS])
+
+    def record_search(self, query):
+        """
+        Count a search against every term whose text matches the query exactly.
+
+        Searches made before the index is built aren't counted, rather than
+        building it for them.
+        """
+        if not self.loaded:
+            return
+        with self._lock:
+            for term in self._terms_by_text.get(normalize(query), ()):
+                self._hits[term] = self._hits.get(term, 0) + 1
+                self._reposition(term)
+
+    def _terms_under(self, prefix):
+        start = bisect.bisect_left(self._keys, (prefix,))
+        end = bisect.bisect_left(self._keys, (prefix + _LAST_CHAR,), start)
+        return {term for key, term in self._keys[start:end]}
+
+    def suggest(self, prefix, limit=8):
+        """Return up to ``limit`` ``(field, text)`` terms completing the prefix, most popular first."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.ensure_loaded()
+        with self._lock:
+            if limit > MAX_SUGGESTIONS:
+                return heapq.nsmallest(limit, self._terms_under(prefix), key=self._rank_key)
+            kept = self._kept(prefix)
+            completions = kept.get(prefix)
+            if completions is None:
+                completions = self._completions(self._terms_under(prefix))
+                # Short prefixes with nothing under them aren't kept, as any text may be typed
+                if kept is self._ranked or completions.terms:
+                    kept[prefix] = completions
+                if len(self._ranked) > self.cache_size:
+                    self._ranked.popitem(last=False)
+            elif kept is self._ranked:
+                self._ranked.move_to_end(prefix)
+            return completions.terms[:limit]
+
+
+def init_app(app, db, model):
+    """Register a suggestion index for an app, built from ``model`` on first use and kept current."""
+    index = PrefixIndex()
+    fields = [getattr(model, field) for field in SUGGEST_FIELDS]
+
+    def build(index):
+        with app.app_context():
+            with db.engine.connect() as conn:
+                index.add_books(conn.execute(select(model.id, *fields)))
+        logger.info(f"Built suggestion index with {len(index)} titles and authors")
+
+    index.defer(build)
+    lazy_index.on_warm_up(app, index.ensure_loaded)
+    model_events.subscribe(model, index.changed)
+    app.extensions['suggest_index'] = index
+    return index
+
+
+def get_suggest_index():
+    """Return the suggestion index registered on the current app."""
+    return current_app.extensions['suggest_index']
@@ -0,0 +1,100 @@
+"""
+Compiled templates kept across processes.
+
+Jinja compiles each template to Python code the first time it is loaded, and
+every new worker or serverless instance would otherwise pay for that on its
+first requests. The compiled code is saved as bytecode in
+``TEMPLATE_CACHE_DIR`` and loaded from there on later starts. Each entry is
+checked against a hash of the template source, so an edited template is
+compiled again. The Python version is checked too.
+
+The cache is filled:
+
+* at build time: ``render_builder.py`` compiles the deployed template folder;
+* on demand: ``flask precompile-templates`` compiles every template the app
+  can load, including the ones ``direct.py`` embeds;
+* at warm-up, with ``TEMPLATE_PRECOMPILE``: every template is loaded before the
+  first request (see lazy_index.py). Under a preloading server (see
+  ``gunicorn.conf.py``) this happens once in the master, and workers inherit
+  the compiled templates.
+
+A cache directory that can't be written, like a read-only serverless bundle,
+is still read from.
+"""
+import logging
+import os
+
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+import lazy_index
+
+logger = logging.getLogger(__name__)
+
+# File names of the templates to precompile
+TEMPLATE_SUFFIXES = ('.html',)
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache in a directory, which only reads when the directory is read-only."""
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError as e:
+            logger.debug(f"Not caching compiled template {bucket.key}: {e}")
+
+
+def precompile(app):
+    """Load every template the app can find, so each is compiled and cached. Returns how many were."""
+    return precompile_environment(app.jinja_env)
+
+
+def precompile_environment(env):
+    """Load every template a Jinja environment can find, as ``precompile`` does for an app."""
+    compiled = 0
+    for name in env.list_templates(filter_func=lambda name: name.endswith(TEMPLATE_SUFFIXES)):
+        try:
+            env.get_template(name)
+            compiled += 1
+        except TemplateError as e:
+            logger.error(f"Could not compile template {name}: {e}")
+    return compiled
+
+
+def precompile_folder(template_dir, cache_dir):
+    """
+    Fill ``cache_dir`` with the templates in ``template_dir``, without creating the application.
+
+    A bare Flask app compiles them with the same settings and cache keys as an
+    app loading its templates from that folder, so the folder must be where the
+    app will find it at run time.
+    """
+    app = Flask(__name__, template_folder=os.path.abspath(template_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = TemplateBytecodeCache(str(cache_dir))
+    return precompile(app)
+
+
+def init_app(app):
+    """Cache an app's compiled templates in its TEMPLATE_CACHE_DIR, and precompile them at warm-up if configured."""
+    @app.cli.command('precompile-templates')
+    def precompile_command():
+        """Compile every template into the template cache."""
+        print(f"Compiled {precompile(app)} templates into {app.config.get('TEMPLATE_CACHE_DIR')}")
+
+    cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+    if not cache_dir:
+        return None
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            logger.warning(f"Template cache disabled: can't create {cache_dir}: {e}")
+            return None
+    cache = TemplateBytecodeCache(cache_dir)
+    app.jinja_env.bytecode_cache = cache
+    app.extensions['template_cache'] = cache
+    if app.config.get('TEMPLATE_PRECOMPILE'):
+        lazy_index.on_warm_up(app, lambda: logger.info(f"Precompiled {precompile(app)} templates"))
+    return cache
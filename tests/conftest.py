@@ -0,0 +1,92 @@
+"""
+Shared fixtures: each test gets an app of its own on a new SQLite catalog,
+seeded with the sample books the way a fresh deployment is.
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from jinja2 import FileSystemLoader
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# app.py builds an application from the environment at import; keep it off the working copy
+_scratch = tempfile.mkdtemp(prefix='library-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_scratch, 'library.db')}"
+os.environ['BM25_STATS_PATH'] = os.path.join(_scratch, 'bm25_stats.pickle')
+os.environ['TEMPLATE_CACHE_DIR'] = ''
+for name in ('CATALOG_DATABASE', 'DATABASE_READ_URLS', 'CATALOG_SNAPSHOT', 'SEARCH_COALESCE_LOCK_DIR'):
+    os.environ.pop(name, None)
+
+import app as app_module  # noqa: E402
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_scratch, ignore_errors=True)
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    """Path of the SQLite file behind the test's apps."""
+    return tmp_path / 'library.db'
+
+
+@pytest.fixture
+def make_app(tmp_path, database_path):
+    """
+    Return a factory for apps on the test's database.
+
+    Keyword arguments override settings, e.g. ``make_app(CATALOG_SNAPSHOT=True)``.
+    """
+    def make(**settings):
+        settings = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{database_path}",
+            'BM25_STATS_PATH': str(tmp_path / 'bm25_stats.pickle'),
+            'TEMPLATE_CACHE_DIR': '',
+            # No background thread; other_process checks for changes itself
+            'CATALOG_SYNC_INTERVAL': 0,
+            **settings,
+        }
+        flask_app = app_module.create_app(type('TestConfig', (), settings))
+        # The templates sit next to the code here; build.sh copies them into templates/ for deployment
+        flask_app.jinja_loader = FileSystemLoader(str(ROOT))
+        return flask_app
+    return make
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def other_process(app, database_path):
+    """
+    Return a function writing to the test database the way another process's ORM commit does.
+
+    The SQL runs on a connection of its own, unseen by model_events, and
+    logs the books it changes in catalog_changes. The app then catches up,
+    as its background thread would within CATALOG_SYNC_INTERVAL.
+    """
+    def commit(sql, params=()):
+        op = sql.split(None, 1)[0].lower()
+        with closing(sqlite3.connect(database_path)) as conn, conn:
+            ids = [row[0] for row in conn.execute(f"{sql} RETURNING id", params).fetchall()]
+            conn.executemany("INSERT INTO catalog_changes (book_id, op, changed_at) VALUES (?, ?, ?)",
+                             [(book_id, op, datetime.utcnow().isoformat(" ")) for book_id in ids])
+        sync = app.extensions.get('catalog_sync')
+        if sync is not None:
+            with app.app_context():
+                sync.check()
+    return commit
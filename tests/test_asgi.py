@@ -0,0 +1,170 @@
+"""The read paths served by asgi.py."""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from jinja2 import FileSystemLoader
+from starlette.testclient import TestClient
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope='module')
+def client():
+    import asgi
+
+    # As in conftest: the templates sit next to the code here, not in templates/
+    asgi.templates.loader = FileSystemLoader(str(ROOT))
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def test_home_page(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'search' in response.text.lower()
+
+
+def test_search_results(client):
+    response = client.get('/search?query=orwell')
+    assert response.status_code == 200
+    assert '1984' in response.text
+    assert 'Animal Farm' in response.text
+
+
+def test_isbn_searches_redirect_to_the_book(client):
+    response = client.get('/search?query=0-7432-7356-7', follow_redirects=False)
+    assert response.status_code == 302
+    assert response.headers['location'].endswith('/book/3')
+
+
+def test_empty_searches_show_the_home_page(client):
+    response = client.get('/search?query=')
+    assert response.status_code == 200
+    assert 'Please enter a search term.' in response.text
+
+
+def test_book_details(client):
+    response = client.get('/book/3')
+    assert response.status_code == 200
+    assert 'The Great Gatsby' in response.text
+
+
+def test_unknown_books_are_not_found(client):
+    response = client.get('/book/99999')
+    assert response.status_code == 404
+    assert 'Page not found' in response.text
+
+
+def test_unchanged_book_pages_are_not_sent_again(client):
+    etag = client.get('/book/3').headers['etag']
+    response = client.get('/book/3', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+
+
+def test_search_api_streams_matches(client):
+    response = client.get('/api/search?query=orwell&fields=title')
+    assert response.status_code == 200
+    assert {json.loads(line)['title'] for line in response.text.splitlines()} == {'1984', 'Animal Farm'}
+
+
+@pytest.mark.parametrize('url', [
+    '/api/search?query=the&limit=0',
+    '/api/search?query=the&format=xml',
+    '/api/search',
+    '/api/books?after=-5',
+    '/api/pick-list?ids=1,two',
+])
+def test_bad_api_requests_are_rejected(client, url):
+    response = client.get(url)
+    assert response.status_code == 400
+    assert 'error' in response.json()
+
+
+def test_bad_pick_list_bodies_are_rejected(client):
+    response = client.post('/api/pick-list', json={'ids': 5})
+    assert response.status_code == 400
+    assert 'lists' in response.json()['error']
+
+
+def test_pick_list(client):
+    route = client.post('/api/pick-list', json={'ids': [1, 2, 3]}).json()
+    assert sorted(stop['id'] for stop in route['stops']) == [1, 2, 3]
+
+
+def test_books_by_filters(client):
+    response = client.get('/api/books?status=issued&shelf=A1')
+    assert [record['title'] for record in response.json()['results']] == ['The Great Gatsby']
+
+
+def test_facets(client):
+    counts = client.get('/api/facets?query=orwell').json()['facets']
+    assert sum(item['count'] for item in counts['status']) == 2
+
+
+def test_shelf_listing(client):
+    payload = client.get('/api/shelf/A1').json()
+    assert 'The Great Gatsby' in [book['title'] for book in payload['results']]
+    assert client.get('/shelf/A1').status_code == 200
+
+
+def test_suggestions(client):
+    suggestions = client.get('/api/suggest?prefix=hob').json()['suggestions']
+    assert {'text': 'The Hobbit', 'type': 'title'} in suggestions
+
+
+def test_stats(client):
+    assert set(client.get('/api/stats').json()) >= {'search_cache', 'page_cache', 'single_flight'}
+
+
+def test_details_and_results_come_from_the_snapshot(client, monkeypatch):
+    import asgi
+    from catalog_snapshot import CatalogSnapshot
+    from models import Book
+
+    snapshot = CatalogSnapshot(asgi.db, Book)
+    monkeypatch.setattr(asgi, 'snapshot', snapshot)
+    assert 'Animal Farm' in client.get('/search?query=animal farm').text
+    assert client.get('/book/5').status_code == 200
+    # Books missing from an empty snapshot are loaded into it
+    assert len(snapshot) >= 2
+
+
+def test_read_replicas_are_refused(tmp_path):
+    env = {**os.environ,
+           'DATABASE_URL': f"sqlite:///{tmp_path / 'library.db'}",
+           'DATABASE_READ_URLS': f"sqlite:///{tmp_path / 'replica.db'}",
+           'BM25_STATS_PATH': str(tmp_path / 'bm25_stats.pickle')}
+    result = subprocess.run([sys.executable, '-c', 'import asgi'], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "doesn't read from DATABASE_READ_URLS" in result.stderr
+
+
+def test_changes_from_other_processes_are_followed(client):
+    import asgi
+
+    def suggestions():
+        return [item['text'] for item in client.get('/api/suggest?prefix=middlem').json()['suggestions']]
+
+    assert suggestions() == []
+    with closing(sqlite3.connect(asgi.engine.url.database)) as conn, conn:
+        book_id = conn.execute(
+            "INSERT INTO book (title, author, isbn, shelf, \"column\", \"row\", status, title_norm, author_norm, "
+            "version) VALUES ('Middlemarch', 'George Eliot', '9780141439549', 'Z9', '1', 'Top', 'available', "
+            "'middlemarch', 'george eliot', 1)"
+        ).lastrowid
+        conn.execute("INSERT INTO catalog_changes (book_id, op, changed_at) VALUES (?, 'insert', ?)",
+                     (book_id, datetime.utcnow().isoformat(' ')))
+    deadline = time.monotonic() + 5
+    while not suggestions() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert suggestions() == ['Middlemarch']
@@ -0,0 +1,34 @@
+"""Bitsets of the low-cardinality book columns."""
+import random
+
+from bitmap_index import BitmapIndex, bitmap_of, iter_ids
+
+
+def test_bitmaps_are_packed_from_ids():
+    assert bitmap_of([0, 3, 9], 10) == 0b1000001001
+    assert bitmap_of([], 0) == 0
+    assert list(iter_ids(bitmap_of([2, 64, 65], 66))) == [2, 64, 65]
+
+
+def test_a_bulk_load_matches_adding_books_one_by_one():
+    chance = random.Random(7)
+    rows = [(book_id, chance.choice(['available', 'issued']), chance.choice(['Fiction', None]),
+             f'A{chance.randint(1, 4)}', str(chance.randint(1, 3)), 'Top')
+            for book_id in chance.sample(range(1, 5000), 800)]
+    loaded, added = BitmapIndex(), BitmapIndex()
+    loaded.load(rows)
+    for row in rows:
+        added.add(row[0], row[1:])
+    assert len(loaded) == len(added) == 800
+    for filters in ({}, {'status': 'issued'}, {'category': 'Fiction', 'shelf': 'A2'}, {'shelf': 'Z9'}):
+        assert loaded.select(filters) == added.select(filters)
+    assert loaded.facet_counts(['status', 'shelf']) == added.facet_counts(['status', 'shelf'])
+
+
+def test_changes_after_a_bulk_load_are_applied():
+    index = BitmapIndex()
+    index.load([(1, 'available', 'Fiction', 'A1', '1', 'Top'), (2, 'issued', 'Fiction', 'A1', '2', 'Top')])
+    index.add(2, ['available', 'Fiction', 'A1', '2', 'Top'])
+    index.remove(1)
+    assert index.page({'status': 'available'}) == [2]
+    assert index.count({'status': 'issued'}) == 0
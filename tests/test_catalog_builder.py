@@ -0,0 +1,36 @@
+"""The read-only catalog file and the BM25 statistics built with it."""
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import ranking
+from catalog_builder import stats_path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = tmp_path / 'catalog.db'
+    # In a process of its own: the builder points the environment at the new file and imports direct.py
+    subprocess.run([sys.executable, 'catalog_builder.py', str(path)], cwd=ROOT, check=True,
+                   capture_output=True)
+    return path
+
+
+def test_statistics_are_written_next_to_the_catalog(catalog):
+    assert stats_path(str(catalog)) == str(catalog.with_suffix('.bm25.pickle'))
+    assert ranking.Bm25Stats.load(stats_path(str(catalog))) is not None
+
+
+def test_cold_starts_load_the_statistics_instead_of_building_them(catalog, make_app, monkeypatch):
+    def build(rows, fingerprint):
+        raise AssertionError("BM25 statistics rebuilt")
+
+    monkeypatch.setattr(ranking.Bm25Stats, 'build', build)
+    app = make_app(CATALOG_DATABASE=str(catalog), BM25_STATS_PATH=stats_path(str(catalog)))
+    response = app.test_client().get('/search?query=gatsby')
+    assert response.status_code == 200
+    assert b'The Great Gatsby' in response.data
@@ -0,0 +1,53 @@
+"""Search results and book details served from the catalog snapshot."""
+import pytest
+
+from catalog_snapshot import CatalogSnapshot
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(CATALOG_SNAPSHOT=True)
+
+
+def test_details_come_from_the_snapshot(app, client):
+    assert isinstance(app.extensions['catalog_snapshot'], CatalogSnapshot)
+    response = client.get('/book/3')
+    assert response.status_code == 200
+    assert b'The Great Gatsby' in response.data
+
+
+def test_results_come_from_the_snapshot(client):
+    response = client.get('/search?query=orwell')
+    assert b'1984' in response.data
+    assert b'Animal Farm' in response.data
+
+
+def test_changes_from_other_processes_reach_the_snapshot(client, other_process):
+    client.get('/book/3')
+    etag = client.get('/search?query=gatsby').headers['ETag']
+    other_process("UPDATE book SET title = 'Gatsby Revisited', title_norm = 'gatsby revisited', "
+                  "status = 'missing', version = version + 1 WHERE id = 3")
+    details = client.get('/book/3')
+    assert b'Gatsby Revisited' in details.data
+    assert b'Missing' in details.data
+    results = client.get('/search?query=gatsby')
+    assert results.headers['ETag'] != etag
+    assert b'Gatsby Revisited' in results.data
+
+
+def test_books_deleted_by_other_processes_leave_the_snapshot(app, client, other_process):
+    assert client.get('/book/3').status_code == 200
+    other_process("DELETE FROM book WHERE id = 3")
+    assert client.get('/book/3').status_code == 404
+    with app.app_context():
+        assert app.extensions['catalog_snapshot'].get(3) is None
+
+
+def test_own_commits_reach_the_snapshot(app, client):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        db.session.get(Book, 3).title = 'Gatsby Again'
+        db.session.commit()
+    assert b'Gatsby Again' in client.get('/book/3').data
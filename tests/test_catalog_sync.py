@@ -0,0 +1,176 @@
+"""Filter-only browsing from /api/books, and changes committed by other processes."""
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import catalog_generation
+from normalize import normalize_text
+
+INSERT_BOOK = (
+    "INSERT INTO book (title, author, isbn, shelf, \"column\", \"row\", status, category, "
+    "title_norm, author_norm, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)"
+)
+
+
+def insert_book(other_process, title, author, isbn, shelf='F1', status='available'):
+    other_process(INSERT_BOOK, (title, author, isbn, shelf, '1', 'Top', status, 'Fiction',
+                                normalize_text(title), normalize_text(author)))
+
+
+def books(client, query):
+    response = client.get(f'/api/books?{query}')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def titles(client, query):
+    return [record['title'] for record in books(client, query)['results']]
+
+
+def suggestions(client, prefix):
+    return [item['text'] for item in client.get(f'/api/suggest?prefix={prefix}').get_json()['suggestions']]
+
+
+def test_browses_books_by_column_filters(client):
+    assert titles(client, 'status=issued&shelf=A1') == ['The Great Gatsby']
+
+
+def test_pages_continue_after_the_last_id(client):
+    first = books(client, 'category=Fiction&limit=2')
+    assert len(first['results']) == 2
+    rest = books(client, f"category=Fiction&limit=100&after={first['next']}")
+    assert first['results'][-1]['id'] < rest['results'][0]['id']
+    assert len(first['results']) + len(rest['results']) == first['total']
+
+
+@pytest.mark.parametrize('after', ['-5', '-1', 'two'])
+def test_after_must_be_a_book_id(client, after):
+    response = client.get(f'/api/books?after={after}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_books_inserted_elsewhere_are_indexed(client, other_process):
+    insert_book(other_process, 'Middlemarch', 'George Eliot', '9780141439549')
+    assert 'Middlemarch' in suggestions(client, 'middle')
+    assert titles(client, 'shelf=F1') == ['Middlemarch']
+    assert b'Middlemarch' in client.get('/search?query=middlemarch').data
+
+
+def test_books_updated_elsewhere_are_reindexed(client, other_process):
+    other_process("UPDATE book SET title = 'Gatsby Revisited', title_norm = 'gatsby revisited', "
+                  "status = 'available', version = version + 1 WHERE title = 'The Great Gatsby'")
+    assert suggestions(client, 'gatsby') == ['Gatsby Revisited']
+    assert titles(client, 'status=issued&shelf=A1') == []
+    assert 'Gatsby Revisited' in titles(client, 'status=available&shelf=A1')
+
+
+def test_books_deleted_elsewhere_are_dropped(client, other_process):
+    other_process("DELETE FROM book WHERE title = 'The Great Gatsby'")
+    assert suggestions(client, 'gatsby') == []
+    assert books(client, 'shelf=A1&status=issued')['total'] == 0
+
+
+def test_own_commits_are_not_replayed(app, client):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        db.session.get(Book, 1).status = 'missing'
+        db.session.commit()
+    assert 1 in [record['id'] for record in books(client, 'status=missing')['results']]
+    assert app.extensions['catalog_sync'].replayed == 0
+
+
+
+def logged(app):
+    from app import db
+
+    with app.app_context(), db.engine.connect() as conn:
+        return conn.execute(select(catalog_generation.catalog_changes.c.book_id,
+                                   catalog_generation.catalog_changes.c.op)
+                            .order_by(catalog_generation.catalog_changes.c.generation)).all()
+
+
+def test_commits_log_the_books_they_change(app):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        before = catalog_generation.current(db.session)
+        db.session.get(Book, 3).status = 'missing'
+        db.session.commit()
+        after = catalog_generation.current(db.session)
+    assert after[0] > before[0]
+    assert logged(app)[-1] == (3, 'update')
+
+
+def test_only_the_logged_books_are_replayed(app, client, other_process):
+    client.get('/api/books')
+    other_process("UPDATE book SET status = 'missing', version = version + 1 WHERE id IN (1, 2)")
+    assert app.extensions['catalog_sync'].replayed == 2
+    assert {record['id'] for record in books(client, 'status=missing')['results']} == {1, 2}
+
+
+def test_changes_are_followed_by_a_background_thread(make_app, database_path):
+    client = make_app(CATALOG_SYNC_INTERVAL=0.05).test_client()
+    assert suggestions(client, 'middle') == []
+    with closing(sqlite3.connect(database_path)) as conn, conn:
+        book_id = conn.execute(INSERT_BOOK, ('Middlemarch', 'George Eliot', '9780141439549', 'F1', '1', 'Top',
+                                             'available', 'Fiction', 'middlemarch', 'george eliot')).lastrowid
+        conn.execute("INSERT INTO catalog_changes (book_id, op, changed_at) VALUES (?, 'insert', ?)",
+                     (book_id, datetime.utcnow().isoformat(' ')))
+    deadline = time.monotonic() + 5
+    while 'Middlemarch' not in suggestions(client, 'middle') and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert 'Middlemarch' in suggestions(client, 'middle')
+
+
+def test_the_log_starts_after_the_old_counter(app):
+    from app import db
+
+    with app.app_context():
+        catalog_generation.catalog_changes.drop(db.engine)
+        with db.engine.begin() as conn:
+            conn.execute(catalog_generation.catalog_state.update().values(generation=41))
+        catalog_generation.create_change_log(db.engine)
+        assert catalog_generation.current(db.session)[0] == 42
+
+
+def test_pruning_keeps_the_latest_change(app):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        for status in ('missing', 'available'):
+            db.session.get(Book, 3).status = status
+            db.session.commit()
+        state = catalog_generation.current(db.session)
+        assert catalog_generation.prune(db.engine, datetime.utcnow() + timedelta(days=1)) >= 2
+        assert catalog_generation.current(db.session) == state
+    assert logged(app) == [(3, 'update')]
+
+
+def test_generations_committed_out_of_order_are_replayed(app, client, database_path):
+    sync = app.extensions['catalog_sync']
+    client.get('/api/books')
+    generation = sync.state[0]
+
+    def log(skip, status, book_id):
+        with closing(sqlite3.connect(database_path)) as conn, conn:
+            conn.execute("UPDATE book SET status = ?, version = version + 1 WHERE id = ?", (status, book_id))
+            conn.execute("INSERT INTO catalog_changes (generation, book_id, op, changed_at) VALUES (?, ?, 'update', ?)",
+                         (generation + skip, book_id, datetime.utcnow().isoformat(' ')))
+
+    # Generation + 1 is still in flight when generation + 2 commits
+    log(2, 'missing', 1)
+    with app.app_context():
+        sync.check()
+    log(1, 'missing', 2)
+    with app.app_context():
+        sync.check()
+    assert {record['id'] for record in books(client, 'status=missing')['results']} == {1, 2}
@@ -0,0 +1,56 @@
+"""Category, status and shelf counts from /api/facets and the search filter bar."""
+import json
+
+
+def facets(client, query=''):
+    response = client.get(f'/api/facets?{query}')
+    assert response.status_code == 200
+    return {name: {item['value']: item['count'] for item in values}
+            for name, values in response.get_json()['facets'].items()}
+
+
+def test_catalog_counts_cover_every_book(client):
+    counts = facets(client)
+    assert set(counts) == {'category', 'status', 'shelf'}
+    assert sum(counts['status'].values()) == sum(counts['shelf'].values()) == 29
+
+
+def test_search_counts_match_the_search(client):
+    matches = [json.loads(line) for line in client.get('/api/search?query=the').data.splitlines()]
+    counts = facets(client, 'query=the')
+    assert sum(counts['status'].values()) == len(matches) == 13
+
+
+def test_filters_narrow_the_counts(client):
+    counts = facets(client, 'query=the&category=Fiction')
+    assert counts['category'] == {'Fiction': 6}
+    assert sum(counts['status'].values()) == 6
+
+
+def test_filters_without_a_search_count_from_the_bitmaps(client):
+    assert facets(client, 'status=issued&shelf=A1') == {
+        'category': {'Fiction': 1}, 'status': {'issued': 1}, 'shelf': {'A1': 1},
+    }
+
+
+def test_unknown_filter_values_count_nothing(client):
+    assert facets(client, 'shelf=Z9') == {'category': {}, 'status': {}, 'shelf': {}}
+    assert facets(client, 'query=the&shelf=Z9') == {'category': {}, 'status': {}, 'shelf': {}}
+
+
+def test_counts_follow_commits(app, client):
+    from app import db
+    from models import Book
+
+    before = facets(client)['status']['issued']
+    with app.app_context():
+        db.session.get(Book, 1).status = 'issued'
+        db.session.commit()
+    assert facets(client)['status']['issued'] == before + 1
+
+
+def test_search_page_filters_by_facet(client):
+    response = client.get('/search?query=the&category=Fiction&status=issued')
+    assert response.status_code == 200
+    assert b'The Great Gatsby' in response.data
+    assert b'Found 1 result(s)' in response.data
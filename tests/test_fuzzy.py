@@ -0,0 +1,48 @@
+"""Close matches for misspelled searches."""
+from fuzzy import SymSpellIndex, edit_distance
+
+
+def test_misspelled_searches_show_close_matches(client):
+    response = client.get('/search?query=hobit')
+    assert response.status_code == 200
+    assert b'Close matches' in response.data
+    assert b'The Hobbit' in response.data
+
+
+def test_searches_with_enough_results_show_none(client):
+    assert b'Close matches' not in client.get('/search?query=the').data
+
+
+def test_filtered_searches_show_none(client):
+    assert b'Close matches' not in client.get('/search?query=hobit&status=available').data
+
+
+def test_words_beyond_the_distance_are_not_matched(client, make_app):
+    # Two edits from "tolkien"
+    assert b'The Hobbit' in client.get('/search?query=tokkein').data
+    strict = make_app(FUZZY_MAX_DISTANCE=1).test_client()
+    assert b'The Hobbit' not in strict.get('/search?query=tokkein').data
+
+
+def test_new_books_are_matched_once_committed(app, client):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        db.session.add(Book(title='Middlemarch', author='George Eliot', isbn='9780141439549',
+                            shelf='F1', column='1', row='Top'))
+        db.session.commit()
+    assert b'Middlemarch' in client.get('/search?query=midlemarch').data
+
+
+def test_every_query_word_must_match():
+    index = SymSpellIndex()
+    index.add_book(1, ['Pride and Prejudice', 'Jane Austen'])
+    index.add_book(2, ['Emma', 'Jane Austen'])
+    assert index.search('prejudise austin') == [1]
+    assert index.search('emma prejudise') == []
+
+
+def test_transpositions_count_once():
+    assert edit_distance('hobbit', 'hobibt', 2) == 1
+    assert edit_distance('hobbit', 'tibboh', 2) > 2
@@ -0,0 +1,113 @@
+"""Validators, conditional requests and Cache-Control on book and search pages."""
+from datetime import timedelta
+
+from werkzeug.http import http_date, parse_date
+
+from shelf_browse import neighbors
+
+
+def edit(app, book_id, **values):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        book = db.session.get(Book, book_id)
+        for name, value in values.items():
+            setattr(book, name, value)
+        db.session.commit()
+
+
+def test_book_pages_carry_validators(client):
+    response = client.get('/book/3')
+    assert response.headers['ETag']
+    assert response.headers['Last-Modified']
+    assert response.headers['Cache-Control'] == 'public, max-age=0, stale-while-revalidate=60'
+
+
+def test_cache_control_follows_the_settings(make_app):
+    client = make_app(HTTP_CACHE_MAX_AGE=120, HTTP_CACHE_STALE_WHILE_REVALIDATE=0).test_client()
+    assert client.get('/book/3').headers['Cache-Control'] == 'public, max-age=120'
+
+
+def test_a_current_etag_is_answered_with_304(client):
+    etag = client.get('/book/3').headers['ETag']
+    for if_none_match in (etag, f'W/{etag}', f'"other", {etag}'):
+        response = client.get('/book/3', headers={'If-None-Match': if_none_match})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+
+
+def test_a_stale_etag_gets_the_page(client):
+    response = client.get('/book/3', headers={'If-None-Match': '"stale"'})
+    assert response.status_code == 200
+    assert b'The Great Gatsby' in response.data
+
+
+def test_if_modified_since_is_compared_without_an_etag(client):
+    last_modified = client.get('/book/3').headers['Last-Modified']
+    assert client.get('/book/3', headers={'If-Modified-Since': last_modified}).status_code == 304
+    earlier = http_date(parse_date(last_modified) - timedelta(seconds=1))
+    assert client.get('/book/3', headers={'If-Modified-Since': earlier}).status_code == 200
+    # If-None-Match takes precedence
+    headers = {'If-None-Match': '"stale"', 'If-Modified-Since': last_modified}
+    assert client.get('/book/3', headers=headers).status_code == 200
+
+
+def test_editing_a_book_changes_its_etag(app, client):
+    etag = client.get('/book/3').headers['ETag']
+    edit(app, 3, status='missing')
+    response = client.get('/book/3', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert b'Missing' in response.data
+
+
+def test_renaming_a_shelf_neighbor_changes_only_the_etag(app, client):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        neighbor = next(book for book in neighbors(Book, db.session.get(Book, 3)) if book is not None)
+    first = client.get('/book/3')
+    edit(app, neighbor.id, title='A New Neighbor')
+    response = client.get('/book/3', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.headers['Last-Modified'] == first.headers['Last-Modified']
+
+
+def test_search_pages_are_validated_against_the_catalog(app, client):
+    first = client.get('/search?query=gatsby')
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'].startswith('public')
+    assert client.get('/search?query=gatsby', headers={'If-None-Match': etag}).status_code == 304
+
+    edit(app, 3, title='Gatsby Again')
+    response = client.get('/search?query=gatsby', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert b'Gatsby Again' in response.data
+
+
+def test_search_etags_follow_other_processes(client, other_process):
+    etag = client.get('/search?query=gatsby').headers['ETag']
+    other_process("UPDATE book SET title = 'Gatsby Revisited', version = version + 1 WHERE id = 3")
+    response = client.get('/search?query=gatsby', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Gatsby Revisited' in response.data
+
+
+def test_the_salt_changes_every_etag(make_app):
+    etag = make_app().test_client().get('/book/3').headers['ETag']
+    salted = make_app(HTTP_CACHE_SALT='next-release').test_client().get('/book/3').headers['ETag']
+    assert salted != etag
+
+
+def test_pages_with_flash_messages_are_not_stored(client):
+    etag = client.get('/book/3').headers['ETag']
+    with client.session_transaction() as session:
+        session['_flashes'] = [('info', 'Shelved just now')]
+    response = client.get('/book/3', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert 'ETag' not in response.headers
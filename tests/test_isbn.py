@@ -0,0 +1,48 @@
+"""ISBN searches resolved with one lookup on the unique index."""
+import pytest
+
+from isbn import to_isbn13
+
+
+@pytest.mark.parametrize('query', ['9780743273565', '978-0-7432-7356-5', '0-7432-7356-7',
+                                   '0743273567', 'ISBN 978 0 7432 7356 5'])
+def test_isbn_searches_open_the_book(client, query):
+    response = client.get('/search', query_string={'query': query})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/book/3')
+
+
+def test_unknown_isbns_fall_back_to_searching(client):
+    response = client.get('/search?query=9780000000002')
+    assert response.status_code == 200
+    assert b'Found 0 result(s)' in response.data
+
+
+def test_bad_check_digits_are_searched_as_text(client):
+    response = client.get('/search?query=9780743273566')
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('value, canonical', [
+    ('080442957X', '9780804429573'),
+    ('080442957x', '9780804429573'),
+    ('ISBN-10: 0-8044-2957-X', '9780804429573'),
+    ('9780804429573', '9780804429573'),
+    ('0804429570', None),
+    ('97808044295', None),
+    ('', None),
+])
+def test_isbns_are_normalized_to_isbn13(value, canonical):
+    assert to_isbn13(value) == canonical
+
+
+def test_books_store_the_canonical_isbn(app):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        book = Book(title='Middlemarch', author='George Eliot', isbn='0-14-143954-8',
+                    shelf='F1', column='1', row='Top')
+        db.session.add(book)
+        db.session.commit()
+        assert book.isbn == '9780141439549'
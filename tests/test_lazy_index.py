@@ -0,0 +1,73 @@
+"""Indexes built on first use or at warm-up instead of when the app is created."""
+import pytest
+from sqlalchemy import event
+
+from lazy_index import warm_up
+from suggest import PrefixIndex
+
+LAZY_INDEXES = ('suggest_index', 'fuzzy_index', 'bitmap_index', 'bm25_ranker')
+
+
+def test_creating_the_app_builds_no_index(app):
+    assert [name for name in LAZY_INDEXES if app.extensions[name].loaded] == []
+    assert app.extensions['catalog_sync'].state is None
+
+
+def test_an_index_is_built_by_its_first_use(app, client):
+    response = client.get('/api/suggest?prefix=gats')
+    assert [item['text'] for item in response.get_json()['suggestions']] == ['The Great Gatsby']
+    assert app.extensions['suggest_index'].loaded
+    assert not app.extensions['fuzzy_index'].loaded
+
+
+def test_warm_up_builds_every_index(app):
+    warm_up(app)
+    assert all(app.extensions[name].loaded for name in LAZY_INDEXES)
+    assert app.extensions['catalog_sync'].state is not None
+
+
+def test_warm_up_builds_the_substring_index(make_app):
+    app = make_app(SEARCH_MODE='substring')
+    index = app.extensions['search_engine'].index
+    assert not index.loaded
+    warm_up(app)
+    assert len(index) == app.extensions['bitmap_index'].count({})
+
+
+def test_changes_during_the_build_are_applied_after_it():
+    def build(index):
+        index.add_books([(1, 'Emma', 'Jane Austen')])
+        index.changed('insert', {'id': 2, 'title': 'Persuasion', 'author': 'Jane Austen'})
+
+    index = PrefixIndex()
+    index.defer(build)
+    index.changed('insert', {'id': 3, 'title': 'Sanditon', 'author': 'Jane Austen'})
+    assert [text for field, text in index.suggest('p')] == ['Persuasion']
+    assert index.suggest('sand') == []
+
+
+def test_a_failed_build_is_retried():
+    attempts = []
+
+    def build(index):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('database unavailable')
+        index.add_books([(1, 'Emma', 'Jane Austen')])
+
+    index = PrefixIndex()
+    index.defer(build)
+    with pytest.raises(RuntimeError):
+        index.suggest('emma')
+    assert [text for field, text in index.suggest('emma')] == ['Emma']
+
+
+def test_existing_search_objects_are_not_created_again(app):
+    from app import db
+
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        app.extensions['search_engine'].install()
+    assert not [statement for statement in statements if 'CREATE' in statement]
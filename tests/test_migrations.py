@@ -0,0 +1,167 @@
+"""Bringing catalogs created by earlier releases up to the models' schema."""
+import fcntl
+import logging
+import sqlite3
+import threading
+from contextlib import closing
+
+import pytest
+from sqlalchemy import event, inspect
+
+import migrations
+
+# The book table as the first release created it
+LEGACY_SCHEMA = """
+CREATE TABLE book (
+    id INTEGER PRIMARY KEY,
+    title VARCHAR(200) NOT NULL,
+    author VARCHAR(100) NOT NULL,
+    isbn VARCHAR(20) NOT NULL UNIQUE,
+    publication_year INTEGER,
+    publisher VARCHAR(100),
+    shelf VARCHAR(10) NOT NULL,
+    "column" VARCHAR(10) NOT NULL,
+    "row" VARCHAR(10) NOT NULL,
+    status VARCHAR(20),
+    date_added DATETIME,
+    category VARCHAR(50),
+    description TEXT
+)
+"""
+
+LEGACY_BOOKS = [
+    (1, 'Émile', 'Jean-Jacques Rousseau', '0-14-044563-3', 'A1', '1', 'Top'),
+    (2, 'The Hobbit', 'J.R.R. Tolkien', '978-0-261-10221-7', 'A2', '2', 'Middle'),
+    (3, 'Persuasion', 'Jane Austen', '9780141439686', 'B1', '1', 'Bottom'),
+]
+
+
+@pytest.fixture
+def legacy_database(database_path):
+    with closing(sqlite3.connect(database_path)) as conn, conn:
+        conn.execute(LEGACY_SCHEMA)
+        conn.executemany(
+            'INSERT INTO book (id, title, author, isbn, shelf, "column", "row", status, date_added) '
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 'available', '2020-01-01 00:00:00')", LEGACY_BOOKS)
+    return database_path
+
+
+def book_columns(app):
+    from app import db
+
+    with app.app_context():
+        return {col['name'] for col in inspect(db.engine).get_columns('book')}
+
+
+def test_a_legacy_catalog_is_migrated_at_startup(make_app, legacy_database, database_path):
+    app = make_app()
+    assert {'title_norm', 'author_norm', 'version', 'updated_at'} <= book_columns(app)
+    with closing(sqlite3.connect(database_path)) as conn:
+        rows = conn.execute("SELECT title_norm, isbn, version, updated_at FROM book ORDER BY id").fetchall()
+    assert rows == [
+        ('emile', '9780140445633', 1, '2020-01-01 00:00:00'),
+        ('the hobbit', '9780261102217', 1, '2020-01-01 00:00:00'),
+        ('persuasion', '9780141439686', 1, '2020-01-01 00:00:00'),
+    ]
+    # Not seeded: the catalog already existed
+    response = app.test_client().get('/search?query=emile')
+    assert b'Rousseau' in response.data
+    assert b'Gatsby' not in app.test_client().get('/search?query=gatsby').data
+
+
+def test_a_current_catalog_is_not_migrated_again(make_app, monkeypatch):
+    make_app()
+    monkeypatch.setattr(migrations, 'init_db', lambda db, model: pytest.fail('migrated again'))
+    make_app()
+
+
+def test_the_fingerprint_follows_the_migrations(app, monkeypatch):
+    from app import db
+
+    with app.app_context():
+        fingerprint = migrations.schema_fingerprint(db)
+        assert fingerprint.startswith(migrations.FINGERPRINT_PREFIX)
+        assert migrations.schema_is_current(db, fingerprint)
+        monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [('9999_next', None)])
+        assert not migrations.schema_is_current(db, migrations.schema_fingerprint(db))
+
+
+def test_without_migrate_on_start_init_db_migrates(make_app, legacy_database, caplog):
+    from app import db
+
+    with caplog.at_level(logging.WARNING, logger='migrations'):
+        app = make_app(MIGRATE_ON_START=False)
+    assert 'flask init-db' in caplog.text
+    assert 'title_norm' not in book_columns(app)
+
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    assert 'title_norm' in book_columns(app)
+    with app.app_context():
+        assert migrations.schema_is_current(db, migrations.schema_fingerprint(db))
+
+
+def test_migrate_is_safe_to_repeat(app):
+    result = app.test_cli_runner().invoke(args=['migrate'])
+    assert result.exit_code == 0, result.output
+
+
+def test_seed_leaves_a_catalog_with_books_alone(app):
+    result = app.test_cli_runner().invoke(args=['seed'])
+    assert result.exit_code == 0
+    assert 'already has books' in result.output
+
+
+def test_backfill_commits_in_batches(app):
+    from app import db
+    from models import Book
+
+    seen = []
+
+    def mark(values):
+        seen.append(values['shelf'])
+        return {'publisher': 'Batched'} if values['shelf'] == 'A1' else None
+
+    with app.app_context():
+        total = db.session.query(Book).count()
+        on_a1 = db.session.query(Book).filter_by(shelf='A1').count()
+        assert migrations.backfill(db, Book, ['shelf'], mark, batch_size=2) == on_a1
+        assert len(seen) == total
+        assert db.session.query(Book).filter_by(publisher='Batched').count() == on_a1
+
+
+def test_backfill_writes_each_batch_with_one_statement(app):
+    from app import db
+    from models import Book
+
+    updates = []
+    with app.app_context():
+        total = db.session.query(Book).count()
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, parameters, context, executemany:
+                     updates.append(executemany) if statement.startswith('UPDATE') else None)
+        assert migrations.backfill(db, Book, ['title'], lambda values: {'publisher': 'Batched'},
+                                   batch_size=total) == total
+        assert db.session.query(Book).filter_by(publisher='Batched').count() == total
+    assert updates == [True]
+
+
+def test_sqlite_migrations_wait_for_other_processes(app, database_path):
+    from app import db
+    from models import Book
+
+    done = threading.Event()
+
+    def run():
+        with app.app_context():
+            migrations.migrate(db, Book)
+        done.set()
+
+    # Another process migrating holds the lock
+    with open(str(database_path) + migrations.SQLITE_LOCK_SUFFIX, 'a+b') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        thread = threading.Thread(target=run)
+        thread.start()
+        assert not done.wait(0.3)
+    assert done.wait(5)
+    thread.join()
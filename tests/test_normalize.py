@@ -0,0 +1,65 @@
+"""Searches against the normalized copies of title and author."""
+import pytest
+
+from normalize import normalize_text
+
+
+@pytest.mark.parametrize('value, normalized', [
+    ('Brontë, Charlotte', 'bronte charlotte'),
+    ('  The   HOBBIT ', 'the hobbit'),
+    ('J.R.R. Tolkien', 'j r r tolkien'),
+    ('Straße', 'strasse'),
+    ('snake_case--title', 'snake case title'),
+    (None, None),
+])
+def test_text_is_folded_and_punctuation_collapsed(value, normalized):
+    assert normalize_text(value) == normalized
+
+
+def add_book(app):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        book = Book(title='Villette', author='Brontë, Charlotte', isbn='9780141439884',
+                    shelf='C1', column='1', row='Top')
+        db.session.add(book)
+        db.session.commit()
+        return book.id
+
+
+@pytest.fixture
+def book(app):
+    return add_book(app)
+
+
+def test_inserted_books_are_normalized(app, book):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        stored = db.session.get(Book, book)
+        assert (stored.title_norm, stored.author_norm) == ('villette', 'bronte charlotte')
+
+
+def test_updated_books_are_normalized_again(app, book):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        db.session.get(Book, book).title = 'Shirley!'
+        db.session.commit()
+        assert db.session.get(Book, book).title_norm == 'shirley'
+
+
+@pytest.mark.parametrize('query', ['bronte', 'BRONTË', 'Brontë, Charlotte', 'VILLETTE'])
+def test_searches_ignore_case_accents_and_punctuation(client, book, query):
+    response = client.get('/search', query_string={'query': query})
+    assert b'Villette' in response.data
+
+
+def test_substring_searches_use_the_normalized_columns(make_app):
+    app = make_app(SEARCH_MODE='substring')
+    add_book(app)
+    response = app.test_client().get('/search', query_string={'query': 'RONTË, CHAR'})
+    assert b'Villette' in response.data
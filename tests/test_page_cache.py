@@ -0,0 +1,83 @@
+"""Book pages served from the page cache until the book or its shelf changes."""
+from types import SimpleNamespace
+
+from page_cache import PageCache
+from shelf_browse import neighbors
+
+
+def counts(client):
+    return client.get('/api/stats').get_json()['page_cache']['routes'].get('book_details', {'hits': 0, 'misses': 0})
+
+
+def edit(app, book_id, **values):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        book = db.session.get(Book, book_id)
+        for name, value in values.items():
+            setattr(book, name, value)
+        db.session.commit()
+
+
+def test_repeated_requests_are_served_from_the_cache(client):
+    first = client.get('/book/3')
+    second = client.get('/book/3')
+    assert second.data == first.data
+    assert (counts(client)['hits'], counts(client)['misses']) == (1, 1)
+
+
+def test_an_edited_book_is_rendered_again(app, client):
+    client.get('/book/3')
+    edit(app, 3, title='Gatsby Again')
+    response = client.get('/book/3')
+    assert b'Gatsby Again' in response.data
+    assert counts(client)['misses'] == 2
+
+
+def test_an_edited_shelf_neighbor_is_rendered_again(app, client):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        neighbor = next(book for book in neighbors(Book, db.session.get(Book, 3)) if book is not None)
+    client.get('/book/3')
+    edit(app, neighbor.id, title='A New Neighbor')
+    assert b'A New Neighbor' in client.get('/book/3').data
+
+
+def test_changes_from_other_processes_are_rendered(client, other_process):
+    client.get('/book/3')
+    other_process("UPDATE book SET title = 'Gatsby Revisited', version = version + 1 WHERE id = 3")
+    assert b'Gatsby Revisited' in client.get('/book/3').data
+
+
+def test_missing_books_are_not_cached(client):
+    assert client.get('/book/99999').status_code == 404
+    assert client.get('/book/99999').status_code == 404
+    assert counts(client)['hits'] == 0
+
+
+def test_pages_with_flash_messages_are_not_cached(client):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('info', 'Shelved just now')]
+    assert b'Shelved just now' in client.get('/book/3').data
+    assert b'Shelved just now' not in client.get('/book/3').data
+    assert counts(client)['hits'] == 0
+
+
+def test_only_the_books_of_cached_pages_are_remembered():
+    cache = PageCache(max_size=2)
+    books = [SimpleNamespace(id=book_id, version=1, shelf='A1') for book_id in range(10)]
+    for book in books[:-1]:
+        cache.put('book_details', book, 'page', neighbors=(books[book.id + 1],))
+    # Pages of books 7 and 8, linking 8 and 9
+    assert set(cache.versions) == {7, 8}
+    assert set(cache.shelves) == {7, 8, 9}
+    cache.changed('update', {'id': 2, 'version': 2, 'shelf': 'B1'})
+    assert 2 not in cache.versions and 2 not in cache.shelves
+    assert cache.get('book_details', 8) == 'page'
+    # A linked book moving still renders the page again
+    cache.changed('update', {'id': 9, 'version': 2, 'shelf': 'B1'})
+    assert cache.shelves[9] == 'B1'
+    assert cache.get('book_details', 8) is None
@@ -0,0 +1,49 @@
+"""Keyset-paginated search result pages."""
+import re
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor
+
+BOOK_LINK_RE = re.compile(rb'href="/book/(\d+)"')
+NEXT_LINK_RE = re.compile(rb'href="/search\?[^"]*after=([\w-]+)')
+
+
+@pytest.fixture
+def app(make_app):
+    # Keyset order throughout, without BM25 ranking the first candidates
+    return make_app(SEARCH_RANKING='none', SEARCH_PAGE_SIZE=5)
+
+
+def page(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    token = NEXT_LINK_RE.search(response.data)
+    ids = [int(book_id) for book_id in dict.fromkeys(BOOK_LINK_RE.findall(response.data))]
+    return ids, token.group(1).decode() if token else None
+
+
+def test_pages_follow_each_other_without_gaps_or_repeats(client):
+    pages, token = [], ''
+    while token is not None:
+        ids, token = page(client, f'/search?query=the&after={token}')
+        pages.append(ids)
+    assert [len(ids) for ids in pages] == [5, 5, 3]
+    seen = [book_id for ids in pages for book_id in ids]
+    assert len(set(seen)) == len(seen) == 13
+
+
+def test_total_is_capped(make_app):
+    client = make_app(SEARCH_RANKING='none', SEARCH_COUNT_CAP=4).test_client()
+    assert b'Found 4+ result(s)' in client.get('/search?query=the').data
+
+
+@pytest.mark.parametrize('token', ['not-a-token', encode_cursor({'id': 1}), '%%%'])
+def test_malformed_page_tokens_start_from_the_first_page(client, token):
+    first, _ = page(client, '/search?query=the')
+    assert page(client, f'/search?query=the&after={token}')[0] == first
+
+
+def test_tokens_round_trip():
+    assert decode_cursor(encode_cursor(['the great gatsby', 3])) == ['the great gatsby', 3]
+    assert decode_cursor(None) is None
@@ -0,0 +1,60 @@
+"""Walking routes through the stacks from /api/pick-list."""
+import pytest
+
+from pick_list import MAX_ID
+
+
+def pick(client, **body):
+    response = client.post('/api/pick-list', json=body)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_orders_requested_books_into_a_route(client):
+    response = client.get('/api/pick-list?ids=1,2,3')
+    assert response.status_code == 200
+    route = response.get_json()
+    assert sorted(stop['id'] for stop in route['stops']) == [1, 2, 3]
+    assert [stop['stop'] for stop in route['stops']] == [1, 2, 3]
+    assert route['total_distance'] <= route['unoptimized_distance']
+
+
+def test_books_are_requested_by_isbn(client):
+    route = pick(client, isbns=['978-0-7432-7356-5'], ids=[1])
+    assert 'The Great Gatsby' in [stop['title'] for stop in route['stops']]
+
+
+def test_unknown_books_are_reported_missing(client):
+    route = pick(client, ids=[1, 99999, MAX_ID])
+    assert [stop['id'] for stop in route['stops']] == [1]
+    assert route['missing'] == [99999, MAX_ID]
+
+
+@pytest.mark.parametrize('body, message', [
+    ({'ids': 5}, 'lists'),
+    ({'isbns': '9780743273565'}, 'lists'),
+    ({'ids': [MAX_ID + 1]}, 'Not a book id'),
+    ({'ids': [-MAX_ID - 2]}, 'Not a book id'),
+    ({'ids': [True]}, 'Not a book id'),
+    ({'ids': [1.5]}, 'Not a book id'),
+    ({'ids': [{'id': 1}]}, 'Not a book id'),
+    ({'isbns': ['not an isbn']}, 'Not a book id'),
+    ({}, 'Give the books'),
+])
+def test_bad_bodies_are_rejected(client, body, message):
+    response = client.post('/api/pick-list', json=body)
+    assert response.status_code == 400
+    assert message in response.get_json()['error']
+
+
+def test_bad_query_parameters_are_rejected(client):
+    response = client.get(f'/api/pick-list?ids=1,two,{MAX_ID + 1}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == f"Not a book id or ISBN: two, {MAX_ID + 1}"
+
+
+def test_batches_are_limited(make_app):
+    client = make_app(PICK_LIST_MAX_STOPS=2).test_client()
+    response = client.get('/api/pick-list?ids=1,2,3')
+    assert response.status_code == 400
+    assert 'at most 2' in response.get_json()['error']
@@ -0,0 +1,57 @@
+"""List views read only the columns their cards show."""
+import pytest
+from sqlalchemy import event
+
+import projection
+from lazy_index import warm_up
+
+
+@pytest.fixture
+def statements(app):
+    from app import db
+
+    # Building the BM25 statistics reads every description; do that first
+    warm_up(app)
+    seen = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: seen.append(statement))
+    return seen
+
+
+@pytest.mark.parametrize('url', [
+    '/search?query=orwell',
+    '/search?query=the',
+    '/search?query=tokkein',
+    '/shelf/A1',
+    '/api/shelf/A1',
+])
+def test_list_views_skip_the_unlisted_columns(client, statements, url):
+    assert client.get(url).status_code == 200
+    selects = [statement for statement in statements if statement.lstrip().startswith('SELECT')]
+    assert selects
+    for column in ('description', 'publisher', 'date_added'):
+        assert not [statement for statement in selects if column in statement], column
+
+
+def test_the_details_page_reads_the_whole_book(client, statements):
+    response = client.get('/book/3')
+    assert response.status_code == 200
+    assert any('description' in statement for statement in statements)
+
+
+def test_summaries_keep_the_order_of_their_ids(app):
+    from app import db
+    from models import Book
+
+    make_summary = projection.summary_factory(Book)
+    with app.app_context():
+        rows = db.session.execute(projection.summaries_by_id(Book, [3, 1, 2])).all()
+    summaries = [make_summary(row) for row in rows]
+    assert [summary.id for summary in summaries] == [3, 1, 2]
+    gatsby = summaries[0]
+    assert gatsby.title == 'The Great Gatsby'
+    assert gatsby.status_display == 'Issued'
+    assert gatsby.location_display.startswith('Shelf A1, Column ')
+    with pytest.raises(AttributeError):
+        gatsby.description
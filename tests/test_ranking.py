@@ -0,0 +1,136 @@
+"""BM25 ranking of search results and paging through the ranked order."""
+import re
+import threading
+
+from lazy_index import warm_up
+from ranking import Bm25Ranker, Bm25Stats, catalog_fingerprint
+
+BOOK_LINK_RE = re.compile(rb'href="/book/(\d+)"')
+NEXT_LINK_RE = re.compile(rb'href="/search\?[^"]*after=([\w-]+)')
+
+
+def result_pages(client, query):
+    """Yield the book ids of each page of a search, following the next-page links."""
+    url = f'/search?query={query}'
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        yield [int(book_id) for book_id in dict.fromkeys(BOOK_LINK_RE.findall(response.data))]
+        token = NEXT_LINK_RE.search(response.data)
+        url = f'/search?query={query}&after={token.group(1).decode()}' if token else None
+
+
+def ranked_client(make_app, **settings):
+    """A client of an app whose BM25 statistics are loaded."""
+    app = make_app(**settings)
+    warm_up(app)
+    return app.test_client()
+
+
+def all_results(make_app, query, **settings):
+    return next(result_pages(ranked_client(make_app, SEARCH_PAGE_SIZE=100, **settings), query))
+
+
+def test_pages_follow_the_ranked_order(make_app):
+    ranked = all_results(make_app, 'the')
+    client = ranked_client(make_app, SEARCH_PAGE_SIZE=2)
+    assert [book_id for page in result_pages(client, 'the') for book_id in page] == ranked
+
+
+def test_pages_continue_past_the_ranked_candidates(make_app):
+    ranked = all_results(make_app, 'the', BM25_CANDIDATE_LIMIT=3)
+    for page_size in (2, 3, 4):
+        client = ranked_client(make_app, SEARCH_PAGE_SIZE=page_size, BM25_CANDIDATE_LIMIT=3)
+        pages = list(result_pages(client, 'the'))
+        assert [book_id for page in pages for book_id in page] == ranked
+        assert all(pages)
+
+
+def test_later_pages_reuse_the_ranking(make_app):
+    app = make_app(SEARCH_PAGE_SIZE=2)
+    warm_up(app)
+    ranker = app.extensions['bm25_ranker']
+    calls = []
+    rank = ranker.rank
+    ranker.rank = lambda ids, query: calls.append(query) or rank(ids, query)
+    assert len(list(result_pages(app.test_client(), 'the'))) > 2
+    assert calls == ['the']
+
+
+def test_edits_change_the_fingerprint(app):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        before = catalog_fingerprint(db, Book)
+        db.session.get(Book, 1).title = 'Retitled'
+        db.session.commit()
+        assert catalog_fingerprint(db, Book) != before
+
+
+def test_stale_statistics_are_rebuilt_in_the_background(app):
+    from app import db
+    from models import Book
+
+    warm_up(app)
+    ranker = app.extensions['bm25_ranker']
+    ranker.rebuild_interval = 0
+    with app.app_context():
+        db.session.add(Book(title='Middlemarch', author='George Eliot', isbn='9780141439549',
+                            shelf='F1', column='1', row='Top'))
+        db.session.commit()
+        book_id = Book.query.filter_by(title='Middlemarch').one().id
+    assert book_id not in ranker.stats.doc_ids
+    app.test_client().get('/search?query=middlemarch')
+    ranker.wait()
+    assert book_id in ranker.stats.doc_ids
+
+
+def test_old_statistics_serve_during_a_rebuild():
+    old = Bm25Stats.build([(1, 'Emma', 'Jane Austen', None, None)], (1, 1, 0))
+    new = Bm25Stats.build([(1, 'Emma', 'Jane Austen', None, None),
+                           (2, 'Persuasion', 'Jane Austen', None, None)], (2, 2, 1))
+    release = threading.Event()
+
+    def loader():
+        release.wait(5)
+        return new
+
+    ranker = Bm25Ranker(old, loader=loader, rebuild_interval=0)
+    ranker.mark_stale()
+    assert ranker.scores([2], 'persuasion')[0] == 0
+    assert ranker.stats is old
+    release.set()
+    ranker.wait()
+    assert ranker.stats is new
+    assert ranker.scores([2], 'persuasion')[0] > 0
+
+
+def test_candidates_are_the_engines_best_matches(make_app):
+    from app import db
+    from models import Book
+
+    # Only one candidate is ranked; it must be the book that matches best, not the lowest id
+    app = make_app(BM25_CANDIDATE_LIMIT=1)
+    warm_up(app)
+    with app.app_context():
+        db.session.add(Book(title='Orwell Orwell Orwell', author='George Orwell', isbn='9780141439549',
+                            shelf='F1', column='1', row='Top'))
+        db.session.commit()
+        best = Book.query.filter_by(title='Orwell Orwell Orwell').one().id
+    assert next(result_pages(app.test_client(), 'orwell'))[0] == best
+
+
+def test_the_first_search_does_not_wait_for_the_statistics(app, client, monkeypatch):
+    ranker = app.extensions['bm25_ranker']
+    release = threading.Event()
+    build = ranker._build
+    monkeypatch.setattr(ranker, '_build', lambda index: release.wait(5) and build(index))
+    response = client.get('/search?query=orwell')
+    assert response.status_code == 200
+    assert b'Animal Farm' in response.data
+    assert not ranker.loaded
+    release.set()
+    ranker.ready()
+    ranker._builder.join(5)
+    assert ranker.loaded
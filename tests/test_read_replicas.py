@@ -0,0 +1,67 @@
+"""Read-only requests routed to a read replica, and everything else to the primary."""
+import sqlite3
+import time
+from contextlib import closing
+
+import pytest
+
+from read_replicas import PRIMARY_UNTIL_KEY
+
+
+@pytest.fixture
+def replica_path(tmp_path, make_app, database_path):
+    """A copy of the seeded catalog where book 3 has a title the primary doesn't."""
+    make_app()
+    path = tmp_path / 'replica.db'
+    with closing(sqlite3.connect(database_path)) as primary, closing(sqlite3.connect(path)) as replica:
+        primary.backup(replica)
+        with replica:
+            replica.execute("UPDATE book SET title = 'Replica Gatsby' WHERE id = 3")
+    return path
+
+
+@pytest.fixture
+def app(make_app, replica_path):
+    return make_app(DATABASE_READ_URLS=f"sqlite:///{replica_path}")
+
+
+def pick_title(response):
+    return response.get_json()['stops'][0]['title']
+
+
+def test_reads_go_to_the_replica(client):
+    assert b'Replica Gatsby' in client.get('/book/3').data
+    assert pick_title(client.get('/api/pick-list?ids=3')) == 'Replica Gatsby'
+    replicas = client.get('/api/stats').get_json()['read_replicas']
+    assert [(replica['bind'], replica['healthy']) for replica in replicas] == [('replica_0', True)]
+    assert replicas[0]['reads'] >= 2
+
+
+def test_other_methods_go_to_the_primary(client):
+    assert pick_title(client.post('/api/pick-list', json={'ids': [3]})) == 'The Great Gatsby'
+
+
+def test_clients_that_just_wrote_read_from_the_primary(client):
+    with client.session_transaction() as session:
+        session[PRIMARY_UNTIL_KEY] = time.time() + 60
+    assert pick_title(client.get('/api/pick-list?ids=3')) == 'The Great Gatsby'
+    with client.session_transaction() as session:
+        session[PRIMARY_UNTIL_KEY] = time.time() - 1
+    assert pick_title(client.get('/api/pick-list?ids=3')) == 'Replica Gatsby'
+
+
+def test_an_unreachable_replica_is_taken_out_of_rotation(make_app, tmp_path):
+    # Starting up on a new database doesn't touch the replica
+    app = make_app(DATABASE_READ_URLS=f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    router = app.extensions['read_replicas']
+    with app.app_context():
+        router.check()
+    assert not router.replicas[0].healthy
+    assert router.replicas[0].error
+    assert pick_title(app.test_client().get('/api/pick-list?ids=3')) == 'The Great Gatsby'
+
+
+def test_without_replicas_every_read_goes_to_the_primary(make_app):
+    client = make_app().test_client()
+    assert 'read_replicas' not in client.application.extensions
+    assert client.get('/api/stats').get_json()['read_replicas'] == []
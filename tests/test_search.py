@@ -0,0 +1,68 @@
+"""Full-text search through the /search page."""
+
+
+def test_search_finds_words_of_title_and_author(client):
+    response = client.get('/search?query=orwell')
+    assert response.status_code == 200
+    assert b'1984' in response.data
+    assert b'Animal Farm' in response.data
+
+
+def test_search_matches_partly_typed_words(client):
+    response = client.get('/search?query=gats')
+    assert b'The Great Gatsby' in response.data
+
+
+def test_search_requires_every_word(client):
+    response = client.get('/search?query=tolstoy+peace')
+    assert b'War and Peace' in response.data
+    assert b'Anna Karenina' not in response.data
+
+
+def test_search_form_is_posted(client):
+    response = client.post('/search', data={'query': 'hobbit'})
+    assert response.status_code == 200
+    assert b'The Hobbit' in response.data
+
+
+def test_search_without_query_redirects_home(client):
+    response = client.get('/search')
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/')
+
+
+def test_search_punctuation_only_finds_nothing(client):
+    response = client.get('/search?query=%22%2A%28')
+    assert response.status_code == 200
+    assert b'Found 0 result(s)' in response.data
+
+
+def test_search_wildcards_match_literally(client):
+    for query in ('%25', '_', '%25_%25'):
+        response = client.get(f'/search?query={query}')
+        assert b'Found 0 result(s)' in response.data
+
+
+def like_titles(app, query):
+    from app import db
+    from models import Book
+    from search_engine import SearchEngine
+
+    with app.app_context():
+        return {book.title for book in SearchEngine(db, Book).search(query)}
+
+
+def test_like_search_matches_typed_isbns(app):
+    assert like_titles(app, '978-0-7432-7356-5') == {'The Great Gatsby'}
+    assert like_titles(app, '%') == set()
+    assert like_titles(app, '0_4') == set()
+
+
+def test_like_search_skips_isbns_for_queries_without_digits(app):
+    from models import Book
+    from search_engine import SearchEngine
+
+    with app.app_context():
+        assert 'isbn' not in str(SearchEngine(None, Book).like_criterion('orwell'))
+        assert 'isbn' in str(SearchEngine(None, Book).like_criterion('0451'))
+    assert like_titles(app, 'orwell') == {'1984', 'Animal Farm'}
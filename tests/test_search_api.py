@@ -0,0 +1,45 @@
+"""Streaming search results from /api/search."""
+import json
+
+import pytest
+
+
+def records(response):
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.data.splitlines()]
+
+
+def test_streams_ndjson_records(client):
+    response = client.get('/api/search?query=orwell')
+    assert response.mimetype == 'application/x-ndjson'
+    assert {record['title'] for record in records(response)} == {'1984', 'Animal Farm'}
+
+
+def test_streams_a_json_array_of_chosen_fields(client):
+    response = client.get('/api/search?query=hobbit&format=json&fields=title,shelf')
+    assert response.status_code == 200
+    assert response.get_json() == {'results': [{'title': 'The Hobbit', 'shelf': 'A2'}]}
+
+
+def test_limit_caps_the_matches(client):
+    assert len(records(client.get('/api/search?query=the&limit=2'))) == 2
+
+
+def test_limit_defaults_to_the_configured_maximum(make_app):
+    client = make_app(SEARCH_API_MAX_LIMIT=3).test_client()
+    assert len(records(client.get('/api/search?query=the'))) == 3
+
+
+@pytest.mark.parametrize('limit', ['-1', '0', '4', 'ten', '1.5'])
+def test_limit_outside_the_allowed_range_is_rejected(make_app, limit):
+    client = make_app(SEARCH_API_MAX_LIMIT=3).test_client()
+    response = client.get(f'/api/search?query=the&limit={limit}')
+    assert response.status_code == 400
+    assert 'from 1 to 3' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('query', ['', 'query=the&fields=title,password', 'query=the&format=xml'])
+def test_bad_requests_are_rejected(client, query):
+    response = client.get(f'/api/search?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,59 @@
+"""Search result pages served from the search cache until the catalog changes."""
+from search_cache import SearchCache
+
+
+def stats(client):
+    return client.get('/api/stats').get_json()['search_cache']
+
+
+def test_repeated_searches_are_served_from_the_cache(client):
+    first = client.get('/search?query=orwell')
+    misses = stats(client)['misses']
+    second = client.get('/search?query=orwell')
+    assert second.data == first.data
+    assert stats(client)['misses'] == misses
+    # The results page and its facet counts
+    assert stats(client)['hits'] == 2
+
+
+def test_queries_differing_in_case_and_spacing_share_an_entry(client):
+    client.get('/search?query=george orwell')
+    client.get('/search?query=  George   ORWELL ')
+    assert stats(client)['hits'] == 2
+
+
+def test_a_commit_clears_the_cache(app, client):
+    from app import db
+    from models import Book
+
+    client.get('/search?query=gatsby')
+    with app.app_context():
+        db.session.get(Book, 3).title = 'Gatsby Again'
+        db.session.commit()
+    assert stats(client)['size'] == 0
+    assert stats(client)['invalidations'] >= 1
+    assert b'Gatsby Again' in client.get('/search?query=gatsby').data
+
+
+def test_the_least_recently_used_entries_are_evicted(make_app):
+    client = make_app(SEARCH_CACHE_SIZE=2).test_client()
+    client.get('/search?query=orwell')
+    client.get('/search?query=tolkien')
+    assert stats(client)['size'] == 2
+    assert stats(client)['evictions'] == 2
+
+
+def test_expired_entries_are_computed_again(make_app):
+    client = make_app(SEARCH_CACHE_TTL=0).test_client()
+    client.get('/search?query=orwell')
+    client.get('/search?query=orwell')
+    assert stats(client)['hits'] == 0
+
+
+def test_lookups_refresh_an_entry():
+    cache = SearchCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
@@ -0,0 +1,81 @@
+"""Browsing a shelf in physical order, and stepping along it from a book's page."""
+import pytest
+
+
+def shelf_order(app, shelf):
+    """Return the ids on a shelf ordered by column, row and id, read straight from the table."""
+    from models import Book
+
+    with app.app_context():
+        books = Book.query.filter_by(shelf=shelf).all()
+    return [book.id for book in sorted(books, key=lambda book: (book.column, book.row, book.id))]
+
+
+def walk(client, url):
+    """Follow a shelf listing's page tokens to the end; return the ids and the pages read."""
+    ids, pages = [], 0
+    after = ''
+    while True:
+        payload = client.get(f"{url}&after={after}" if after else url).get_json()
+        ids += [book['id'] for book in payload['results']]
+        pages += 1
+        after = payload['next']
+        if not after:
+            return ids, pages
+
+
+def test_books_are_listed_in_physical_order(app, client):
+    payload = client.get('/api/shelf/A1').get_json()
+    assert payload['shelf'] == 'A1'
+    assert [book['id'] for book in payload['results']] == shelf_order(app, 'A1')
+    assert payload['total'] == len(payload['results'])
+    assert sum(entry['count'] for entry in payload['columns']) == payload['total']
+    assert 3 in [book['id'] for book in payload['results']]
+
+
+def test_a_column_narrows_the_listing(client):
+    payload = client.get('/api/shelf/A1').get_json()
+    columns = {entry['column']: entry['count'] for entry in payload['columns']}
+    column, count = next(iter(columns.items()))
+    narrowed = client.get(f'/api/shelf/A1?column={column}').get_json()
+    assert narrowed['column'] == column
+    assert narrowed['total'] == count
+    assert {book['column'] for book in narrowed['results']} == {column}
+    # The column counts still cover the whole shelf
+    assert narrowed['columns'] == payload['columns']
+
+
+def test_page_tokens_walk_the_whole_shelf(app, client):
+    expected = shelf_order(app, 'A1')
+    assert len(expected) > 2
+    ids, pages = walk(client, '/api/shelf/A1?limit=2')
+    assert ids == expected
+    assert pages == (len(expected) + 1) // 2
+
+
+def test_an_unknown_shelf_is_empty(client):
+    response = client.get('/api/shelf/Z9')
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert (payload['total'], payload['results'], payload['columns'], payload['next']) == (0, [], [], None)
+
+
+def test_the_shelf_page_lists_its_books(client):
+    response = client.get('/shelf/A1')
+    assert response.status_code == 200
+    assert b'The Great Gatsby' in response.data
+    assert b'Shelf A1' in response.data
+
+
+@pytest.mark.parametrize('position', ['first', 'middle', 'last'])
+def test_the_book_page_links_its_shelf_neighbors(app, client, position):
+    order = shelf_order(app, 'A1')
+    index = {'first': 0, 'middle': len(order) // 2, 'last': len(order) - 1}[position]
+    page = client.get(f'/book/{order[index]}').data.decode()
+    previous_link = f'href="/book/{order[index - 1]}"' if index > 0 else None
+    next_link = f'href="/book/{order[index + 1]}"' if index < len(order) - 1 else None
+    assert ('Previous on shelf' in page) == (previous_link is not None)
+    assert ('Next on shelf' in page) == (next_link is not None)
+    for link in (previous_link, next_link):
+        if link is not None:
+            assert link in page
@@ -0,0 +1,146 @@
+"""Identical concurrent searches sharing one execution."""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pagination
+import projection
+from single_flight import SingleFlight
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_concurrent_identical_searches_run_once(app, monkeypatch):
+    engine = app.extensions['search_engine']
+    flight = app.extensions['single_flight']
+    release = threading.Event()
+    paginate = engine.paginate
+    calls = []
+
+    def slow_paginate(*args, **kwargs):
+        calls.append(args)
+        release.wait(5)
+        return paginate(*args, **kwargs)
+
+    monkeypatch.setattr(engine, 'paginate', slow_paginate)
+
+    def search(_):
+        response = app.test_client().get('/search?query=orwell')
+        return response.status_code, b'Animal Farm' in response.data
+
+    with ThreadPoolExecutor(4) as pool:
+        results = pool.map(search, range(4))
+        wait_for(lambda: flight.coalesced == 3)
+        release.set()
+        assert list(results) == [(200, True)] * 4
+
+    assert len(calls) == 1
+    stats = app.test_client().get('/api/stats').get_json()['single_flight']
+    assert stats['coalesced'] >= 3
+
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError('database unavailable')
+
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(flight.do, 'key', fail) for _ in range(3)]
+        wait_for(lambda: flight.coalesced == 2)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert flight.executions == 1
+
+
+def test_workers_share_results_through_the_lock_dir(tmp_path):
+    # Two SingleFlights stand for two worker processes
+    leader, follower = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+
+    def search():
+        started.set()
+        release.wait(5)
+        return {'status': [['available', 2]]}
+
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(leader.do, 'key', search)
+        started.wait(5)
+        second = pool.submit(follower.do, 'key', lambda: {'computed': 'again'})
+        time.sleep(0.1)
+        release.set()
+        assert first.result() == second.result() == {'status': [['available', 2]]}
+    assert (leader.executions, follower.executions, follower.shared) == (1, 0, 1)
+    # Shared as JSON, which reading back can't run code from
+    [result] = tmp_path.glob('*.result')
+    assert json.loads(result.read_text())['result'] == {'value': {'status': [['available', 2]]}}
+
+
+def test_pages_are_shared_as_summaries(tmp_path):
+    from models import Book
+
+    leader, follower = SingleFlight(str(tmp_path), model=Book), SingleFlight(str(tmp_path), model=Book)
+    make_summary = projection.summary_factory(Book)
+    gatsby = make_summary((3, 'The Great Gatsby', 'F. Scott Fitzgerald', 'issued', 'A1', '2', 'Top', '9780743273565'))
+    page = pagination.Page([gatsby], 'token', 1, False)
+    leader._write_result(str(tmp_path / 'page.result'), 'key', page)
+
+    shared = follower._read_result(str(tmp_path / 'page.result'), 'key', 0)
+    assert (shared.next_token, shared.total, shared.total_capped) == ('token', 1, False)
+    [book] = shared.items
+    assert isinstance(book, projection.BookSummary)
+    assert (book.id, book.title, book.status_display) == (3, 'The Great Gatsby', 'Issued')
+    assert follower._read_result(str(tmp_path / 'page.result'), 'other key', 0) is None
+
+
+def test_unrelated_searches_do_not_wait_for_each_other(tmp_path):
+    busy, other = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path), wait_timeout=5)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return {}
+
+    with ThreadPoolExecutor(1) as pool:
+        running = pool.submit(busy.do, 'key', slow)
+        started.wait(5)
+        start = time.monotonic()
+        # Found in a stripe shared with "key" when lock files were striped
+        for n in range(100):
+            assert other.do(f'other {n}', lambda: {'n': n}) == {'n': n}
+        assert time.monotonic() - start < 1
+        release.set()
+        running.result()
+
+
+def test_a_hung_search_holds_other_workers_up_to_the_timeout(tmp_path):
+    hung, waiting = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path), wait_timeout=0.2)
+    started, release = threading.Event(), threading.Event()
+
+    def hang():
+        started.set()
+        release.wait(5)
+        return {}
+
+    with ThreadPoolExecutor(1) as pool:
+        running = pool.submit(hung.do, 'key', hang)
+        started.wait(5)
+        start = time.monotonic()
+        assert waiting.do('key', lambda: {'ran': 'here'}) == {'ran': 'here'}
+        assert time.monotonic() - start < 2
+        release.set()
+        running.result()
+    assert (waiting.executions, waiting.timeouts) == (1, 1)
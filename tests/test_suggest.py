@@ -0,0 +1,131 @@
+"""Search-box completions from /api/suggest."""
+import random
+
+from suggest import MAX_SUGGESTIONS, PrefixIndex
+
+
+def suggestions(client, query):
+    response = client.get(f'/api/suggest?{query}')
+    assert response.status_code == 200
+    return [(item['type'], item['text']) for item in response.get_json()['suggestions']]
+
+
+def test_completes_authors_and_titles(client):
+    assert ('author', 'George Orwell') in suggestions(client, 'prefix=geo')
+    assert ('title', 'The Hobbit') in suggestions(client, 'prefix=hob')
+
+
+def test_completes_any_word_of_a_title(client):
+    assert suggestions(client, 'prefix=gats') == [('title', 'The Great Gatsby')]
+
+
+def test_authors_of_several_books_rank_first(client):
+    assert suggestions(client, 'prefix=j')[0] == ('author', 'J.R.R. Tolkien')
+
+
+def test_searched_terms_rank_first(client):
+    assert suggestions(client, 'prefix=the&limit=1') != [('title', 'The Odyssey')]
+    client.get('/search?query=The+Odyssey')
+    assert suggestions(client, 'prefix=the&limit=1') == [('title', 'The Odyssey')]
+
+
+def test_limit_is_clamped(client):
+    assert len(suggestions(client, 'prefix=the&limit=2')) == 2
+    assert len(suggestions(client, 'prefix=the&limit=-3')) == 1
+    assert len(suggestions(client, 'prefix=t&limit=500')) <= 50
+
+
+def test_empty_prefix_has_no_completions(client):
+    assert suggestions(client, 'prefix=') == []
+
+
+def test_new_books_are_suggested_once_committed(app, client):
+    from app import db
+    from models import Book
+
+    with app.app_context():
+        db.session.add(Book(title='Middlemarch', author='George Eliot', isbn='9780141439549',
+                            shelf='F1', column='1', row='Top'))
+        db.session.commit()
+    assert ('title', 'Middlemarch') in suggestions(client, 'prefix=middle')
+
+
+def test_ranks_every_term_under_a_prefix():
+    index = PrefixIndex()
+    index.add_books((book_id, f'A{book_id:05d}', None) for book_id in range(5000))
+    # Alphabetically last under "a", but on the most books
+    index.add_books((book_id, 'Azure', None) for book_id in range(5000, 5003))
+    assert index.suggest('a', 1) == [('title', 'Azure')]
+
+
+def test_bulk_and_single_adds_agree():
+    rows = [(1, 'The Hobbit', 'J.R.R. Tolkien'), (2, 'The Lord of the Rings', 'J.R.R. Tolkien'),
+            (3, 'The Odyssey', 'Homer')]
+    bulk, single = PrefixIndex(), PrefixIndex()
+    bulk.add_books(rows)
+    for book_id, *values in rows:
+        single.add_book(book_id, values)
+    for prefix in ('t', 'the', 'j', 'lord', 'rings', 'homer', 'x'):
+        assert bulk.suggest(prefix, 10) == single.suggest(prefix, 10)
+
+
+def test_changes_reach_cached_prefixes():
+    index = PrefixIndex()
+    index.add_books([(1, 'Emma', 'Jane Austen')])
+    assert index.suggest('e') == [('title', 'Emma')]
+    index.add_book(2, ('Eclipse', None))
+    assert index.suggest('e') == [('title', 'Eclipse'), ('title', 'Emma')]
+    index.remove_book(1)
+    assert index.suggest('e') == [('title', 'Eclipse')]
+
+
+def test_short_prefixes_are_ranked_when_built(monkeypatch):
+    index = PrefixIndex()
+    index.add_books((book_id, f'A{book_id:05d}', None) for book_id in range(5000))
+    index.add_books((book_id, 'Azure', None) for book_id in range(5000, 5003))
+
+    def scan(prefix):
+        raise AssertionError(f"{prefix!r} ranked on request")
+
+    monkeypatch.setattr(index, '_terms_under', scan)
+    assert index.suggest('a', 1) == [('title', 'Azure')]
+    assert index.suggest('a0', 1) == [('title', 'A00000')]
+    # A search moves the term within the kept lists, which aren't ranked again
+    index.record_search('A04321')
+    assert index.suggest('a', 2) == [('title', 'A04321'), ('title', 'Azure')]
+    assert index.suggest('a04', 1) == [('title', 'A04321')]
+
+
+def test_kept_lists_match_ranking_every_term():
+    rng = random.Random(7)
+    # Enough titles that the kept lists of the short prefixes hold only the best
+    words = ['a', 'ab', 'abc', 'abd', 'abe', 'abcd', 'abcde', 'ac', 'b', 'ba', 'bab', 'bac', 'c', 'ca']
+    index = PrefixIndex()
+    index.add_books((book_id, ' '.join(rng.sample(words, 2)), rng.choice(words)) for book_id in range(300))
+    books = set(range(300))
+    prefixes = ('a', 'ab', 'abc', 'abcd', 'b', 'ba', 'c', 'd')
+    for prefix in prefixes:
+        index.suggest(prefix)
+    for step in range(400):
+        action = rng.random()
+        if action < 0.4:
+            book_id = rng.choice(sorted(books))
+            index.remove_book(book_id)
+            books.discard(book_id)
+        elif action < 0.7:
+            book_id = 1000 + step
+            index.add_book(book_id, (' '.join(rng.sample(words, 2)), rng.choice(words)))
+            books.add(book_id)
+        else:
+            index.record_search(' '.join(rng.sample(words, 2)))
+        for prefix in prefixes:
+            expected = sorted(index._terms_under(prefix), key=index._rank_key)[:MAX_SUGGESTIONS]
+            assert index.suggest(prefix, MAX_SUGGESTIONS) == expected, (step, prefix)
+
+
+def test_prefixes_are_ranked_again_when_removals_empty_their_lists():
+    index = PrefixIndex()
+    index.add_books((book_id, f'A{book_id:03d}', None) for book_id in range(150))
+    for book_id in range(120):
+        index.remove_book(book_id)
+    assert index.suggest('a', 3) == [('title', 'A120'), ('title', 'A121'), ('title', 'A122')]
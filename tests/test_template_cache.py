@@ -0,0 +1,32 @@
+"""Compiled templates shared through the bytecode cache."""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from lazy_index import warm_up
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_warm_up_compiles_every_template_into_the_cache(make_app, tmp_path):
+    cache_dir = tmp_path / 'jinja'
+    app = make_app(TEMPLATE_CACHE_DIR=str(cache_dir))
+    assert os.listdir(cache_dir) == []
+    warm_up(app)
+    assert len(os.listdir(cache_dir)) == len(list(ROOT.glob('*.html')))
+
+
+def test_asgi_templates_share_the_apps_bytecode_cache(tmp_path):
+    env = {
+        **os.environ,
+        'DATABASE_URL': f"sqlite:///{tmp_path / 'library.db'}",
+        'BM25_STATS_PATH': str(tmp_path / 'bm25_stats.pickle'),
+        'TEMPLATE_CACHE_DIR': str(tmp_path / 'jinja'),
+    }
+    # asgi.py wraps the app app.py builds at import, from the environment
+    subprocess.run(
+        [sys.executable, '-c', "import asgi; "
+         "assert asgi.templates.bytecode_cache is asgi.flask_app.jinja_env.bytecode_cache is not None"],
+        cwd=ROOT, env=env, check=True, capture_output=True
+    )